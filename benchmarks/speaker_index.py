@@ -0,0 +1,146 @@
+"""Benchmark of the voice print speaker index for large user populations.
+
+Generates synthetic voice prints for increasing numbers of users and compares the approximate nearest neighbour index
+with an exhaustive search on lookup latency and recall, alongside the cost of building the index and of enrolling and
+removing users. Runs offline, without TensorFlow.
+
+Usage (from the project root):
+    python -m benchmarks.speaker_index --users 100 1000 5000 10000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import src.voice.SpeakerIndex as SpeakerIndex
+
+embedding_size = 40
+"""int: Size of the synthetic voice embeddings, being the width of the last hidden layer of the voice model"""
+voice_types = 32
+"""int: Number of clusters the synthetic voice prints are drawn around, as voices are not uniformly spread"""
+
+
+def synthetic_prints(rng, users):
+    """Method draws voice prints clustered around voice types, non-negative like the ReLU embeddings they model
+
+    Args:
+        rng (Generator): Random number generator
+        users (int): Number of users
+
+    Returns:
+        A (users, embedding_size) float32 array of unit voice prints
+    """
+    types = np.abs(rng.normal(0, 1, (voice_types, embedding_size)))
+    prints = types[rng.integers(voice_types, size=users)] + np.abs(rng.normal(0, 0.5, (users, embedding_size)))
+    return SpeakerIndex.unit(prints)
+
+
+def exhaustive_search(queries, names, prints):
+    """Method finds the closest voice print of every query by comparing it with every voice print"""
+    similarity = queries @ prints.T
+    best = np.argmax(similarity, axis=1)
+    return names[best], similarity[np.arange(len(best)), best]
+
+
+def timed(function, *args):
+    """Method times a single call
+
+    Returns:
+        The result of the call and its latency (s)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run_population(rng, users, queries, batch, updates):
+    """Method benchmarks the index and the exhaustive search for one number of users
+
+    Args:
+        rng (Generator): Random number generator
+        users (int): Number of users
+        queries (int): Number of identification queries
+        batch (int): Number of queries per lookup
+        updates (int): Number of users enrolled and removed
+
+    Returns:
+        A dictionary of the index build time, lookup latencies, recall and update latencies
+    """
+    names = np.array([f'user_{i}' for i in range(users)], dtype=object)
+    prints = synthetic_prints(rng, users)
+    speakers = rng.integers(users, size=queries)
+    utterances = SpeakerIndex.unit(prints[speakers] + rng.normal(0, 0.05, (queries, embedding_size)))
+
+    index, build_time = timed(SpeakerIndex.SpeakerIndex.build, names, prints)
+    results = {'users': users, 'lists': len(index.lists), 'build_ms': build_time * 1e3}
+    for name, search in (('exhaustive', lambda q: exhaustive_search(q, names, prints)), ('index', index.search)):
+        found, latencies = [], []
+        for start in range(0, queries, batch):
+            (batch_names, _), latency = timed(search, utterances[start:start + batch])
+            found.append(batch_names)
+            latencies.append(latency / len(batch_names))
+        results[name + '_p50_us'] = float(np.percentile(latencies, 50) * 1e6)
+        results[name + '_found'] = np.concatenate(found)
+    results['recall'] = float(np.mean(results.pop('index_found') == results['exhaustive_found']))
+    results['accuracy'] = float(np.mean(results.pop('exhaustive_found') == names[speakers]))
+    results['speedup'] = results['exhaustive_p50_us'] / results['index_p50_us']
+
+    new_prints = synthetic_prints(rng, updates)
+    insert_latencies, remove_latencies = [], []
+    for i in range(updates):
+        index, latency = timed(index.inserted, f'new_user_{i}', new_prints[i])
+        insert_latencies.append(latency)
+    for i in range(updates):
+        index, latency = timed(index.removed, f'new_user_{i}')
+        remove_latencies.append(latency)
+    results['insert_p50_us'] = float(np.percentile(insert_latencies, 50) * 1e6)
+    results['remove_p50_us'] = float(np.percentile(remove_latencies, 50) * 1e6)
+    return results
+
+
+def print_results(results):
+    """Method prints the results of every number of users"""
+    print(f"{'users':>8}{'lists':>7}{'build ms':>10}{'exact us':>10}{'index us':>10}{'speedup':>9}{'recall':>8}"
+          f"{'accuracy':>10}{'insert us':>11}{'remove us':>11}")
+    for row in results:
+        print(f"{row['users']:>8}{row['lists']:>7}{row['build_ms']:>10.1f}{row['exhaustive_p50_us']:>10.1f}"
+              f"{row['index_p50_us']:>10.1f}{row['speedup']:>9.1f}{row['recall']:>8.3f}{row['accuracy']:>10.3f}"
+              f"{row['insert_p50_us']:>11.1f}{row['remove_p50_us']:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the voice print speaker index on synthetic users')
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 5000, 10000], help='numbers of users')
+    parser.add_argument('--queries', type=int, default=2000, help='identification queries per number of users')
+    parser.add_argument('--batch', type=int, default=1, help='queries per lookup')
+    parser.add_argument('--updates', type=int, default=100, help='users enrolled and removed')
+    parser.add_argument('--probes', type=int, default=SpeakerIndex.search_probes, help='lists searched per query')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic voice prints')
+    parser.add_argument('--output', default='bench_results', help='folder the JSON results are written to')
+    args = parser.parse_args()
+
+    SpeakerIndex.search_probes = args.probes
+    rng = np.random.default_rng(args.seed)
+    results = [run_population(rng, users, args.queries, args.batch, args.updates) for users in args.users]
+    print_results(results)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    os.makedirs(args.output, exist_ok=True)
+    output_file = f"{args.output}/speaker_index_{timestamp.replace(':', '')}_{commit or 'nocommit'}.json"
+    with open(output_file, 'w') as f:
+        json.dump({'commit': commit, 'timestamp': timestamp, 'cpus': os.cpu_count(),
+                   'config': {**vars(args), 'embedding_size': embedding_size}, 'results': results}, f, indent=2)
+    print(f"Results written to {output_file}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""Benchmark suite for the voice identification pipeline.
+
+Generates a synthetic corpus of speakers under a temporary project root, times every stage of the voice pipeline and
+saves the results as JSON, so runs can be compared across commits. Runs offline and on CPU only.
+
+Usage (from the project root):
+    python -m benchmarks.voice_pipeline --recordings 200 --speakers 4
+    python -m benchmarks.voice_pipeline --compare bench_results/<earlier run>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timedelta
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '')  # CPU only, set before TensorFlow can be imported
+
+import numpy as np
+import pandas as pd
+
+import src.voice.AudioStoreDatabase as AudioStoreDatabase
+import src.voice.FeatureStore as FeatureStore
+import src.voice.PackedCorpus as PackedCorpus
+import src.voice.UserStore as UserStore
+import src.voice.VoiceModel as vm
+import src.voice.VoiceStorage as VoiceStorage
+
+capture_rate = 16000
+"""int: Sample rate of the synthetic recordings, a common microphone capture rate"""
+
+
+def synthetic_voice(rng, fundamental, seconds, sr=capture_rate):
+    """Method synthesizes a voice-like recording: a harmonic series with speaker specific fundamental and formants,
+    syllable-rate amplitude modulation and background noise.
+
+    Args:
+        rng (Generator): Random number generator
+        fundamental (float): Fundamental frequency of the speaker (Hz)
+        seconds (float): Duration of the recording
+        sr (int): Sample rate
+
+    Returns:
+        A numpy int16 array of the recording
+    """
+    t = np.arange(int(seconds * sr)) / sr
+    pitch = fundamental * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))  # Intonation
+    phase = 2 * np.pi * np.cumsum(pitch) / sr
+    formant = fundamental * 4
+    y = sum(np.sin(k * phase) * np.exp(-((k * fundamental - formant) / formant) ** 2) / k for k in range(1, 40))
+    y *= 0.5 + 0.5 * np.abs(np.sin(2 * np.pi * rng.uniform(3, 5) * t))  # Syllables
+    y += rng.normal(0, 0.01, len(t))
+    return (y / np.abs(y).max() * 0.6 * 32767).astype(np.int16)
+
+
+def write_wav(path, samples, sr=capture_rate):
+    """Method writes int16 samples as a mono .wav file
+
+    Args:
+        path (str): Path of the .wav file
+        samples (ndarray): The int16 samples
+        sr (int): Sample rate
+    """
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(samples.tobytes())
+
+
+def generate_corpus(root, recordings, speakers, seed):
+    """Method generates a synthetic corpus in the project layout under root: recordings with audio_store.csv, the
+    user list and an empty model folder.
+
+    Args:
+        root (str): The temporary project root
+        recordings (int): Number of recordings
+        speakers (int): Number of speakers
+        seed (int): Random seed
+
+    Returns:
+        The speaker names and a list of (name, samples) pairs of held out recordings for prediction
+    """
+    rng = np.random.default_rng(seed)
+    for folder in ('/data/voice', '/data/users', '/data/temp', '/models'):
+        os.makedirs(root + folder, exist_ok=True)
+
+    names = [f'speaker{i:03d}' for i in range(speakers)]
+    fundamentals = dict(zip(names, rng.uniform(85, 255, speakers)))
+    start = datetime(2023, 1, 1)
+    rows = []
+    for i in range(recordings):
+        name = names[i % speakers]
+        identifier = (start + timedelta(seconds=i)).strftime('%Y%m%d%H%M%S')
+        file_name = identifier + '_voice.wav'
+        write_wav(root + '/data/voice/' + file_name, synthetic_voice(rng, fundamentals[name], rng.uniform(1, 5)))
+        rows.append([identifier, file_name, 'synthetic', name, 'UNKNOWN', 'Passive'])
+
+    columns = ['id', 'audio_file', 'transcript', 'name', 'command', 'passive_active']
+    pd.DataFrame(rows, columns=columns).set_index('id').to_csv(root + '/data/voice/audio_store.csv')
+    with open(root + '/data/users/user_list.txt', 'w') as f:
+        json.dump({'user_list': names, 'user_tokens': []}, f)
+
+    held_out = [(name, synthetic_voice(rng, fundamentals[name], rng.uniform(1, 5))) for name in names]
+    return names, held_out
+
+
+def use_root(root):
+    """Method points the voice modules at the temporary project root
+
+    Args:
+        root (str): The temporary project root
+    """
+    vm.root_path = root
+    FeatureStore.root_path = root
+    UserStore.root_path = root
+    VoiceStorage.root_path = root
+    PackedCorpus.root_path = root
+    AudioStoreDatabase.root_path = root
+
+
+def peak_rss_mb():
+    """Method returns the peak resident set size of the process and its finished children (MB)"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024  # ru_maxrss is in kB on Linux
+
+
+def latency_stats(latencies, files=None):
+    """Method summarizes the latencies of repeated calls of a stage
+
+    Args:
+        latencies (list): The call latencies (s)
+        files (int): Number of files processed by all calls, defaults to one per call
+
+    Returns:
+        A dictionary of latency percentiles (ms), throughput and the peak RSS so far
+    """
+    latencies = np.asarray(latencies)
+    files = len(latencies) if files is None else files
+    return {'calls': len(latencies), 'p50_ms': float(np.percentile(latencies, 50) * 1e3),
+            'p95_ms': float(np.percentile(latencies, 95) * 1e3), 'total_s': float(latencies.sum()),
+            'files_per_s': float(files / latencies.sum()), 'peak_rss_mb': peak_rss_mb()}
+
+
+def timed(function, *args):
+    """Method times a single call, silencing its console output
+
+    Returns:
+        The result of the call and its latency (s)
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - start
+
+
+def run(args):
+    """Method runs the benchmark suite
+
+    Args:
+        args (Namespace): The parsed command line arguments
+
+    Returns:
+        A dictionary of the benchmark configuration and the results of every stage
+    """
+    import speech_recognition as sr
+
+    root = tempfile.mkdtemp(prefix='kurt_bench_')
+    results = {}
+    try:
+        _, held_out = generate_corpus(root, args.recordings, args.speakers, args.seed)
+        use_root(root)
+        vm.parallel_extraction = args.workers > 1
+        vm.extraction_workers = args.workers
+        recordings = len(pd.read_csv(root + '/data/voice/audio_store.csv'))
+
+        waveforms = [samples.astype(np.float32) / 32768.0 for _, samples in held_out]
+        vm.AudioFeatures.mel_band_mean(waveforms[0], capture_rate)  # Warm up, imports are not part of the stages
+        timed(vm.load_tensorflow)
+        latencies = [timed(vm.AudioFeatures.mel_band_mean, waveforms[i % len(waveforms)], capture_rate)[1]
+                     for i in range(args.repeats)]
+        results['feature_extraction'] = latency_stats(latencies)
+
+        df, latency = timed(vm.generate_raw_dataset)
+        results['generate_raw_dataset'] = latency_stats([latency], recordings)
+        _, latency = timed(vm.generate_final_dataset, df.copy())
+        results['generate_final_dataset_cold'] = latency_stats([latency], recordings)
+        _, latency = timed(vm.generate_final_dataset, df.copy())  # Served by the feature store
+        results['generate_final_dataset_cached'] = latency_stats([latency], recordings)
+
+        if args.skip_training:
+            return report(args, results)
+        users = vm.user_dictionary()
+        _, latency = timed(vm.train_model, len(users), '/model_bench')
+        results['train_model'] = latency_stats([latency], recordings)
+        _, _ = timed(vm.promote_model, '/model_bench', users)
+
+        audio = [(name, sr.AudioData(samples.tobytes(), capture_rate, 2)) for name, samples in held_out]
+        latencies, correct = [], 0
+        for i in range(args.repeats):
+            name, recording = audio[i % len(audio)]
+            (user, _), latency = timed(vm.predict, recording)
+            latencies.append(latency)
+            correct += user == name
+        results['predict'] = latency_stats(latencies)
+        results['predict']['accuracy'] = correct / args.repeats
+        return report(args, results)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def report(args, results):
+    """Method combines the benchmark results with the configuration and environment of the run"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+            'config': {'recordings': args.recordings, 'speakers': args.speakers, 'repeats': args.repeats,
+                       'workers': args.workers, 'seed': args.seed, 'inference_engine': vm.inference_engine,
+                       'identification_mode': vm.identification_mode},
+            'stages': results}
+
+
+def print_results(run_results, baseline=None):
+    """Method prints the stage results, with the relative change of p50 latency against a baseline run"""
+    print(f"{'stage':32}{'p50 ms':>12}{'p95 ms':>12}{'files/s':>12}{'peak MB':>10}{'vs base':>10}")
+    for stage, stats in run_results['stages'].items():
+        change = ''
+        if baseline is not None and stage in baseline['stages']:
+            change = f"{stats['p50_ms'] / baseline['stages'][stage]['p50_ms'] - 1:+.0%}"
+        print(f"{stage:32}{stats['p50_ms']:12.2f}{stats['p95_ms']:12.2f}{stats['files_per_s']:12.1f}"
+              f"{stats['peak_rss_mb']:10.0f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the voice identification pipeline on a synthetic corpus')
+    parser.add_argument('--recordings', type=int, default=200, help='number of synthetic recordings')
+    parser.add_argument('--speakers', type=int, default=4, help='number of synthetic speakers')
+    parser.add_argument('--repeats', type=int, default=50, help='calls timed for per-utterance stages')
+    parser.add_argument('--workers', type=int, default=1, help='feature extraction worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic corpus')
+    parser.add_argument('--skip-training', action='store_true', help='skip the train_model and predict stages')
+    parser.add_argument('--output', default='bench_results', help='folder the JSON results are written to')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    results = run(args)
+    os.makedirs(args.output, exist_ok=True)
+    output_file = f"{args.output}/{results['timestamp'].replace(':', '')}_{results['commit'] or 'nocommit'}.json"
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"Results written to {output_file}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
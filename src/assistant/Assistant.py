@@ -1,17 +1,21 @@
+# The cold-start clock starts before the remaining imports, which dominate the start-up time
+import time
+start_time = time.perf_counter()
+
 import re
+import threading
 
 import speech_recognition as sr
-import pyttsx3
-import google.cloud.texttospeech as tts
 from playsound import playsound
 import os
 
 import src.voice.VoiceStorage as Store
 import src.voice.UserStore as Users
 import src.voice.VoiceModel as vm
+from src.voice.StreamingIdentification import StreamingIdentifier, TappedStream
 
 from src.assistant.AssistantSkills import Skills
-from src.assistant.Nlp_qa import bert_qa
+from src.assistant.Nlp_qa import bert_qa, load_bert_model
 from src.assistant.Teleprompt import display_script
 
 from src.calendar.Calendar import authenticate_calendar
@@ -29,20 +33,76 @@ activation_word = 'hi kurt'
 """string: Activation phrase indicating that Kurt should respond to the user query"""
 voice = 'en-US-News-N'
 """str: Language model of the Google's text-to-speech generator"""
-engine = pyttsx3.init()
-"""pyttsx3: The voice to speech engine"""
-client = tts.TextToSpeechClient()
-"""Google text_to_speech: The text to speech client utilized by Kurt"""
+engine = None
+"""pyttsx3: The voice to speech engine, created on initialization"""
+client = None
+"""Google text_to_speech: The text to speech client utilized by Kurt, created on first use"""
+client_lock = threading.Lock()
+"""Lock: Lock ensuring the text to speech client is only created once, when created concurrently by the prewarm thread"""
+prewarm_enabled = True
+"""bool: Boolean flag indicating if heavy dependencies are loaded in the background after initialization"""
+cold_start_budget = 3.0
+"""float: Seconds allowed from importing the assistant until Kurt is initialized and ready to greet (see README)"""
+streaming_identification = True
+"""bool: Boolean flag indicating if the speaker of a query is identified while the query is being captured"""
+stream_identifier = None
+"""StreamingIdentifier: Speaker identification performed while capturing the last user query"""
 
 
 def initialize():
     """Method initializes key properties required for Kurt to function
     This method initializes the voice classification model, possibly initiating thee retraining protocol,
     depending on the last recorded voice date.
+    Heavy dependencies not required for the greeting are loaded on first use, or prewarmed in the background.
     """
+    global engine
+    import pyttsx3
+    engine = pyttsx3.init()
     engine.setProperty('voice', 'default')  # voices[0].id for english in mac
     engine.setProperty('rate', 160)  # rate = AIs speech rate
     vm.initialize_model()
+    if prewarm_enabled:
+        prewarm()
+
+    cold_start = time.perf_counter() - start_time
+    print(f"Kurt initialized in {cold_start:.2f}s (budget {cold_start_budget:.1f}s)")
+    if cold_start > cold_start_budget:
+        print("Warning: cold-start budget exceeded")
+
+
+def prewarm():
+    """Method loads the heavy dependencies of later conversation steps in a background thread.
+
+    The text to speech client, the voice prediction path and the BERT model are loaded in order of first use, so a
+    conversation turn rarely waits on an import.
+
+    Returns:
+        The prewarm thread
+    """
+    thread = threading.Thread(target=prewarm_dependencies, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+def prewarm_dependencies():
+    """Method loads the heavy dependencies, in order of their first use in a conversation"""
+    text_to_speech_client()
+    vm.prewarm()
+    load_bert_model()
+
+
+def text_to_speech_client():
+    """Method creates the Google text to speech client on first use
+
+    Returns:
+        The text to speech client
+    """
+    global client
+    with client_lock:
+        if client is None:
+            import google.cloud.texttospeech as tts
+            client = tts.TextToSpeechClient()
+    return client
 
 
 def activate():
@@ -112,10 +172,10 @@ def skills_process(query, audio, name, service):
     query = query.lower().split()  # Split query into an array of strings
 
     if name == 'Unknown':
-        active_engagement_skills(query, '', service)  # Perform skill on requested query (Unknown user)
+        command = active_engagement_skills(query, '', service)  # Perform skill on requested query (Unknown user)
     else:
-        active_engagement_skills(query, name, service)  # Perform skill on requested query (Known user)
-    engagement_recording(' '.join(query), audio, name, 'Active')  # Record observations for training purposes
+        command = active_engagement_skills(query, name, service)  # Perform skill on requested query (Known user)
+    engagement_recording(' '.join(query), audio, name, 'Active', command)  # Record observations for training purposes
 
 
 def new_user_query(query):
@@ -140,6 +200,8 @@ def new_user_registration(query, audio):
     1. Ask the user for the name (username) until one is available (not in known users)
     2. Authenticate Google calendar access with the new user. Producing a user specific token pass for future use.
     3. Perform audio collection bootstrapping process to support voice classification functionality.
+    4. Include the user in predictions: enroll the user's voice print from the bootstrapped recordings without
+       retraining in voice_print identification mode, otherwise retrain the voice model in the background.
     Args:
         query (str): The text form of the user's query.
         audio (AudioData): The audio data object of the recorded
@@ -151,8 +213,12 @@ def new_user_registration(query, audio):
     authenticate_calendar(name)  # New user calendar access
     Users.add_user_token(name)  # Add user-specific token to user store
 
-    bootstrap_new_user(name, query, audio)  # Bootstrap audio samples
-    vm.retrain_model()  # Retrain model to include new user in predictions
+    recordings = bootstrap_new_user(name, query, audio)  # Bootstrap audio samples
+    Store.flush_recordings()  # Bootstrapped recordings are read back for enrollment or retraining
+    if vm.identification_mode == 'voice_print':
+        vm.enroll_user(name, recordings)  # Enroll new user's voice print for predictions
+    else:
+        vm.retrain_model(background=True)  # Retrain model to include new user in predictions
 
 
 def get_name():
@@ -206,33 +272,40 @@ def bootstrap_new_user(name, query, audio):
         name (str): The extracted name of the new user to be registered. This will be the label of training data
         query (str): The text form of the user's registration request for saving as training data.
         audio (AudioData): The audio of the user's registration request for saving as training data.
+    Returns:
+        A list of the file names of the saved recordings.
     """
     bootstrap_samples = 5  # Number of sample recordings to collect from the user
-    engagement_recording(query, audio, name, 'Bootstrap')  # Save new user registration query
+    recordings = [engagement_recording(query, audio, name, 'Bootstrap')]  # Save new user registration query
 
     talk("For voice recognition purposes please follow the next instructions.")
     for sample in range(bootstrap_samples):
         talk("Please read out loud the displayed script")
         display_script()  # Display script
         query, audio = parse_command()  # Gather audio and text info
-        engagement_recording(query, audio, name, 'Bootstrap')  # Save information
+        recordings.append(engagement_recording(query, audio, name, 'Bootstrap'))  # Save information
     talk('Thank you ' + name + " you are successfully registered")
+    return recordings
 
 
-def engagement_recording(query, audio, name, active_passive_flag):
+def engagement_recording(query, audio, name, active_passive_flag, command=None):
     """Method saves the query, audio, username and the active/ passive flag for data recording purposes.
+    The recording is stored by the background recording writer, off the conversation thread.
     Args:
         query (string): The text form of the user's query
         audio (AudioData): The audio data object of the recorded query when spoken by the user
         name (string): The user's name.
-        active_passive_flag (string): Active or Passive
+        active_passive_flag (string): Active, Passive or Bootstrap
+        command (string): The type of skill executed in answer to the query
+    Returns:
+        The file name the recording is stored under, or None if nothing was recorded. Passive and active recordings
+        may still be left out by the speaker's sample budget.
     """
     if len(name) != 0:  # Non-empty label
-        Store.retrieve_transcript(query)  # Record transcript for storage
-        Store.retrieve_user_name(name)  # Record username
-        Store.passive_active_flag(active_passive_flag)  # Set engagement type flag
-        Store.generate_audio_file(audio)  # Saves detected audio
-        Store.save_audio()  # Save the recording
+        recording = Store.capture_recording(audio, query, name, active_passive_flag, command)
+        Store.store_recording(recording)  # Handed to the background writer
+        return recording.file_name
+    return None
 
 
 def active_engagement_skills(query, name, service):
@@ -241,10 +314,13 @@ def active_engagement_skills(query, name, service):
         query (string): The text form of the user's query
         name (string): The username
         service (Calendar.service): User authentication link to access calendar
+    Returns:
+        The type of skill executed
     """
     skills = Skills(query, service)  # Determine requested skill
     response = skills.skill_selection(name)  # Execute requested skill returning text result
     talk(response)  # Communicate response
+    return skills.command
 
 
 def user_query():
@@ -255,7 +331,7 @@ def user_query():
     talk("How can I help you?")
     query = None
     while query is None:  # Only when query is determined, can the loop exit
-        query, input_audio = parse_command()  # Parse user query from speech to text
+        query, input_audio = parse_command(identify=streaming_identification)  # Parse user query from speech to text
 
     return query, input_audio
 
@@ -263,16 +339,22 @@ def user_query():
 def identify_user(audio):
     """Method identifies the user spoke,
     The method gives a trained voice classifier the input audio to determine if Kurt recognizes the users voice.
-    If the classifier predicts a user with less that 70% certainty, the uncertain user protocol is initiated.
+    If the user is predicted with less certainty than the identification threshold (70% for the classifier, a
+    calibrated cosine similarity for voice prints), the uncertain user protocol is initiated.
     Args:
         audio (AudioData): Audio data from the user's query for voice classification model prediction
     Returns:
         Returns either Unknown as the name if the user is not registered. Alternatively, it returns the user's name
         when identified.
     """
-    name, score = vm.predict(audio)  # Use voice classification model to predict the speaker
+    global stream_identifier
+    if stream_identifier is not None and stream_identifier.decided:  # Speaker identified confidently while listening
+        name, score = stream_identifier.name, stream_identifier.score
+    else:
+        name, score = vm.predict(audio)  # Use voice classification model to predict the speaker
+    stream_identifier = None
 
-    if score < 0.7:  # Certainty of user prediction below 70%
+    if score < vm.identification_threshold():  # Certainty of user prediction below the threshold
         name = uncertain_user_protocol()  # Activate uncertain user protocol
 
     if name == "Unknown":  # User could not be detected
@@ -336,6 +418,8 @@ def talk(text: str):
     Returns:
         A voice output as an answer to a query or indication of current process.
     """
+    import google.cloud.texttospeech as tts
+
     language_code = "-".join(voice.split("-")[:2])
     text_input = tts.SynthesisInput(text=text)  # Set the text input to be synthesized
 
@@ -345,21 +429,25 @@ def talk(text: str):
     # Select the type of audio file you want returned
     audio_config = tts.AudioConfig(audio_encoding=tts.AudioEncoding.LINEAR16)
 
-    response = client.synthesize_speech(input=text_input, voice=voice_params, audio_config=audio_config)
+    response = text_to_speech_client().synthesize_speech(input=text_input, voice=voice_params, audio_config=audio_config)
     audio_file = f"{file_path}/{voice}.wav"
     with open(audio_file, "wb") as out:
         out.write(response.audio_content)
     playsound(audio_file)
 
 
-def parse_command():
+def parse_command(identify=False):
     """ Method identifies the activation phrase, and parses voice-to-text creating a text query for the assistant.
     This method makes use of the speech_recognition library, and will utilize the device's default microphone in
     order to detect spoken words.
     The microphone's energy threshold is dynamically adjusted based on the surrounding ambient noise.
+    Args:
+        identify (bool): Identify the speaker while the query is captured, stopping once confident.
+                         The result is kept in stream_identifier for identify_user.
     Returns:
         Returns a string representing the user's query in string format and the audio file of the query
     """
+    global stream_identifier
     listener = sr.Recognizer()  # Acts as a listener parsing voice into text
     print('Listening for  a command')
 
@@ -368,6 +456,9 @@ def parse_command():
         listener.adjust_for_ambient_noise(source, duration=2)  # Adjust sensitivity based on ambient noise
         listener.dynamic_energy_threshold = True  # Allows sensitivity adjustment dynamically
         listener.pause_threshold = 3  # seconds of non-speaking audio before a phrase is considered complete
+        if identify:
+            stream_identifier = StreamingIdentifier(source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+            source.stream = TappedStream(source.stream, stream_identifier, listener)  # Identify during capture
         print('Listening')
         input_audio = listener.listen(source)  # could be limited time, Google API
 
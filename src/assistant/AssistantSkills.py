@@ -2,9 +2,6 @@ import sys
 from datetime import datetime
 import webbrowser
 from enum import Enum
-import wikipedia
-import pyjokes
-import src.voice.VoiceStorage as vc
 import src.calendar.Calendar as calendar
 import src.calendar.Prediction as predict
 
@@ -38,6 +35,7 @@ class Skills:
     def __init__(self, query, calendar_service):
         self.query = query
         self.calendar_service = calendar_service
+        self.command = None
 
     def skill_selection(self, name):
         """Method selects a skill to be executed based off of query keyword.
@@ -56,22 +54,22 @@ class Skills:
 
         match keyword:
             case 'say':
-                vc.retrieve_command(Command.SAY.name)
+                self.command = Command.SAY.name
                 return self.greet_repeat(name)
             case 'search':
-                vc.retrieve_command(Command.SEARCH.name)
+                self.command = Command.SEARCH.name
                 return self.web_search()
             case 'time':
-                vc.retrieve_command(Command.TIME.name)
+                self.command = Command.TIME.name
                 return self.get_time(name)
             case 'wikipedia':
-                vc.retrieve_command(Command.WIKIPEDIA.name)
+                self.command = Command.WIKIPEDIA.name
                 return self.wikipedia_summary()
             case 'joke':
-                vc.retrieve_command(Command.JOKE.name)
+                self.command = Command.JOKE.name
                 return self.tell_joke(name)
             case 'read schedule':
-                vc.retrieve_command(Command.READ_SCHEDULE.name)
+                self.command = Command.READ_SCHEDULE.name
                 text = ' '.join(self.query)
                 if 'week' in text and not calendar.contains_weekdays(text):
                     start, end = calendar.get_week(text)
@@ -79,16 +77,16 @@ class Skills:
                 day = calendar.get_date(text)
                 return self.read_days_schedule(day)
             case 'schedule event':
-                vc.retrieve_command(Command.SCHEDULE_EVENT.name)
+                self.command = Command.SCHEDULE_EVENT.name
                 return self.create_event()
             case 'predict':
-                vc.retrieve_command(Command.PREDICT.name)
+                self.command = Command.PREDICT.name
                 return self.predict_event(name)
             case 'quit':
-                vc.retrieve_command(Command.EXIT.name)
+                self.command = Command.EXIT.name
                 return "goodbye", self.quit()
             case _:
-                vc.retrieve_command(Command.UNKNOWN.name)
+                self.command = Command.UNKNOWN.name
                 return 'Sorry I do not possess that skill at this time'
 
     def check_verbal_options(self):
@@ -168,6 +166,8 @@ class Skills:
             DisambiguationError: This error is raises and accepts disambiguation error (ambitious article title)
             returning a random page summary from the available pages.
         """
+        import wikipedia  # Imported on the first wikipedia query
+
         search_subject = ' '.join(self.query)
         search_results = wikipedia.search(search_subject)
         if not search_results:
@@ -187,6 +187,8 @@ class Skills:
         Returns:
             A string formatted joke
         """
+        import pyjokes  # Imported on the first joke
+
         return name + " I have a joke for you.. " + pyjokes.get_joke()
 
     def read_days_schedule(self, day):
@@ -1,7 +1,23 @@
-from transformers import pipeline
+import threading
 
-bert_model = pipeline("question-answering", model='distilbert-base-cased-distilled-squad')
-"""pipeline: The pre-trained BERT Question-Answer model"""
+bert_model = None
+"""pipeline: The pre-trained BERT Question-Answer model, loaded on first use"""
+bert_lock = threading.Lock()
+"""Lock: Lock ensuring the BERT model is only loaded once, when loaded concurrently by the prewarm thread"""
+
+
+def load_bert_model():
+    """Method loads the pre-trained BERT Question-Answer model on first use
+
+    Returns:
+        The BERT Question-Answer pipeline
+    """
+    global bert_model
+    with bert_lock:
+        if bert_model is None:
+            from transformers import pipeline  # transformers is only imported once a name has to be extracted
+            bert_model = pipeline("question-answering", model='distilbert-base-cased-distilled-squad')
+    return bert_model
 
 
 def bert_qa(question: str, context: str):
@@ -12,6 +28,6 @@ def bert_qa(question: str, context: str):
         question (str): The question Kurt wants to answer
         context (str): The contextual information from which the answer can be extracted.
     """
-    answer = bert_model(question=question, context=context)
+    answer = load_bert_model()(question=question, context=context)
     return answer['answer'], answer['score']
 
@@ -1,11 +1,6 @@
 from datetime import datetime, timedelta, date
 import os.path
 import numpy as np
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
 file_path = os.path.dirname(os.path.abspath(__file__))
 """str: Path to this python script"""
@@ -34,6 +29,12 @@ def authenticate_calendar(name: str):
     Returns:
         service object that contain the user's connection to the Google Calendar API
     """
+    from google.auth.transport.requests import Request  # Google API clients are imported on first authentication
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
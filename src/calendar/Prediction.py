@@ -6,7 +6,6 @@ import pandas as pd
 
 from datetime import date
 
-from sklearn.ensemble import RandomForestClassifier
 from src.calendar.Calendar import get_events_between_days, create_event, get_week
 
 
@@ -123,6 +122,7 @@ def make_predictions(hist_data, period_start, period_end):
     y_train = hist_data['event']
 
     # model for prediction
+    from sklearn.ensemble import RandomForestClassifier  # scikit-learn is imported on the first prediction
     random_forest = RandomForestClassifier(n_estimators=50, max_depth=10)
     random_forest.fit(X_train, y_train)
 
@@ -0,0 +1,281 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import librosa
+import numpy as np
+import scipy.fft
+import soundfile
+from numpy.lib.stride_tricks import sliding_window_view
+
+import src.voice.VoiceActivity as VoiceActivity
+
+process_context = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+"""str: Worker start method. Workers are never forked from the calling process, as extraction runs on the retrain thread
+after TensorFlow started its own threads. The fork server loads the audio libraries once, and workers inherit them"""
+default_workers = os.cpu_count() or 1
+"""int: Default number of feature extraction worker processes"""
+default_chunk_size = 32
+"""int: Default number of recordings decoded and featurized by a worker per task"""
+parallel_threshold = 64
+"""int: Minimum number of files featurized across worker processes. Fewer files are featurized serially, as handing
+them to the workers costs more than it saves"""
+worker_pool = None
+"""ProcessPoolExecutor: The feature extraction workers, started on first use and reused by later extractions"""
+pool_workers = 0
+"""int: Number of worker processes of the worker pool"""
+pool_lock = threading.Lock()
+"""Lock: Lock ensuring a single worker pool is started when features are extracted concurrently"""
+reference_rate = 22050
+"""int: Sample rate the voice features are defined at (librosa's default rate)"""
+n_fft = 2048
+"""int: STFT frame length at the reference rate"""
+hop_length = 512
+"""int: STFT hop length at the reference rate"""
+n_mels = 128
+"""int: Number of mel bands, being the length of the voice feature"""
+decode_block = 65536
+"""int: Number of frames decoded at a time when streaming an audio file into its waveform"""
+trim_silence = True
+"""bool: Boolean flag indicating if silence is trimmed from waveforms before featurizing, as it dilutes the band means"""
+frame_block = 256
+"""int: Number of STFT frames transformed at once, bounding the memory used by long recordings"""
+analyses = dict()
+"""dict: STFT parameters and mel filterbanks, computed once per sample rate as sr: (frame length, hop, filterbank,
+window) pairs"""
+
+
+def mel_analysis(sr):
+    """Method returns the STFT parameters and mel filterbank for a sample rate, computing them on first use.
+
+    Frames span the same duration, and bins the same frequencies, as at the reference rate. The filterbank is limited
+    to the reference Nyquist frequency and scaled for the frame length, so features computed at the source rate match
+    those of the recording resampled to the reference rate.
+
+    Args:
+        sr (int): Sample rate of the waveforms to analyse
+
+    Returns:
+        The frame length, hop length, (n_mels, bins) filterbank and analysis window
+    """
+    if sr not in analyses:
+        frame_length = int(round(n_fft * sr / reference_rate))
+        hop = max(1, int(round(hop_length * sr / reference_rate)))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # Bands above the source Nyquist frequency stay empty, as after resampling
+            filterbank = librosa.filters.mel(sr=sr, n_fft=frame_length, n_mels=n_mels, fmax=reference_rate / 2)
+        filterbank *= (n_fft / frame_length) ** 2  # Spectrum power grows with the square of the frame length
+        window = librosa.filters.get_window('hann', frame_length, fftbins=True)
+        analyses[sr] = (frame_length, hop, filterbank.astype(np.float32), window.astype(np.float32))
+    return analyses[sr]
+
+
+def mel_band_means(frames, sr):
+    """Method generates the voice features of a batch of equal-length waveforms in one vectorized pass.
+
+    The band means equal the filterbank applied to the mean power spectrum, so the mel spectrogram itself is never
+    materialized. Matches librosa.feature.melspectrogram (centered, zero padded) averaged over time.
+
+    Args:
+        frames (ndarray): A (batch, samples) array of waveforms, or a single waveform
+        sr (int): Sample rate of the waveforms
+
+    Returns:
+        A (batch, n_mels) float32 array containing the mean of every mel band
+    """
+    frames = np.atleast_2d(np.asarray(frames, dtype=np.float32))
+    frame_length, hop, filterbank, window = mel_analysis(sr)
+    padded = np.pad(frames, ((0, 0), (frame_length // 2, frame_length // 2)))  # Centered frames
+    windows = sliding_window_view(padded, frame_length, axis=1)[:, ::hop]  # (batch, frames, frame_length) view
+    return mel_bands(windows_power(windows, window) / windows.shape[1], sr)
+
+
+def windows_power(windows, window):
+    """Method sums the power spectra of STFT frames, transforming blocks of frames at a time
+
+    Args:
+        windows (ndarray): A (..., frames, frame_length) array of frames
+        window (ndarray): The analysis window
+
+    Returns:
+        A (..., bins) array of the power spectra summed over the frames
+    """
+    power = np.zeros(windows.shape[:-2] + (windows.shape[-1] // 2 + 1,))
+    for start in range(0, windows.shape[-2], frame_block):
+        spectrum = scipy.fft.rfft(windows[..., start:start + frame_block, :] * window, axis=-1)  # Single precision
+        power += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=-2)  # Power spectrum summed over frames
+    return power
+
+
+def mel_bands(power, sr):
+    """Method applies the mel filterbank of a sample rate to (mean) power spectra
+
+    Args:
+        power (ndarray): A (..., bins) array of power spectra
+        sr (int): Sample rate of the analysed waveforms
+
+    Returns:
+        A (..., n_mels) float32 array of mel band energies
+    """
+    return (power @ mel_analysis(sr)[2].T).astype(np.float32)
+
+
+def stream_bands(samples, sr):
+    """Method computes the mel band energies of the complete STFT frames at the start of a streamed waveform.
+
+    Streams are not center padded at their end, as the end is unknown while streaming. The energy of every frame is
+    returned as well, so silent frames can be gated as VoiceActivity trims them.
+
+    Args:
+        samples (ndarray): The buffered samples of the stream, starting at a frame boundary
+        sr (int): Sample rate of the stream
+
+    Returns:
+        A (frames, n_mels) float32 array of mel band energies, the (frames,) energies (dBFS) of the samples of every
+        hop, and the number of samples consumed, being the start of the next frame
+    """
+    frame_length, hop, filterbank, window = mel_analysis(sr)
+    if len(samples) < frame_length:
+        return np.empty((0, n_mels), dtype=np.float32), np.empty(0), 0
+    windows = sliding_window_view(samples, frame_length)[::hop]  # (frames, frame_length) view
+    bands = np.empty((len(windows), n_mels), dtype=np.float32)
+    for start in range(0, len(windows), frame_block):
+        spectrum = scipy.fft.rfft(windows[start:start + frame_block] * window, axis=-1)
+        bands[start:start + frame_block] = (spectrum.real ** 2 + spectrum.imag ** 2) @ filterbank.T
+    centers = windows[:, (frame_length - hop) // 2:(frame_length + hop) // 2]  # The hop each frame is centered on
+    energy = 20 * np.log10(np.maximum(np.sqrt(np.mean(np.square(centers), axis=1)), 1e-10))
+    return bands, energy, len(windows) * hop
+
+
+def mel_band_mean(x, sr, trim=None):
+    """Method generates the voice feature of a waveform, being the mean of each mel spectrogram band over time.
+
+    Silence is trimmed first when trimming, so only speech contributes to the band means.
+
+    Args:
+        x (ndarray): The audio waveform
+        sr (int): Sample rate of the waveform
+        trim (bool): Trim silence first, defaults to trim_silence
+
+    Returns:
+        A numpy vector containing the mean of every mel band
+    """
+    if trim_silence if trim is None else trim:
+        x = VoiceActivity.trim(x, sr)
+    return mel_band_means(x, sr)[0]
+
+
+def load_audio(path, sr=None):
+    """Method decodes an audio file (.wav, .flac) into a mono waveform.
+
+    The file is decoded block by block straight into the waveform, scaled and resampled as by librosa.load. Formats
+    not readable by soundfile are decoded by librosa.
+
+    Args:
+        path (str): The complete path of the audio file
+        sr (int): Sample rate to decode the audio at, None keeps the source sample rate
+
+    Returns:
+        A numpy float32 array of the waveform and its sample rate
+    """
+    try:
+        info = soundfile.info(path)
+    except RuntimeError:  # Not a soundfile format
+        return librosa.load(path, sr=sr)
+    y = np.empty(info.frames, dtype=np.float32)
+    position = 0
+    for block in soundfile.blocks(path, blocksize=decode_block, dtype='float32', always_2d=True):
+        y[position:position + len(block)] = block.mean(axis=1)  # Mix down to mono
+        position += len(block)
+    if sr is not None and sr != info.samplerate:
+        return librosa.resample(y[:position], orig_sr=info.samplerate, target_sr=sr), sr
+    return y[:position], info.samplerate
+
+
+def file_features(paths, trim=None):
+    """Method decodes and featurizes a chunk of audio files, at their source sample rate.
+
+    Only the feature vectors are returned, so raw waveforms never leave the worker process.
+
+    Args:
+        paths (list): The complete paths of the audio files
+        trim (bool): Trim silence first, defaults to trim_silence
+
+    Returns:
+        A (len(paths), n_mels) float32 array of features
+    """
+    return np.stack([mel_band_mean(*load_audio(path), trim=trim) for path in paths])  # At the source sample rate
+
+
+def parallel_features(paths, workers=default_workers, chunk_size=default_chunk_size, features=file_features):
+    """Method decodes and featurizes audio files across a pool of worker processes.
+
+    The files are split into chunks, each processed by a single worker, and the extraction throughput is reported. The
+    worker pool is kept for later extractions, and fewer than parallel_threshold files are featurized serially.
+
+    Args:
+        paths (list): The complete paths of the audio files
+        workers (int): Number of worker processes
+        chunk_size (int): Number of files processed per worker task
+        features (function): Function featurizing a chunk of paths within a worker, defaults to decoding audio files
+
+    Returns:
+        A (len(paths), n_mels) float32 array of features ordered as paths
+    """
+    paths = list(paths)
+    if not paths:
+        return np.empty((0, n_mels), dtype=np.float32)
+    if len(paths) < parallel_threshold or workers <= 1:
+        return features(paths)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    start = time.perf_counter()
+
+    pool = extraction_pool(workers)
+    try:
+        results = list(pool.map(features, chunks))  # Results are returned in chunk order
+    except BrokenProcessPool:  # A worker died, start a new pool on the next extraction
+        shutdown_pool()
+        raise
+
+    elapsed = time.perf_counter() - start
+    print(f"Extracted {len(paths)} files in {elapsed:.2f}s ({len(paths) / elapsed:.1f} files/s, {workers} workers)")
+    return np.concatenate(results)
+
+
+def extraction_pool(workers=default_workers):
+    """Method returns the feature extraction worker pool, starting it on first use or when the number of workers changed
+
+    Args:
+        workers (int): Number of worker processes
+
+    Returns:
+        The ProcessPoolExecutor
+    """
+    global worker_pool, pool_workers
+    with pool_lock:
+        if worker_pool is not None and pool_workers != workers:
+            worker_pool.shutdown()
+            worker_pool = None
+        if worker_pool is None:
+            context = multiprocessing.get_context(process_context)
+            if process_context == 'forkserver':
+                context.set_forkserver_preload([__name__])  # Takes effect when the fork server first starts
+            worker_pool, pool_workers = ProcessPoolExecutor(max_workers=workers, mp_context=context), workers
+        return worker_pool
+
+
+def shutdown_pool():
+    """Method stops the feature extraction workers, a later extraction starting them again"""
+    global worker_pool
+    with pool_lock:
+        if worker_pool is not None:
+            worker_pool.shutdown()
+            worker_pool = None
+
+
+atexit.register(shutdown_pool)
@@ -0,0 +1,239 @@
+"""SQLite backend of the audio store.
+
+The recordings of audio_store.csv are held in an embedded SQLite database in WAL mode, indexed on speaker name,
+recording id (the time of capture), command and listening type. Selected with store_backend = 'sqlite' in
+VoiceStorage, an existing audio_store.csv is imported once on first use.
+
+Usage (from the project root):
+    python -m src.voice.AudioStoreDatabase --import-csv
+    python -m src.voice.AudioStoreDatabase --export-csv data/voice/audio_store_export.csv
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+
+import pandas as pd
+
+import Config
+
+root_path = Config.root_dir()
+"""str: Path to the project root"""
+data_path = '/data/voice/'
+"""str: path from project root to voice data"""
+database_name = 'audio_store.db'
+"""str: Name of the SQLite database of the audio store"""
+csv_name = 'audio_store.csv'
+"""str: Name of the csv audio store imported on first use"""
+columns = {'id': 'TEXT PRIMARY KEY', 'audio_file': 'TEXT NOT NULL UNIQUE', 'transcript': 'TEXT', 'name': 'TEXT',
+           'command': 'TEXT', 'passive_active': 'TEXT', 'suggested_name': 'TEXT', 'suggestion_confidence': 'REAL'}
+"""dict: Columns of the recordings table with their SQLite types"""
+optional_columns = ['suggested_name', 'suggestion_confidence']
+"""list: Columns only read, as in the csv audio store, once any recording holds a value"""
+indexes = {'recordings_name_id': ['name', 'id'], 'recordings_command': ['command'],
+           'recordings_passive_active': ['passive_active', 'id']}
+"""dict: Indexes of the recordings table as name: columns pairs. Ids are sortable capture times, so the primary key
+serves time range queries"""
+busy_timeout = 5.0
+"""float: Seconds a connection waits for a concurrent write transaction to finish"""
+connections = threading.local()
+"""local: The database connection of every thread, SQLite connections not being shareable between threads"""
+
+
+def database_file():
+    """Method returns the path of the audio store database"""
+    return root_path + data_path + database_name
+
+
+def connect():
+    """Method returns the database connection of the calling thread, creating the database on first use.
+
+    Returns:
+        The sqlite3 connection
+    """
+    path = database_file()
+    connection = getattr(connections, 'connection', None)
+    if connection is not None and connections.path == path:
+        return connection
+
+    created = not os.path.isfile(path)
+    connection = sqlite3.connect(path, timeout=busy_timeout)
+    connection.execute('PRAGMA journal_mode=WAL')  # Readers never block the recording writer
+    connection.execute('PRAGMA synchronous=NORMAL')  # Durable at WAL checkpoints, the WAL itself survives crashes
+    with connection:
+        connection.execute(f"CREATE TABLE IF NOT EXISTS recordings "
+                           f"({', '.join(f'{column} {kind}' for column, kind in columns.items())})")
+        for index, index_columns in indexes.items():
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {index} ON recordings ({', '.join(index_columns)})")
+        connection.execute('PRAGMA optimize')  # Refresh the statistics the query planner chooses indexes by
+    connections.connection, connections.path = connection, path
+    if created and os.path.isfile(root_path + data_path + csv_name):
+        import_csv(root_path + data_path + csv_name)  # One-shot import of the csv audio store
+    return connection
+
+
+def database_rows(df):
+    """Method converts a DataFrame of recordings into database rows, storing empty fields as NULL
+
+    Args:
+        df (DataFrame): The recordings, with an id column or index
+
+    Returns:
+        The names of the columns present and the list of rows
+    """
+    df = df.reset_index() if 'id' not in df.columns else df
+    present = [column for column in columns if column in df.columns]
+    df = df[present].astype(object)
+    df = df.where(df.notna() & (df != ''), None)
+    return present, [tuple(row) for row in df.itertuples(index=False)]
+
+
+def insert(df):
+    """Method inserts recordings in one transaction. Recordings are never replaced: a recording whose id or file name is
+    already stored, such as an id issued by another assistant process, is reported and left out, the others are
+    inserted
+
+    Args:
+        df (DataFrame): The recordings, with an id column or index
+
+    Returns:
+        The ids of the recordings left out
+    """
+    present, rows = database_rows(df)
+    statement = f"INSERT INTO recordings ({', '.join(present)}) VALUES ({', '.join('?' * len(present))})"
+    connection = connect()
+    rejected = []
+    with connection:
+        for row in rows:
+            try:
+                connection.execute(statement, row)
+            except sqlite3.IntegrityError as error:  # Only this row is left out of the transaction
+                rejected.append(row[present.index('id')])
+                print(f"Recording {rejected[-1]} collides with a stored recording, not inserted: {error}")
+    return rejected
+
+
+def replace(df):
+    """Method replaces all recordings in one transaction
+
+    Args:
+        df (DataFrame): The complete audio store
+    """
+    present, rows = database_rows(df)
+    connection = connect()
+    with connection:
+        connection.execute("DELETE FROM recordings")
+        connection.executemany(f"INSERT INTO recordings ({', '.join(present)}) "
+                               f"VALUES ({', '.join('?' * len(present))})", rows)
+
+
+def delete(audio_files):
+    """Method deletes recordings by file name in one transaction
+
+    Args:
+        audio_files (list): File names of the recordings
+    """
+    connection = connect()
+    with connection:
+        connection.executemany("DELETE FROM recordings WHERE audio_file = ?", [(x,) for x in audio_files])
+
+
+def select(selected=None, name=None, since=None):
+    """Method reads recordings ordered by id, through the indexes when filtered
+
+    Args:
+        selected (list): Columns to read, defaults to all columns apart from empty optional columns
+        name (str): Only read the recordings of this speaker
+        since (str): Only read recordings with a later id, such as the training watermark
+
+    Returns:
+        A DataFrame of the recordings, empty fields being empty strings as in the csv audio store
+    """
+    all_columns = selected is None
+    selected = list(columns) if all_columns else selected
+    conditions, parameters = [], []
+    if name is not None:
+        conditions.append("name = ?")
+        parameters.append(name)
+    if since is not None:
+        conditions.append("id > ?")
+        parameters.append(since)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor = connect().execute(f"SELECT {', '.join(selected)} FROM recordings{where} ORDER BY id", parameters)
+    df = pd.DataFrame(cursor.fetchall(), columns=selected, dtype=object).fillna('').astype(str)
+    if all_columns:
+        df = df.drop(columns=[column for column in optional_columns if not df[column].any()])
+    return df
+
+
+def counts(since=None):
+    """Method counts the recordings of every speaker
+
+    Args:
+        since (str): Only count recordings with a later id, such as the training watermark
+
+    Returns:
+        A dictionary of name: recording count pairs
+    """
+    where, parameters = ("WHERE id > ?", [since]) if since is not None else ('', [])
+    return {name: count for name, count in
+            connect().execute(f"SELECT name, COUNT(*) FROM recordings {where} GROUP BY name", parameters)}
+
+
+def import_csv(csv_path):
+    """Method imports a csv audio store into the database, keeping recordings already imported
+
+    Args:
+        csv_path (str): Path of the csv audio store
+
+    Returns:
+        The number of recordings imported
+    """
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    present, rows = database_rows(df)
+    connection = connect()
+    with connection:
+        imported = connection.total_changes
+        connection.executemany(f"INSERT OR IGNORE INTO recordings ({', '.join(present)}) "
+                               f"VALUES ({', '.join('?' * len(present))})", rows)
+        imported = connection.total_changes - imported
+        connection.execute('ANALYZE')
+    print(f"Imported {imported}/{len(df)} recordings from {csv_path}")
+    return imported
+
+
+def export_csv(csv_path):
+    """Method exports the database as a csv audio store, replacing the csv file atomically
+
+    Args:
+        csv_path (str): Path of the exported csv file
+
+    Returns:
+        The number of recordings exported
+    """
+    df = select()
+    df.to_csv(csv_path + '.tmp', index=False)
+    os.replace(csv_path + '.tmp', csv_path)
+    return len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import or export the SQLite audio store')
+    parser.add_argument('--import-csv', nargs='?', const='', metavar='CSV',
+                        help='import a csv audio store, defaults to data/voice/audio_store.csv')
+    parser.add_argument('--export-csv', metavar='CSV', help='export the audio store as csv')
+    parser.add_argument('--root', default=os.getcwd(), help='project root, defaults to the current directory')
+    args = parser.parse_args()
+
+    global root_path
+    root_path = args.root
+    if args.import_csv is not None:
+        import_csv(args.import_csv or root_path + data_path + csv_name)
+    if args.export_csv:
+        print(f"Exported {export_csv(args.export_csv)} recordings to {args.export_csv}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
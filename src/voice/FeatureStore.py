@@ -0,0 +1,370 @@
+import csv
+import glob
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a single assistant process is expected
+    fcntl = None
+
+import Config
+import src.voice.PackedCorpus as PackedCorpus
+
+root_path = Config.root_dir()
+"""str: Path to the project root"""
+data_path = '/data/voice/'
+"""str: path from project root to voice data"""
+store_path = 'features/'
+"""str: Path from the voice data folder to the feature store"""
+index_columns = ['audio_file', 'content_hash', 'row']
+"""list: Columns of the feature store index"""
+staged_features = dict()
+"""dict: Features computed during live predictions, awaiting the storage of their recording as hash: (key, feature)"""
+staged_limit = 16
+"""int: Maximum number of staged features kept in memory"""
+lock_name = 'features.lock'
+"""str: Name of the lock file serializing the writers of the feature stores across processes"""
+compaction_suffix = '.compacting'
+"""str: Suffix of the marker of a compaction whose rewritten files are complete, completed by the next writer when
+interrupted"""
+store_lock = threading.RLock()
+"""RLock: Lock serializing the writers of the feature stores within the process, such as the recording writer and the
+retraining thread"""
+lock_file = None
+"""file: The open lock file while the process holds the feature store lock, None otherwise"""
+
+
+def parameter_key(params: dict):
+    """Method generates a short key uniquely identifying a set of feature extraction parameters.
+
+    Features computed with different parameters are kept in separate stores, so a parameter change never mixes
+    incompatible features.
+
+    Args:
+        params (dict): The feature extraction parameters
+
+    Returns:
+        A hexadecimal string identifying the parameter set
+    """
+    encoded = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+def content_hash(data: bytes):
+    """Method generates the content hash of a recording
+
+    Args:
+        data (bytes): The bytes of the recording file
+
+    Returns:
+        A hexadecimal string representing the hash of the recording content
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_hash(audio_file: str):
+    """Method generates the content hash of a stored recording file, or of its samples once packed into the corpus
+
+    Args:
+        audio_file (str): File name of the recording within the voice data folder
+
+    Returns:
+        A hexadecimal string representing the hash of the recording content
+    """
+    try:
+        with open(root_path + data_path + audio_file, 'rb') as f:
+            return content_hash(f.read())
+    except FileNotFoundError:  # Packed recording, without a file of its own
+        return content_hash(PackedCorpus.read_samples(audio_file).tobytes())
+
+
+def store_files(key: str):
+    """Method returns the paths of the feature array and index files of a feature store
+
+    Args:
+        key (str): The feature parameter key of the store
+
+    Returns:
+        The path of the raw float32 feature array and the path of its csv index
+    """
+    directory = root_path + data_path + store_path
+    return directory + 'features_' + key + '.f32', directory + 'features_' + key + '.csv'
+
+
+@contextmanager
+def locked_store():
+    """Method holds the feature store lock, exclusive to one thread of one process. An interrupted compaction is
+    completed first. The lock is re-entrant within the thread holding it
+    """
+    global lock_file
+    with store_lock:
+        if lock_file is not None:
+            yield
+            return
+        directory = root_path + data_path + store_path
+        os.makedirs(directory, exist_ok=True)
+        with open(directory + lock_name, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+            lock_file = f
+            try:
+                for marker in glob.glob(directory + '*' + compaction_suffix):
+                    finish_compaction(marker)
+                yield
+            finally:
+                lock_file = None
+
+
+def load_index(key: str, dim: int):
+    """Method reads the index of a feature store.
+
+    Index rows pointing past the end of the feature array (an interrupted append) are ignored, and the latest row of a
+    recording takes precedence over earlier ones. A negative row removes the recording from the index.
+
+    Args:
+        key (str): The feature parameter key of the store
+        dim (int): Length of a single feature vector
+
+    Returns:
+        A dictionary of audio_file: (content_hash, row) pairs
+    """
+    feature_file, index_file = store_files(key)
+    if not os.path.isfile(index_file) or not os.path.isfile(feature_file):
+        return dict()
+
+    stored_rows = os.path.getsize(feature_file) // (dim * 4)  # Complete rows in the feature array
+    index = dict()
+    with open(index_file, newline='') as f:
+        for record in csv.DictReader(f):
+            row = int(record['row'])
+            if row < 0:  # Recording removed
+                index.pop(record['audio_file'], None)
+            elif row < stored_rows:
+                index[record['audio_file']] = (record['content_hash'], row)
+    return index
+
+
+def load_features(key: str, dim: int):
+    """Method memory maps the feature array of a feature store
+
+    Args:
+        key (str): The feature parameter key of the store
+        dim (int): Length of a single feature vector
+
+    Returns:
+        A read-only (rows, dim) float32 array, empty when the store does not exist
+    """
+    feature_file, _ = store_files(key)
+    rows = os.path.getsize(feature_file) // (dim * 4) if os.path.isfile(feature_file) else 0
+    if rows == 0:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.memmap(feature_file, dtype=np.float32, mode='r', shape=(rows, dim))
+
+
+def append_features(key: str, entries: list):
+    """Method appends computed features to a feature store.
+
+    The feature rows are written before their index rows, so an interrupted append never indexes a partial row. Appends
+    are serialized by the feature store lock, so only a row left partial by an interrupted append is ever truncated.
+
+    Args:
+        key (str): The feature parameter key of the store
+        entries (list): A list of (audio_file, content_hash, feature) tuples
+    """
+    if not entries:
+        return
+    feature_file, index_file = store_files(key)
+    os.makedirs(os.path.dirname(feature_file), exist_ok=True)
+
+    features = np.stack([np.asarray(feature, dtype=np.float32) for _, _, feature in entries])
+    row_bytes = features[0].nbytes
+    with locked_store():
+        first_row = os.path.getsize(feature_file) // row_bytes if os.path.isfile(feature_file) else 0
+        with open(feature_file, 'ab') as f:
+            f.truncate(first_row * row_bytes)  # Drop a partially written row left by an interrupted append
+            f.write(features.tobytes())
+
+        index_exists = os.path.isfile(index_file)
+        with open(index_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if not index_exists:
+                writer.writerow(index_columns)
+            for offset, (audio_file, digest, _) in enumerate(entries):
+                writer.writerow([audio_file, digest, first_row + offset])
+
+
+def get_features(audio_files, compute_features, params: dict):
+    """Method retrieves the features of the given recordings, computing only those missing from the store.
+
+    A stored feature is reused when its recording's content hash is unchanged. New or changed recordings are passed
+    to compute_features in a single call and written to the store.
+
+    Args:
+        audio_files (iterable): File names of the recordings within the voice data folder
+        compute_features (function): Function computing the (n, dim) feature array of a list of recording file names
+        params (dict): The feature extraction parameters, containing the feature length as "n_mels"
+
+    Returns:
+        A contiguous (len(audio_files), dim) float32 array of features ordered as audio_files
+    """
+    features, rows = feature_rows(audio_files, compute_features, params)
+    return np.ascontiguousarray(features[rows])
+
+
+def feature_rows(audio_files, compute_features, params: dict, chunk_size=None):
+    """Method ensures the store holds the features of the given recordings, returning their rows in a snapshot of the
+    store.
+
+    Missing recordings are computed and appended chunk_size recordings at a time, so the memory used is bounded by the
+    chunk size rather than by the number of missing recordings, and completed chunks survive an interruption. The
+    snapshot is a memory map of the feature array, which a later compaction replaces rather than rewrites, so the rows
+    stay valid for as long as the snapshot is held.
+
+    Args:
+        audio_files (iterable): File names of the recordings within the voice data folder
+        compute_features (function): Function computing the (n, dim) feature array of a list of recording file names
+        params (dict): The feature extraction parameters, containing the feature length as "n_mels"
+        chunk_size (int): Maximum number of recordings computed per compute_features call, None computes all at once
+
+    Returns:
+        A read-only (rows, dim) float32 snapshot of the feature array and a numpy array of the rows of the recordings
+        within it, ordered as audio_files
+    """
+    key = parameter_key(params)
+    dim = params['n_mels']
+    with locked_store():
+        index = load_index(key, dim)
+
+    audio_files = list(audio_files)
+    hashes = [file_hash(audio_file) for audio_file in audio_files]
+    missing = [(audio_file, digest) for audio_file, digest in zip(audio_files, hashes)
+               if index.get(audio_file, (None,))[0] != digest]
+
+    missing = list(dict(missing).items())  # Compute each new or changed recording once
+    chunk_size = chunk_size or max(len(missing), 1)
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        features = compute_features([audio_file for audio_file, _ in chunk])
+        append_features(key, [(audio_file, digest, feature) for (audio_file, digest), feature in zip(chunk, features)])
+
+    with locked_store():
+        index = load_index(key, dim)
+        if len(load_features(key, dim)) > 2 * len(index):  # Mostly superseded rows, rewrite the store
+            compact_store(key, dim, index)
+            index = load_index(key, dim)
+        features = load_features(key, dim)
+    print(f"Feature store: {len(audio_files) - len(missing)} cached, {len(missing)} computed")
+    return features, np.array([index[audio_file][1] for audio_file in audio_files], dtype=np.int64)
+
+
+def rename_recordings(renames: dict):
+    """Method carries the stored features of recordings over to their new file names, after a lossless conversion left
+    their samples unchanged
+
+    Args:
+        renames (dict): A dictionary of old audio_file: (new audio_file, new content hash) pairs
+    """
+    with locked_store():
+        for index_file in glob.glob(root_path + data_path + store_path + 'features_*.csv'):
+            with open(index_file, newline='') as f:
+                rows = [[*renames[record['audio_file']], record['row']] for record in csv.DictReader(f)
+                        if record['audio_file'] in renames]
+            with open(index_file, 'a', newline='') as f:
+                csv.writer(f).writerows(rows)
+
+
+def remove_recordings(audio_files):
+    """Method removes recordings deleted from disk from the index of every feature store. Their rows are dropped by the
+    next compaction of the store
+
+    Args:
+        audio_files (list): File names of the recordings
+    """
+    with locked_store():
+        for index_file in glob.glob(root_path + data_path + store_path + 'features_*.csv'):
+            with open(index_file, newline='') as f:
+                indexed = {record['audio_file'] for record in csv.DictReader(f)}
+            with open(index_file, 'a', newline='') as f:
+                csv.writer(f).writerows([audio_file, '', -1] for audio_file in audio_files if audio_file in indexed)
+
+
+def compact_store(key: str, dim: int, index: dict):
+    """Method rewrites a feature store keeping only the rows referenced by its index, the caller holding the feature
+    store lock.
+
+    The compacted feature array and index are written to temporary files, which replace the store once both are
+    complete. Memory maps of the replaced feature array keep reading the rows they were taken with.
+
+    Args:
+        key (str): The feature parameter key of the store
+        dim (int): Length of a single feature vector
+        index (dict): The current index of the store as audio_file: (content_hash, row) pairs
+    """
+    feature_file, index_file = store_files(key)
+    features = load_features(key, dim)
+    with open(feature_file + '.tmp', 'wb') as f:
+        f.write(np.ascontiguousarray(features[[row for _, row in index.values()]]).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    with open(index_file + '.tmp', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(index_columns)
+        writer.writerows([audio_file, digest, row] for row, (audio_file, (digest, _)) in enumerate(index.items()))
+        f.flush()
+        os.fsync(f.fileno())
+
+    open(feature_file + compaction_suffix, 'w').close()  # Both files complete, the compaction can be completed
+    finish_compaction(feature_file + compaction_suffix)
+
+
+def finish_compaction(marker: str):
+    """Method replaces a feature store by its compacted files, completing a compaction interrupted after they were
+    written
+
+    Args:
+        marker (str): Path of the compaction marker, being the feature array path followed by compaction_suffix
+    """
+    feature_file = marker[:-len(compaction_suffix)]
+    index_file = feature_file[:-len('.f32')] + '.csv'
+    for path in (feature_file, index_file):
+        if os.path.isfile(path + '.tmp'):
+            os.replace(path + '.tmp', path)
+    os.remove(marker)
+
+
+def stage_feature(audio, feature, params: dict):
+    """Method stages a feature computed during a live prediction, until its recording is stored.
+
+    Args:
+        audio (AudioData): The data structure containing the recorded user audio
+        feature (ndarray): The feature vector computed from the recording
+        params (dict): The feature extraction parameters used to compute the feature
+    """
+    if len(staged_features) >= staged_limit:
+        staged_features.pop(next(iter(staged_features)))  # Discard the oldest staged feature
+    staged_features[content_hash(audio.get_raw_data())] = (parameter_key(params), feature)
+
+
+def commit_staged_features(recordings):
+    """Method writes the staged features of recordings through to the feature store once the recordings are stored.
+
+    Args:
+        recordings (list): A list of (audio, audio_file, data) tuples, being the recorded AudioData, the file name of
+            the stored recording within the voice data folder and the bytes written to the recording file. Data is None
+            when the stored recording does not hold exactly the featurized samples, such as a trimmed or resampled
+            recording, whose staged feature is discarded rather than written
+    """
+    rows = dict()
+    for audio, audio_file, data in recordings:
+        staged = staged_features.pop(content_hash(audio.get_raw_data()), None)
+        if staged is not None and data is not None:
+            key, feature = staged
+            rows.setdefault(key, []).append((audio_file, content_hash(data), feature))
+    for key, key_rows in rows.items():
+        append_features(key, key_rows)
@@ -0,0 +1,141 @@
+"""Converts the WAV recordings of the voice corpus to FLAC.
+
+Every conversion is verified to decode to exactly the original samples before the audio store is pointed at the FLAC
+file. Stored features are carried over, as the samples are unchanged.
+
+Usage (from the project root):
+    python -m src.voice.FlacMigration --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import soundfile
+
+import Config
+import src.voice.AudioFeatures as AudioFeatures
+import src.voice.AudioStoreDatabase as AudioStoreDatabase
+import src.voice.FeatureStore as FeatureStore
+import src.voice.PackedCorpus as PackedCorpus
+import src.voice.VoiceStorage as VoiceStorage
+
+root_path = Config.root_dir()
+"""str: Path to the project root"""
+data_path = '/data/voice/'
+"""str: path from project root to voice data"""
+lossless_subtypes = {'PCM_16': ('int16', 'PCM_16'), 'PCM_24': ('int32', 'PCM_24'), 'PCM_U8': ('int16', 'PCM_S8')}
+"""dict: WAV sample formats FLAC stores losslessly, as WAV subtype: (sample dtype, FLAC subtype) pairs"""
+
+
+def convert_file(wav_path):
+    """Method converts a WAV file into a FLAC file next to it, verifying the FLAC file decodes to the same samples
+
+    Args:
+        wav_path (str): The complete path of the WAV file
+
+    Returns:
+        The path of the FLAC file, the sizes of the WAV and FLAC files and if the round trip is sample exact. The
+        FLAC file is removed when it is not
+    """
+    info = soundfile.info(wav_path)
+    if info.subtype not in lossless_subtypes:  # Floating point samples, FLAC would not be lossless
+        return None, os.path.getsize(wav_path), 0, False
+    dtype, subtype = lossless_subtypes[info.subtype]
+    samples, sr = soundfile.read(wav_path, dtype=dtype, always_2d=True)
+
+    flac_path = wav_path[:-len('.wav')] + '.flac'
+    soundfile.write(flac_path, samples, sr, format='FLAC', subtype=subtype)
+    decoded, decoded_sr = soundfile.read(flac_path, dtype=dtype, always_2d=True)
+    exact = decoded_sr == sr and np.array_equal(decoded, samples)
+    flac_size = os.path.getsize(flac_path)
+    if not exact:
+        os.remove(flac_path)
+    return flac_path, os.path.getsize(wav_path), flac_size, exact
+
+
+def migrate(workers=AudioFeatures.default_workers, keep_wav=False):
+    """Method converts the WAV recordings of the audio store to FLAC across a pool of worker processes.
+
+    Recordings whose conversion is not sample exact keep their WAV file.
+
+    Args:
+        workers (int): Number of worker processes
+        keep_wav (bool): Keep the WAV files of converted recordings
+
+    Returns:
+        A dictionary summarizing the migration
+    """
+    with VoiceStorage.reading_recordings():  # Assistant processes defer evicting the WAV files being converted
+        df = VoiceStorage.read_audio_store()
+        wav_files = [audio_file for audio_file in df['audio_file']
+                     if audio_file.endswith('.wav') and os.path.isfile(root_path + data_path + audio_file)]
+        paths = [root_path + data_path + audio_file for audio_file in wav_files]
+
+        context = multiprocessing.get_context(AudioFeatures.process_context)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = list(pool.map(convert_file, paths, chunksize=AudioFeatures.default_chunk_size))
+
+    renames = dict()
+    summary = {'recordings': len(wav_files), 'converted': 0, 'failed': [], 'wav_bytes': 0, 'flac_bytes': 0}
+    for audio_file, (flac_path, wav_size, flac_size, exact) in zip(wav_files, results):
+        if not exact:
+            summary['failed'].append(audio_file)
+            continue
+        with open(flac_path, 'rb') as f:
+            renames[audio_file] = (os.path.basename(flac_path), FeatureStore.content_hash(f.read()))
+        summary['converted'] += 1
+        summary['wav_bytes'] += wav_size
+        summary['flac_bytes'] += flac_size
+
+    with VoiceStorage.updating_audio_store():  # Locks out the assistant processes appending to the audio store
+        df = VoiceStorage.read_audio_store()  # Read again, keeping recordings stored during the conversion
+        stored = set(df['audio_file'])
+        evicted = [audio_file for audio_file in renames if audio_file not in stored]
+        df['audio_file'] = [renames[audio_file][0] if audio_file in renames else audio_file
+                            for audio_file in df['audio_file']]
+        VoiceStorage.replace_audio_store(df)  # Point the audio store at the FLAC files
+    for audio_file in evicted:  # Evicted during the conversion, the WAV file is removed by the evicting process
+        os.remove(root_path + data_path + renames.pop(audio_file)[0])
+    FeatureStore.rename_recordings(renames)
+    if not keep_wav:
+        with VoiceStorage.removing_recordings():  # Waits for assistant processes reading the WAV files
+            for audio_file in renames:
+                os.remove(root_path + data_path + audio_file)
+    VoiceStorage.rebuild_manifest()  # Stored sizes changed
+
+    print(f"Converted {summary['converted']}/{summary['recordings']} recordings to FLAC: "
+          f"{summary['wav_bytes'] / 1e6:.1f} MB -> {summary['flac_bytes'] / 1e6:.1f} MB "
+          f"({summary['flac_bytes'] / max(summary['wav_bytes'], 1):.0%})")
+    if summary['failed']:
+        print(f"{len(summary['failed'])} recordings kept as WAV, their FLAC round trip was not sample exact")
+    return summary
+
+
+def use_root(root):
+    """Method points the modules involved in the migration at a project root
+
+    Args:
+        root (str): The project root
+    """
+    global root_path
+    root_path = VoiceStorage.root_path = FeatureStore.root_path = PackedCorpus.root_path = root
+    AudioStoreDatabase.root_path = root
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the WAV recordings of the voice corpus to FLAC')
+    parser.add_argument('--workers', type=int, default=AudioFeatures.default_workers, help='worker processes')
+    parser.add_argument('--keep-wav', action='store_true', help='keep the WAV files of converted recordings')
+    parser.add_argument('--root', default=os.getcwd(), help='project root, defaults to the current directory')
+    args = parser.parse_args()
+
+    use_root(args.root)
+    summary = migrate(args.workers, args.keep_wav)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+candidate_configs = [
+    {'layers': [128, 80, 40], 'dropout': [0.2, 0.5, 0.5], 'batch_size': 20, 'learning_rate': 1e-3},
+    {'layers': [128, 80, 40], 'dropout': [0.1, 0.3, 0.3], 'batch_size': 64, 'learning_rate': 5e-4},
+    {'layers': [256, 128, 64], 'dropout': [0.2, 0.4, 0.4], 'batch_size': 32, 'learning_rate': 1e-3},
+    {'layers': [256, 128], 'dropout': [0.3, 0.5], 'batch_size': 20, 'learning_rate': 1e-3},
+    {'layers': [128, 64], 'dropout': [0.2, 0.3], 'batch_size': 32, 'learning_rate': 1e-3},
+    {'layers': [64, 32], 'dropout': [0.1, 0.2], 'batch_size': 64, 'learning_rate': 2e-3},
+]
+"""list: Candidate network configurations, as dense layer widths, dropout rates, batch size and learning rate"""
+rung_epochs = 5
+"""int: Training epochs of every candidate in the first round of successive halving"""
+reduction_factor = 2
+"""int: Each round of successive halving keeps 1 / reduction_factor of the candidates, training them this factor
+longer"""
+search_workers = min(len(candidate_configs), os.cpu_count() or 1)
+"""int: Number of worker processes training candidates in parallel"""
+process_context = 'spawn'
+"""str: Worker start method. Spawned workers initialize their own TensorFlow runtime, which does not survive forking"""
+
+
+def train_candidate(task):
+    """Method trains a candidate configuration for a round of successive halving, within a worker process.
+
+    Training continues from the weights of the previous round, and the CPU time of the round is measured after the
+    TensorFlow import.
+
+    Args:
+        task (dict): The candidate index, configuration, number of classes, feature directory, threads and epochs
+
+    Returns:
+        A dictionary of the validation loss and accuracy, and the CPU and wall-clock seconds of the round
+    """
+    import src.voice.VoiceModel as vm
+    tf = vm.load_tensorflow()
+    try:  # Only possible before the runtime of this worker is initialized
+        tf.config.threading.set_intra_op_parallelism_threads(task['threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        pass
+
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    data = {name: np.load(os.path.join(task['data_dir'], name + '.npy'), mmap_mode='r')
+            for name in ('x_train', 'y_train', 'x_val', 'y_val')}  # Shared precomputed features
+    model, _ = vm.create_model_structure(task['num_classes'], task['config'])
+    weights = os.path.join(task['data_dir'], f"candidate_{task['candidate']}.weights.h5")
+    if os.path.isfile(weights):
+        model.load_weights(weights)
+    model.fit(np.asarray(data['x_train']), np.asarray(data['y_train']), batch_size=task['config']['batch_size'],
+              epochs=task['epochs'], shuffle=True, verbose=0)
+    loss, accuracy = model.evaluate(np.asarray(data['x_val']), np.asarray(data['y_val']), verbose=0)
+    model.save_weights(weights)
+    return {'candidate': task['candidate'], 'loss': float(loss), 'accuracy': float(accuracy),
+            'cpu_seconds': time.process_time() - start_cpu, 'wall_seconds': time.perf_counter() - start_wall}
+
+
+def search(x_train, y_train, x_val, y_val, cpu_budget, configs=None, workers=None):
+    """Method selects the best candidate configuration by successive halving under a CPU time budget.
+
+    All candidates are trained in parallel worker processes on features shared through memory mapped files. After
+    every round the best 1 / reduction_factor of the candidates, by validation accuracy and loss, continue training
+    reduction_factor times longer. The search stops once a single candidate remains, or when the next round is
+    expected to exceed the CPU budget. The first round always runs.
+
+    Args:
+        x_train (ndarray): Training features
+        y_train (ndarray): One-hot training labels
+        x_val (ndarray): Validation features
+        y_val (ndarray): One-hot validation labels
+        cpu_budget (float): CPU seconds available to the search, summed over the workers
+        configs (list): Candidate configurations, defaults to candidate_configs
+        workers (int): Number of worker processes, defaults to search_workers
+
+    Returns:
+        The best configuration, the path of its trained weights and the per-candidate log. The weights are in a
+        temporary directory to be removed by the caller with os.path.dirname
+    """
+    configs = candidate_configs if configs is None else configs
+    workers = min(workers or search_workers, len(configs))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    data_dir = tempfile.mkdtemp(prefix='kurt_search_')
+    for name, array in (('x_train', x_train), ('y_train', y_train), ('x_val', x_val), ('y_val', y_val)):
+        np.save(os.path.join(data_dir, name + '.npy'), np.asarray(array, dtype=np.float32))
+
+    log = [{'candidate': i, 'config': config, 'epochs': 0, 'rounds': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0,
+            'examples_per_cpu_second': 0.0, 'loss': None, 'accuracy': None} for i, config in enumerate(configs)]
+    survivors, epochs, spent = list(range(len(configs))), rung_epochs, 0.0
+    try:
+        context = multiprocessing.get_context(process_context)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            while True:
+                tasks = [{'candidate': i, 'config': configs[i], 'num_classes': y_train.shape[1], 'data_dir': data_dir,
+                          'threads': threads, 'epochs': epochs - log[i]['epochs']} for i in survivors]
+                for result in pool.map(train_candidate, tasks):
+                    entry = log[result['candidate']]
+                    entry['epochs'] = epochs
+                    entry['rounds'] += 1
+                    entry['cpu_seconds'] += result['cpu_seconds']
+                    entry['wall_seconds'] += result['wall_seconds']
+                    entry['loss'], entry['accuracy'] = result['loss'], result['accuracy']
+                    entry['examples_per_cpu_second'] = len(x_train) * epochs / max(entry['cpu_seconds'], 1e-9)
+                    spent += result['cpu_seconds']
+
+                survivors.sort(key=lambda i: (-log[i]['accuracy'], log[i]['loss']))
+                if len(survivors) == 1:
+                    break
+                next_survivors = survivors[:max(1, len(survivors) // reduction_factor)]
+                next_epochs = epochs * reduction_factor
+                expected = sum(log[i]['cpu_seconds'] / log[i]['epochs'] * (next_epochs - epochs)
+                               for i in next_survivors)
+                if spent + expected > cpu_budget:  # Keep the best candidate trained so far
+                    print(f"Model search: CPU budget of {cpu_budget:.0f}s reached, {spent:.0f}s spent")
+                    break
+                survivors, epochs = next_survivors, next_epochs
+    except BaseException:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        raise
+
+    best = survivors[0]
+    print_log(log, best)
+    return configs[best], os.path.join(data_dir, f'candidate_{best}.weights.h5'), log
+
+
+def print_log(log, best):
+    """Method prints the cost and validation accuracy of every candidate
+
+    Args:
+        log (list): The per-candidate log of the search
+        best (int): Index of the selected candidate
+    """
+    print(f"{'candidate':>10}{'layers':>18}{'epochs':>8}{'cpu s':>9}{'ex/cpu s':>10}{'val acc':>9}{'val loss':>10}")
+    for entry in log:
+        marker = ' *' if entry['candidate'] == best else ''
+        print(f"{entry['candidate']:>10}{str(entry['config']['layers']):>18}{entry['epochs']:>8}"
+              f"{entry['cpu_seconds']:>9.1f}{entry['examples_per_cpu_second']:>10.0f}{entry['accuracy']:>9.3f}"
+              f"{entry['loss']:>10.4f}{marker}")
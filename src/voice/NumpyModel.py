@@ -0,0 +1,230 @@
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+magic = b'KVDN'
+"""bytes: Magic bytes identifying an exported dense network file"""
+format_version = 2
+"""int: Version of the exported dense network file format. Version 2 adds int8 quantized layers"""
+alignment = 64
+"""int: Byte alignment of the weight payload and of every weight array within it"""
+
+
+class DenseNetwork:
+    """This class is a TensorFlow-free inference engine for the voice classification model.
+
+    The network is a stack of dense layers evaluated with numpy, mirroring the Keras model.predict interface so it can
+    serve in place of the Keras model.
+
+    Args:
+        layers (list): A list of (weights, bias, activation) tuples, ordered from input to output
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    def predict(self, x, verbose=0):
+        """Method evaluates the network on a batch of feature vectors
+
+        Args:
+            x (ndarray): A (batch, inputs) array of feature vectors
+            verbose (int): Unused, accepted for compatibility with Keras
+
+        Returns:
+            A (batch, outputs) float32 array of the network outputs
+        """
+        x = np.asarray(x, dtype=np.float32).reshape(-1, self.layers[0][0].shape[0])
+        for weights, bias, activation in self.layers:
+            x = activate(x @ weights + bias, activation)
+        return x
+
+    def truncated(self):
+        """Method returns the network without its output layer, producing the last hidden layer activations
+
+        Returns:
+            A DenseNetwork sharing the weights of all but the last layer
+        """
+        return type(self)(self.layers[:-1])
+
+
+class QuantizedNetwork(DenseNetwork):
+    """This class is the int8 quantized variant of the DenseNetwork inference engine.
+
+    Layer inputs are quantized to int8 with calibrated per-channel scales, which are folded into the int8 weights. The
+    integer products are accumulated by float32 matrix multiplication, being exact for layers of up to 1040 inputs
+    (127 * 127 * 1040 < 2 ** 24) and far faster than numpy integer matrix multiplication. The layer outputs are
+    dequantized with per-output-channel weight scales before the bias and activation are applied.
+
+    Args:
+        layers (list): A list of (integer valued weights, bias, activation, reciprocal input scale, weight scale)
+            tuples, ordered from input to output
+    """
+
+    def predict(self, x, verbose=0):
+        """Method evaluates the network on a batch of feature vectors
+
+        Args:
+            x (ndarray): A (batch, inputs) array of feature vectors
+            verbose (int): Unused, accepted for compatibility with Keras
+
+        Returns:
+            A (batch, outputs) float32 array of the network outputs
+        """
+        x = np.asarray(x, dtype=np.float32).reshape(-1, self.layers[0][0].shape[0])
+        for weights, bias, activation, input_inverse, weight_scale in self.layers:
+            x = x * input_inverse
+            np.clip(np.rint(x, out=x), -127, 127, out=x)  # Integer valued float32 inputs
+            x = x @ weights
+            x *= weight_scale
+            x += bias
+            x = activate(x, activation)
+        return x
+
+
+def activate(x, activation):
+    """Method applies a layer activation function
+
+    Args:
+        x (ndarray): The layer pre-activations
+        activation (str): The name of the Keras activation function
+
+    Returns:
+        The layer activations
+    """
+    if activation == 'relu':
+        return np.maximum(x, 0)
+    if activation == 'softmax':
+        exponent = np.exp(x - x.max(axis=1, keepdims=True))  # Shift for numerical stability
+        return exponent / exponent.sum(axis=1, keepdims=True)
+    if activation == 'linear':
+        return x
+    raise ValueError(f"Unsupported activation: {activation}")
+
+
+def export_model(keras_model, file_path):
+    """Method exports the dense layers of a Keras model to a compact, checksummed, memory-mappable file.
+
+    The file contains the magic bytes, a JSON header describing every layer and the SHA-256 of the weight payload,
+    followed by the aligned float32 weight payload. Dropout layers are inference no-ops and are omitted.
+
+    Args:
+        keras_model (Model): The trained Keras voice classification model
+        file_path (str): Path of the exported file
+    """
+    layers, arrays, offset = [], [], 0
+    for layer in keras_model.layers:
+        if not layer.get_weights():  # Dropout layers carry no weights
+            continue
+        weights, bias = [np.ascontiguousarray(array, dtype=np.float32) for array in layer.get_weights()]
+        entry = {'activation': layer.get_config()['activation'], 'shape': list(weights.shape)}
+        for name, array in (('weights', weights), ('bias', bias)):
+            padding = -offset % alignment
+            arrays.append(b'\0' * padding + array.tobytes())
+            entry[name] = offset + padding
+            offset += padding + array.nbytes
+        layers.append(entry)
+
+    write_model(file_path, layers, b''.join(arrays))
+
+
+def quantize_model(network, calibration, file_path):
+    """Method quantizes a DenseNetwork to int8 and exports it in the dense network file format.
+
+    The input scale of every layer is calibrated per channel on the maximum absolute input over the calibration
+    features, and folded into the layer weights, which are then quantized with a scale per output channel.
+
+    Args:
+        network (DenseNetwork): The float32 inference engine of the trained model
+        calibration (ndarray): A (samples, inputs) array of representative feature vectors
+        file_path (str): Path of the exported quantized file
+    """
+    layers, arrays, offset = [], [], 0
+    x = np.asarray(calibration, dtype=np.float32)
+    for weights, bias, activation in network.layers:
+        input_scale = channel_scale(np.abs(x).max(axis=0))  # Per input channel
+        folded = weights * input_scale[:, None]
+        weight_scale = channel_scale(np.abs(folded).max(axis=0))  # Per output channel
+        quantized = np.rint(folded / weight_scale).astype(np.int8)
+        x = activate(x @ weights + bias, activation)  # Float32 inputs of the next layer
+
+        entry = {'activation': activation, 'shape': list(weights.shape), 'dtype': 'int8'}
+        for name, array in (('weights', quantized), ('bias', bias), ('input_scale', input_scale),
+                            ('weight_scale', weight_scale)):
+            array = np.ascontiguousarray(array, dtype=np.int8 if name == 'weights' else np.float32)
+            padding = -offset % alignment
+            arrays.append(b'\0' * padding + array.tobytes())
+            entry[name] = offset + padding
+            offset += padding + array.nbytes
+        layers.append(entry)
+    write_model(file_path, layers, b''.join(arrays))
+
+
+def channel_scale(max_abs):
+    """Method returns the int8 quantization scales of channels, mapping their maximum absolute value to 127
+
+    Args:
+        max_abs (ndarray): The maximum absolute value of every channel
+
+    Returns:
+        The float32 scale of every channel, 1 for channels that are always zero
+    """
+    return np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+
+
+def write_model(file_path, layers, payload):
+    """Method writes the magic bytes, JSON header and aligned payload of an exported dense network file
+
+    Args:
+        file_path (str): Path of the exported file
+        layers (list): The header entries describing every layer
+        payload (bytes): The weight payload
+    """
+    header = json.dumps({'version': format_version, 'layers': layers,
+                         'sha256': hashlib.sha256(payload).hexdigest()}).encode()
+    header += b' ' * (-(len(magic) + 4 + len(header)) % alignment)  # Align the start of the payload
+
+    with open(file_path, 'wb') as f:
+        f.write(magic + struct.pack('<I', len(header)) + header + payload)
+
+
+def load_model(file_path, verify=True):
+    """Method memory maps an exported dense network file as a DenseNetwork, or as a QuantizedNetwork when quantized
+
+    Args:
+        file_path (str): Path of the exported file
+        verify (bool): Verify the SHA-256 checksum of the weight payload
+
+    Returns:
+        The DenseNetwork (or QuantizedNetwork) inference engine
+
+    Raises:
+        ValueError: The file is not an exported dense network, or its checksum does not match
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{file_path} is not an exported dense network")
+        header_length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length))
+
+    payload_offset = len(magic) + 4 + header_length
+    payload = np.memmap(file_path, dtype=np.uint8, mode='r', offset=payload_offset)
+    if verify and hashlib.sha256(payload).hexdigest() != header['sha256']:
+        raise ValueError(f"{file_path} checksum mismatch")
+
+    layers = []
+    quantized = any(entry.get('dtype') == 'int8' for entry in header['layers'])
+    for entry in header['layers']:
+        inputs, outputs = entry['shape']
+        bias = np.frombuffer(payload, dtype=np.float32, count=outputs, offset=entry['bias'])
+        if not quantized:
+            weights = np.frombuffer(payload, dtype=np.float32, count=inputs * outputs, offset=entry['weights'])
+            layers.append((weights.reshape(inputs, outputs), bias, entry['activation']))
+            continue
+        weights = np.frombuffer(payload, dtype=np.int8, count=inputs * outputs, offset=entry['weights'])
+        input_scale = np.frombuffer(payload, dtype=np.float32, count=inputs, offset=entry['input_scale'])
+        weight_scale = np.frombuffer(payload, dtype=np.float32, count=outputs, offset=entry['weight_scale'])
+        layers.append((weights.reshape(inputs, outputs).astype(np.float32), bias, entry['activation'], 1 / input_scale,
+                       weight_scale))  # Widened once, for exact integer accumulation in float32
+    return QuantizedNetwork(layers) if quantized else DenseNetwork(layers)
@@ -0,0 +1,344 @@
+import csv
+import glob
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a single assistant process is expected
+    fcntl = None
+
+import Config
+import src.voice.AudioFeatures as AudioFeatures
+
+root_path = Config.root_dir()
+"""str: Path to the project root"""
+data_path = '/data/voice/'
+"""str: path from project root to voice data"""
+corpus_path = 'corpus/'
+"""str: Path from the voice data folder to the packed corpus"""
+index_name = 'corpus_index.csv'
+"""str: Name of the csv index of the packed corpus"""
+index_columns = ['audio_file', 'shard', 'offset', 'samples', 'rate']
+"""list: Columns of the packed corpus index, offsets and lengths being in samples and the rate being the sample rate the
+recording was captured at. A shard of -1 marks a removed recording"""
+legacy_rate = 16000
+"""int: Sample rate (Hz) of the recordings packed before the index recorded sample rates, which were resampled to it"""
+lock_name = 'corpus.lock'
+"""str: Name of the lock file in the voice data folder, serializing the writers of the packed corpus across
+processes"""
+corpus_lock = threading.RLock()
+"""RLock: Lock serializing the writers of the packed corpus within the process, such as the recording writer appending
+while the retraining thread compacts"""
+lock_file = None
+"""file: The open lock file while the process holds the packed corpus lock, None otherwise"""
+sample_dtype = np.dtype('<i2')
+"""dtype: Sample format of the shards, 16-bit little-endian PCM"""
+shard_limit = 512 * 1024 * 1024
+"""int: Size (bytes) at which a shard is closed, and further recordings are appended to a new shard"""
+convert_chunk_size = 256
+"""int: Number of WAV files decoded and appended at a time by the converter"""
+shards = dict()
+"""dict: Memory maps of the shards opened by this process as shard: memmap pairs"""
+cached_index = (None, dict())
+"""tuple: The last index read by this process, as (index file size, index) pair"""
+
+
+def corpus_directory():
+    """Method returns the path of the packed corpus directory"""
+    return root_path + data_path + corpus_path
+
+
+def shard_file(shard: int, directory=None):
+    """Method returns the path of a shard of the packed corpus
+
+    Args:
+        shard (int): Number of the shard
+        directory (str): Directory of the corpus, defaults to the packed corpus directory
+
+    Returns:
+        The path of the raw PCM shard file
+    """
+    return (directory or corpus_directory()) + f'shard_{shard:05d}.pcm'
+
+
+def index_file(directory=None):
+    """Method returns the path of the index of the packed corpus, within directory when given"""
+    return (directory or corpus_directory()) + index_name
+
+
+@contextmanager
+def locked_corpus():
+    """Method holds the packed corpus lock, exclusive to one thread of one process. The lock is re-entrant within the
+    thread holding it
+    """
+    global lock_file
+    with corpus_lock:
+        if lock_file is not None:
+            yield
+            return
+        os.makedirs(root_path + data_path, exist_ok=True)
+        with open(root_path + data_path + lock_name, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+            lock_file = f
+            try:
+                yield
+            finally:
+                lock_file = None
+
+
+def load_index():
+    """Method reads the index of the packed corpus.
+
+    Index rows pointing past the end of their shard (an interrupted append) are ignored, and the latest row of a
+    recording takes precedence over earlier ones. Recordings indexed without a sample rate are at legacy_rate.
+
+    Returns:
+        A dictionary of audio_file: (shard, offset, samples, rate) pairs
+    """
+    if not os.path.isfile(index_file()):
+        return dict()
+
+    shard_samples = dict()
+    index = dict()
+    with open(index_file(), newline='') as f:
+        for record in csv.DictReader(f):
+            shard, offset, samples = int(record['shard']), int(record['offset']), int(record['samples'])
+            if shard < 0:  # Removed recording
+                index.pop(record['audio_file'], None)
+                continue
+            if shard not in shard_samples:
+                path = shard_file(shard)
+                shard_samples[shard] = os.path.getsize(path) // sample_dtype.itemsize if os.path.isfile(path) else 0
+            if offset + samples <= shard_samples[shard]:
+                index[record['audio_file']] = (shard, offset, samples, int(record.get('rate') or legacy_rate))
+    return index
+
+
+def current_index():
+    """Method returns the index of the packed corpus, only reading it again once the index file has changed size
+
+    Returns:
+        A dictionary of audio_file: (shard, offset, samples, rate) pairs
+    """
+    global cached_index
+    size = os.path.getsize(index_file()) if os.path.isfile(index_file()) else 0
+    if cached_index[0] != size:
+        cached_index = (size, load_index())
+    return cached_index[1]
+
+
+def append_recordings(entries: list, directory=None):
+    """Method appends recordings to the last shard of the packed corpus, opening a new shard once it is full.
+
+    The samples are written before their index rows, so an interrupted append never indexes a partial recording.
+    Appends hold the packed corpus lock, so a concurrent compaction never swaps the corpus away from under them.
+
+    Args:
+        entries (list): A list of (audio_file, samples, rate) tuples, the samples being int16 arrays at the sample rate
+            the recording was captured at
+        directory (str): Directory of the corpus, defaults to the packed corpus directory
+    """
+    if not entries:
+        return
+    with locked_corpus():
+        directory = directory or corpus_directory()
+        os.makedirs(directory, exist_ok=True)
+        existing = sorted(glob.glob(directory + 'shard_*.pcm'))
+        shard = int(os.path.basename(existing[-1])[6:11]) if existing else 0
+
+        rows = []
+        for audio_file, samples, rate in entries:
+            data = np.ascontiguousarray(samples, dtype=sample_dtype).tobytes()
+            path = shard_file(shard, directory)
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+            size -= size % sample_dtype.itemsize  # Drop a partially written sample left by an interrupted append
+            if size > 0 and size + len(data) > shard_limit:  # Shard is full, start the next one
+                shard, size = shard + 1, 0
+            with open(shard_file(shard, directory), 'ab') as f:
+                f.truncate(size)
+                f.write(data)
+            rows.append([audio_file, shard, size // sample_dtype.itemsize, len(data) // sample_dtype.itemsize, rate])
+        write_index_rows(rows, directory)
+
+
+def write_index_rows(rows, directory=None):
+    """Method appends rows to the index of the packed corpus, writing the header of a new index. An index written
+    before sample rates were recorded is first rewritten with the legacy_rate of its recordings
+
+    Args:
+        rows (list): The index rows, ordered as index_columns
+        directory (str): Directory of the corpus, defaults to the packed corpus directory
+    """
+    index_exists = os.path.isfile(index_file(directory))
+    if index_exists:
+        with open(index_file(directory), newline='') as f:
+            records = list(csv.reader(f))
+        if records and records[0] != index_columns:
+            with open(index_file(directory) + '.tmp', 'w', newline='') as f:
+                csv.writer(f).writerows([index_columns] + [record + [legacy_rate] for record in records[1:]])
+            os.replace(index_file(directory) + '.tmp', index_file(directory))
+    with open(index_file(directory), 'a', newline='') as f:
+        writer = csv.writer(f)
+        if not index_exists:
+            writer.writerow(index_columns)
+        writer.writerows(rows)
+
+
+def remove_recordings(audio_files):
+    """Method removes recordings from the packed corpus.
+
+    Removals are appended to the index. Their samples stay in the shards until the removed samples outweigh the
+    packed ones, at which point the corpus is compacted.
+
+    Args:
+        audio_files (list): File names of the packed recordings to remove
+    """
+    with locked_corpus():
+        index = load_index()
+        removed = [audio_file for audio_file in audio_files if audio_file in index]
+        if not removed:
+            return
+        write_index_rows([[audio_file, -1, 0, 0, 0] for audio_file in removed])
+
+        packed = sum(entry[2] for audio_file, entry in index.items() if audio_file not in removed)
+        stored = sum(os.path.getsize(path) for path in glob.glob(corpus_directory() + 'shard_*.pcm'))
+        if stored > 2 * packed * sample_dtype.itemsize:  # Mostly removed samples, rewrite the corpus
+            compact_corpus()
+
+
+def compact_corpus():
+    """Method rewrites the packed corpus keeping only the recordings referenced by its index.
+
+    The compacted corpus is written next to the current one and swapped in once complete. The packed corpus lock is held
+    throughout, so no recording appended meanwhile is left behind in the replaced corpus.
+    """
+    global cached_index
+    with locked_corpus():
+        index = load_index()
+        compacted = corpus_directory().rstrip('/') + '_compact/'
+        shutil.rmtree(compacted, ignore_errors=True)
+        os.makedirs(compacted)
+        audio_files = sorted(index, key=lambda audio_file: index[audio_file][:2])  # Sequential reads of the shards
+        for start in range(0, len(audio_files), convert_chunk_size):
+            append_recordings([(audio_file, np.array(read_samples(audio_file, index)), index[audio_file][3])
+                               for audio_file in audio_files[start:start + convert_chunk_size]], compacted)
+
+        shards.clear()  # Release the memory maps of the replaced shards
+        cached_index = (None, dict())
+        replaced = corpus_directory().rstrip('/') + '_replaced/'
+        os.replace(corpus_directory(), replaced)
+        os.replace(compacted, corpus_directory())
+        shutil.rmtree(replaced)
+
+
+def open_shard(shard: int, end: int):
+    """Method returns the memory map of a shard, remapping it when it has grown past the mapped length
+
+    Args:
+        shard (int): Number of the shard
+        end (int): Number of samples the memory map must cover
+
+    Returns:
+        A read-only int16 memory map of the shard
+    """
+    if shard not in shards or len(shards[shard]) < end:
+        shards[shard] = np.memmap(shard_file(shard), dtype=sample_dtype, mode='r')
+    return shards[shard]
+
+
+def read_samples(audio_file: str, index=None):
+    """Method slices the samples of a packed recording out of its shard, without copying them
+
+    Args:
+        audio_file (str): File name of the recording
+        index (dict): The corpus index, defaults to the current index
+
+    Returns:
+        A read-only int16 view of the recording samples at the sample rate of the recording
+
+    Raises:
+        KeyError: The recording is not packed
+    """
+    index = current_index() if index is None else index
+    shard, offset, samples, _ = index[audio_file]
+    return open_shard(shard, offset + samples)[offset:offset + samples]
+
+
+def to_samples(y):
+    """Method converts a floating point waveform into int16 samples, the inverse of the scaling applied on decoding
+
+    Args:
+        y (ndarray): The waveform, scaled to [-1, 1)
+
+    Returns:
+        A numpy int16 array of the samples
+    """
+    return np.clip(np.round(np.asarray(y) * 32768.0), -32768, 32767).astype(sample_dtype)
+
+
+def recording_features(audio_files, trim=None):
+    """Method featurizes a chunk of recordings, reading packed recordings from the memory mapped shards.
+
+    Recordings not packed yet are decoded from their WAV file.
+
+    Args:
+        audio_files (list): File names of the recordings
+        trim (bool): Trim silence first, defaults to AudioFeatures.trim_silence
+
+    Returns:
+        A (len(audio_files), n_mels) float32 array of features
+    """
+    index = current_index()
+    return np.stack([AudioFeatures.mel_band_mean(*load_recording(audio_file, index), trim=trim)
+                     for audio_file in audio_files])
+
+
+def load_recording(audio_file: str, index=None):
+    """Method decodes a recording from the memory mapped shards, or from its WAV file when not packed yet
+
+    Args:
+        audio_file (str): File name of the recording
+        index (dict): The corpus index, defaults to the current index
+
+    Returns:
+        A numpy float32 array of the waveform and its sample rate
+    """
+    index = current_index() if index is None else index
+    if audio_file in index:
+        return read_samples(audio_file, index).astype(np.float32) / 32768.0, index[audio_file][3]  # Scaled to [-1, 1)
+    return AudioFeatures.load_audio(root_path + data_path + audio_file)
+
+
+def convert_directory(directory=None, remove_files=False):
+    """Method packs the WAV (and FLAC) recordings of a directory into the corpus, at their source sample rate.
+
+    Recordings already packed are skipped, so an interrupted conversion can be resumed. Recordings are packed under
+    their file name, which keeps audio_store.csv valid.
+
+    Args:
+        directory (str): Directory of the WAV recordings, defaults to the voice data folder
+        remove_files (bool): Delete every WAV file once its recording is indexed in the corpus
+
+    Returns:
+        The number of recordings packed
+    """
+    directory = root_path + data_path if directory is None else directory
+    index = load_index()
+    audio_files = glob.glob(os.path.join(directory, '*.wav')) + glob.glob(os.path.join(directory, '*.flac'))
+    wav_files = [path for path in sorted(audio_files) if os.path.basename(path) not in index]
+
+    for start in range(0, len(wav_files), convert_chunk_size):
+        chunk = wav_files[start:start + convert_chunk_size]
+        decoded = [AudioFeatures.load_audio(path) for path in chunk]
+        append_recordings([(os.path.basename(path), to_samples(y), sr) for path, (y, sr) in zip(chunk, decoded)])
+        if remove_files:
+            for path in chunk:
+                os.remove(path)
+        print(f"Packed {min(start + convert_chunk_size, len(wav_files))}/{len(wav_files)} recordings")
+    return len(wav_files)
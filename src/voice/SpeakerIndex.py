@@ -0,0 +1,235 @@
+import numpy as np
+
+exact_limit = 8192
+"""int: Number of voice prints up to which the index holds a single list, searched exhaustively. Below a few thousand
+voice prints one matrix product is faster than probing lists"""
+list_factor = 1.0
+"""float: The index holds list_factor * sqrt(voice prints) lists, balancing the coarse and the list search"""
+search_probes = 8
+"""int: Number of closest lists searched per query. More probes trade lookup time for recall"""
+kmeans_iterations = 10
+"""int: Number of spherical k-means iterations placing the list centroids"""
+rebuild_factor = 2
+"""float: The lists are rebuilt once the number of voice prints has grown or shrunk by this factor since they were
+built, keeping them balanced"""
+seed = 0
+"""int: Random seed of the list centroid initialization"""
+
+
+def unit(vectors):
+    """Method scales vectors to unit length, so their dot products are cosine similarities
+
+    Args:
+        vectors (ndarray): A (n, dimensions) array of vectors
+
+    Returns:
+        A float32 array of the unit length vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def spherical_kmeans(vectors, clusters):
+    """Method clusters unit vectors by cosine similarity
+
+    Args:
+        vectors (ndarray): A (n, dimensions) array of unit vectors
+        clusters (int): Number of clusters
+
+    Returns:
+        A (clusters, dimensions) float32 array of unit centroids and the cluster of every vector
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(kmeans_iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]  # Reseed empty clusters
+        centroids = unit(sums)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class SpeakerIndex:
+    """This class is an approximate nearest neighbour index of voice prints, by cosine similarity.
+
+    Voice prints are partitioned into lists around centroids (an inverted file index). A lookup compares a query with
+    the centroids and searches only the search_probes closest lists, so it grows with the square root of the number of
+    voice prints. The index is immutable: inserting or removing a voice print returns a new index sharing all unchanged
+    lists, so a served index is never modified by an enrollment.
+
+    Args:
+        centroids (ndarray): A (lists, dimensions) array of unit list centroids
+        lists (tuple): A tuple of (names, voice prints) pairs per list, being an object array of names and a
+            (size, dimensions) float32 array of unit voice prints
+        locations (dict): Dictionary of the list holding every voice print as name: list pairs. Removed voice prints
+            are kept with list -1, as copying a dictionary is far faster without deletions
+        size (int): Number of voice prints
+        built_size (int): Number of voice prints the lists were built for
+        flat (tuple): The contiguous layout of the lists, computed on first use when None
+    """
+
+    def __init__(self, centroids, lists, locations, size, built_size, flat=None):
+        self.centroids = centroids
+        self.lists = lists
+        self.locations = locations
+        self.size = size
+        self.built_size = built_size
+        self.flat = flat
+
+    @classmethod
+    def build(cls, names, vectors):
+        """Method builds an index of voice prints
+
+        Args:
+            names (list): Names of the users
+            vectors (ndarray): A (users, dimensions) array of voice prints, in any scale
+
+        Returns:
+            The SpeakerIndex
+        """
+        names = np.asarray(names, dtype=object)
+        vectors = unit(vectors)
+        if len(names) <= exact_limit:
+            centroids = unit(vectors.sum(axis=0, keepdims=True)) if len(names) else np.zeros((0, 0), np.float32)
+            assignment = np.zeros(len(names), dtype=int)
+        else:
+            centroids, assignment = spherical_kmeans(vectors, int(list_factor * np.sqrt(len(names))))
+        order = np.argsort(assignment, kind='stable')  # Lists are views of one contiguous layout
+        names, vectors = names[order], vectors[order]
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        lists = tuple((names[start:end], vectors[start:end]) for start, end in zip(offsets[:-1], offsets[1:]))
+        locations = dict(zip(names.tolist(), assignment[order].tolist()))
+        return cls(centroids, lists, locations, len(names), len(names), (names, vectors, offsets))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, name):
+        return self.locations.get(name, -1) >= 0
+
+    def vectors(self):
+        """Method returns the names and unit voice prints of the indexed users, list by list"""
+        names = np.concatenate([list_names for list_names, _ in self.lists]) if self.lists else np.array([], object)
+        vectors = np.concatenate([list_vectors for _, list_vectors in self.lists]) if self.lists else None
+        return names, vectors
+
+    def inserted(self, name, vector):
+        """Method returns the index with a user's voice print inserted, replacing their earlier voice print
+
+        Args:
+            name (str): Name of the user
+            vector (ndarray): The voice print, in any scale
+
+        Returns:
+            The new SpeakerIndex
+        """
+        index = self.removed(name) if name in self else self
+        size = len(index) + 1
+        if len(index.lists) <= 1 and size > exact_limit or size > rebuild_factor * max(index.built_size, exact_limit) \
+                or not index.lists:
+            names, vectors = index.vectors()
+            vectors = unit(vector)[None] if vectors is None else np.vstack([vectors, unit(vector)[None]])
+            return type(self).build(np.append(names, np.array([name], dtype=object)), vectors)
+
+        vector = unit(vector)
+        i = int(np.argmax(index.centroids @ vector))
+        list_names, list_vectors = index.lists[i]
+        lists = index.lists[:i] + ((np.append(list_names, np.array([name], dtype=object)),
+                                    np.vstack([list_vectors, vector[None]])),) + index.lists[i + 1:]
+        locations = dict(index.locations)
+        locations[name] = i
+        return type(self)(index.centroids, lists, locations, index.size + 1, index.built_size)
+
+    def removed(self, name):
+        """Method returns the index without a user's voice print
+
+        Args:
+            name (str): Name of the user
+
+        Returns:
+            The new SpeakerIndex, being the index itself when the user is not indexed
+        """
+        if name not in self:
+            return self
+        locations = dict(self.locations)
+        i, locations[name] = locations[name], -1
+        if (self.size - 1) * rebuild_factor < self.built_size and self.built_size > exact_limit:
+            names, vectors = self.vectors()
+            keep = names != name
+            return type(self).build(names[keep], vectors[keep])
+
+        list_names, list_vectors = self.lists[i]
+        keep = list_names != name
+        lists = self.lists[:i] + ((list_names[keep], list_vectors[keep]),) + self.lists[i + 1:]
+        return type(self)(self.centroids, lists, locations, self.size - 1, self.built_size)
+
+    def search(self, queries, probes=None):
+        """Method finds the closest voice print of every query, within the probes lists closest to the query
+
+        Args:
+            queries (ndarray): A (batch, dimensions) array of unit embeddings
+            probes (int): Number of lists searched per query, defaults to search_probes
+
+        Returns:
+            An object array of the closest user names, 'Unknown' when the index is empty, and a float32 array of the
+            cosine similarities
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        names = np.full(len(queries), 'Unknown', dtype=object)
+        scores = np.zeros(len(queries), dtype=np.float32)
+        if len(self) == 0:
+            return names, scores
+        if len(self.lists) == 1:  # Exhaustive search
+            list_names, list_vectors = self.lists[0]
+            similarity = queries @ list_vectors.T
+            best = np.argmax(similarity, axis=1)
+            return list_names[best], similarity[np.arange(len(best)), best]
+
+        probes = min(search_probes if probes is None else probes, len(self.lists))
+        closest = np.argpartition(-(queries @ self.centroids.T), probes - 1, axis=1)[:, :probes]
+        flat_names, flat_vectors, offsets = self.layout()
+        scores[:] = -np.inf
+        best = np.zeros(len(queries), dtype=int)
+        if len(queries) == 1:  # A live utterance, compared with the probed lists in place
+            starts, query = offsets.tolist(), queries[0]
+            for i in closest[0].tolist():
+                similarity = flat_vectors[starts[i]:starts[i + 1]] @ query
+                row = similarity.argmax() if len(similarity) else 0
+                if len(similarity) and similarity[row] > scores[0]:
+                    best[0], scores[0] = starts[i] + row, similarity[row]
+        else:  # Every probed list is compared with all queries probing it at once
+            order = np.argsort(closest.ravel(), kind='stable')
+            probed = closest.ravel()[order]
+            bounds = np.r_[0, np.flatnonzero(np.diff(probed)) + 1, len(probed)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                i = probed[start]
+                if offsets[i] == offsets[i + 1]:
+                    continue
+                members = order[start:end] // probes
+                similarity = queries[members] @ flat_vectors[offsets[i]:offsets[i + 1]].T
+                rows = similarity.argmax(axis=1)
+                list_scores = similarity[np.arange(len(members)), rows]
+                closer = list_scores > scores[members]
+                best[members[closer]], scores[members[closer]] = offsets[i] + rows[closer], list_scores[closer]
+
+        unmatched = np.isneginf(scores)  # The probed lists were emptied by removals
+        if unmatched.any():
+            best[unmatched] = np.argmax(queries[unmatched] @ flat_vectors.T, axis=1)
+            scores[unmatched] = np.einsum('ij,ij->i', queries[unmatched], flat_vectors[best[unmatched]])
+        return flat_names[best], scores
+
+    def layout(self):
+        """Method returns the voice prints of all lists in one contiguous array, ordered list by list, so the probed
+        lists of a batch of queries are gathered in one step. The layout is computed on first use, once per index.
+
+        Returns:
+            An object array of names, a (voice prints, dimensions) float32 array of voice prints and the offset of
+            every list within them, followed by the number of voice prints
+        """
+        if self.flat is None:
+            names, vectors = self.vectors()
+            offsets = np.cumsum([0] + [len(list_names) for list_names, _ in self.lists])
+            self.flat = (names, np.ascontiguousarray(vectors), offsets)
+        return self.flat
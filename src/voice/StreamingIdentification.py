@@ -0,0 +1,126 @@
+import numpy as np
+
+import src.voice.AudioFeatures as AudioFeatures
+import src.voice.VoiceActivity as VoiceActivity
+import src.voice.VoiceModel as vm
+
+confidence_threshold = None
+"""float: Identification confidence at which streaming stops early. None uses the threshold of identify_user, being
+VoiceModel.identification_threshold for the identification mode"""
+minimum_seconds = 1.0
+"""float: Seconds of speech required before the first identification attempt"""
+update_seconds = 0.5
+"""float: Seconds of speech between identification attempts"""
+
+
+class StreamingIdentifier:
+    """This class identifies the speaker while audio is still being captured.
+
+    Audio chunks are analysed into the mel band energies of their STFT frames. Every update_seconds of speech, the mel
+    band mean of the frames so far is classified, and identification stops early once the confidence reaches the
+    threshold. When the served model was trained on trimmed features, silent frames are gated as VoiceActivity trims
+    them, so the streamed features match the training features.
+
+    Args:
+        sample_rate (int): Sample rate of the captured audio
+        sample_width (int): Bytes per sample of the captured audio
+    """
+
+    def __init__(self, sample_rate, sample_width):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        frame_length, hop = AudioFeatures.mel_analysis(sample_rate)[:2]
+        self.buffer = np.zeros(frame_length // 2, dtype=np.float32)  # Center padding of the first frame
+        self.frame_rate = sample_rate / hop
+        self.bands = []
+        self.energy = []
+        self.frames = 0
+        self.samples = 0
+        self.next_update = int(minimum_seconds * sample_rate)
+        self.state = vm.serving_state()  # One model version for the whole capture
+        self.trim = vm.trims(self.state[4])  # As the served model's features
+        self.name = None
+        self.score = 0.0
+        self.decided = False
+
+    def add_chunk(self, data):
+        """Method adds a captured chunk of PCM audio, identifying the speaker when an update is due
+
+        Args:
+            data (bytes): Little-endian signed PCM samples
+        """
+        if self.decided:  # Early exit, the speaker is known
+            return
+        chunk = pcm_to_float(data, self.sample_width)
+        self.buffer = np.concatenate([self.buffer, chunk])
+        self.samples += len(chunk)
+
+        bands, energy, consumed = AudioFeatures.stream_bands(self.buffer, self.sample_rate)
+        self.bands.append(bands)
+        self.energy.append(energy)
+        self.frames += len(bands)
+        self.buffer = self.buffer[consumed:]  # Keep the overlap with the next frame
+
+        if self.samples >= self.next_update and self.frames > 0:
+            self.identify()
+            self.next_update = self.samples + int(update_seconds * self.sample_rate)
+
+    def identify(self):
+        """Method classifies the mel band mean of the frames so far, deciding on the speaker once confident enough"""
+        self.bands, self.energy = [np.concatenate(self.bands)], [np.concatenate(self.energy)]
+        bands = self.bands[0]
+        if self.trim:  # Only speech contributes, as in the trimmed training features
+            bands = bands[VoiceActivity.speech_frames(self.energy[0], self.frame_rate)]
+        feature = bands.mean(axis=0)
+        names, scores = vm.identify_features(feature, self.state)
+        self.name, self.score = names[0], float(scores[0])
+        threshold = vm.identification_threshold() if confidence_threshold is None else confidence_threshold
+        self.decided = self.score >= threshold
+        if self.decided:
+            print(f"Identified user while listening: {self.name} with confidence: {round(self.score * 100, 2)}% "
+                  f"after {self.samples / self.sample_rate:.1f}s")
+
+
+class TappedStream:
+    """This class wraps a microphone stream, passing the audio read by the recognizer on to a streaming identifier.
+
+    Chunks are passed on from the first chunk louder than the recognizer's energy threshold, being the start of the
+    phrase.
+
+    Args:
+        stream: The microphone stream being read by the recognizer
+        identifier (StreamingIdentifier): The identifier receiving the captured audio
+        listener (Recognizer): The recognizer, providing the current energy threshold
+    """
+
+    def __init__(self, stream, identifier, listener):
+        self.stream = stream
+        self.identifier = identifier
+        self.listener = listener
+        self.speaking = False
+
+    def read(self, size):
+        data = self.stream.read(size)
+        if not self.speaking:
+            chunk = pcm_to_float(data, self.identifier.sample_width) * 32768.0  # Energy on the 16-bit scale
+            self.speaking = np.sqrt(np.mean(chunk ** 2)) > self.listener.energy_threshold if len(chunk) else False
+        if self.speaking:
+            self.identifier.add_chunk(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)  # Everything else is served by the microphone stream
+
+
+def pcm_to_float(data, sample_width):
+    """Method converts little-endian signed PCM bytes into float32 samples scaled to [-1, 1)
+
+    Args:
+        data (bytes): The PCM samples
+        sample_width (int): Bytes per sample, 2 or 4
+
+    Returns:
+        A numpy float32 array of the samples
+    """
+    dtype = {2: '<i2', 4: '<i4'}[sample_width]
+    return np.frombuffer(data, dtype=dtype).astype(np.float32) / float(2 ** (8 * sample_width - 1))
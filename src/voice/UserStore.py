@@ -1,5 +1,13 @@
 import Config
 import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a single assistant process is expected
+    fcntl = None
 
 root_path = Config.root_dir()
 """str: Path to the project root"""
@@ -7,6 +15,25 @@ data_path = '/data/users'
 """str: path from project root to voice data"""
 file_name = '/user_list.txt'
 """str: The complete file path leading to user_list file. This contains all user information"""
+journal_name = '/user_journal.jsonl'
+"""str: Append-only journal of the registry updates not yet compacted into the user_list file, one JSON entry per
+line"""
+lock_name = '/user_list.lock'
+"""str: Lock file serializing the registry updates of all assistant processes on the host"""
+token_prefix = 'token_'
+"""str: Prefix of the calendar access token file names, followed by the user name"""
+token_suffix = '.json'
+"""str: Suffix of the calendar access token file names"""
+compaction_threshold = 64
+"""int: Number of journal entries after which the journal is compacted into the user_list file in the background"""
+registry = ((None, 0), {"user_list": [], "user_tokens": []}, frozenset(), dict())
+"""tuple: The cached user registry as (signature, user information, set of user names, user name: token file pairs).
+The signature is the modification time, size and inode of the user_list file, followed by the journal size read. The
+files are only read again once the signature changes, and a grown journal is only read from the previous size"""
+registry_lock = threading.Lock()
+"""Lock: Lock ensuring the registry files are read once when the registry is accessed concurrently"""
+compaction_thread = None
+"""Thread: The background thread compacting the journal, None when no compaction is running"""
 
 
 def ask_user_name(name):
@@ -17,26 +44,30 @@ def ask_user_name(name):
     Returns:
         A boolean value, True if the user exists and False if the user didn't exist.
     """
-    users = access_user_list()
-    user_list = users["user_list"]
-    if name in user_list:  # Name detected in user list
-        return True
+    return name in load_registry()[2]  # Constant time set lookup
+
 
-    return False
+def user_token(name):
+    """Method returns the file name of a user's Calendar access token
+
+    Args:
+        name (str): The name of the user
+
+    Returns:
+        The token file name, None if no token was saved for the user
+    """
+    return load_registry()[3].get(name)
 
 
 def add_user(name):
     """Method adds a new user to the registered users list
 
+    The user is appended to the journal, rather than rewriting the user_list file.
+
     Args:
         name (str): Name of the new user to be registered
     """
-    users = access_user_list()  # Access user information
-    user_list = users["user_list"]  # Generate a username list
-
-    user_list.append(name)  # Add new username to the list
-    users["user_list"] = user_list  # Update user_list with new username
-    write_user_list(users)  # Store user information
+    append_journal({"op": "add_user", "name": name})
 
 
 def add_user_token(name: str):
@@ -48,26 +79,213 @@ def add_user_token(name: str):
     Args:
         name (str): The name of the user, whose access token it being saved.
     """
-    users = access_user_list()
-    user_tokens = users["user_tokens"]
-
-    user_tokens.append("token_" + name + ".json")
-    users["user_tokens"] = user_tokens
-    write_user_list(users)
+    append_journal({"op": "add_token", "token": token_prefix + name + token_suffix})
 
 
 def access_user_list():
-    """Method to access the user_list.txt file, reading it in as a dictionary"""
+    """Method to access the user_list.txt file, reading it in as a dictionary
+
+    Returns:
+        A copy of the cached user information, safe to modify
+    """
+    users = load_registry()[1]
+    return {key: list(value) if isinstance(value, list) else value for key, value in users.items()}
+
+
+@contextmanager
+def file_lock(shared=False):
+    """Method holds the registry lock file, shared between readers or exclusive to one writer across processes
+
+    Args:
+        shared (bool): Whether the lock is shared, allowing concurrent readers
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(root_path + data_path + lock_name, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)  # Released when the file is closed
+        yield
+
+
+def file_signature():
+    """Method returns the signature of the user_list file, changing whenever the file is written or replaced"""
+    stat = os.stat(root_path + data_path + file_name)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def journal_size():
+    """Method returns the size of the journal, 0 when there is none"""
+    try:
+        return os.stat(root_path + data_path + journal_name).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def read_journal(offset=0):
+    """Method reads the complete journal entries from an offset. A trailing entry torn by a crash is ignored.
+
+    Args:
+        offset (int): Byte offset to read from
+
+    Returns:
+        The list of entries and the offset following the last complete entry
+    """
+    try:
+        with open(root_path + data_path + journal_name, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    data = data[:data.rfind(b'\n') + 1]
+    entries = []
+    for line in data.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries, offset + len(data)
+
+
+def apply_entries(users, user_set, tokens, entries):
+    """Method applies journal entries to the user information in place. Entries are idempotent, so an entry already
+    compacted into the user_list file is applied again without effect
+
+    Args:
+        users (dict): A dictionary containing a record of all registered users
+        user_set (set): Set of the user names
+        tokens (dict): Dictionary of user name: token file pairs
+        entries (list): The journal entries
+    """
+    for entry in entries:
+        if entry.get("op") == "add_user" and entry["name"] not in user_set:
+            users["user_list"].append(entry["name"])
+            user_set.add(entry["name"])
+        elif entry.get("op") == "add_token" and entry["token"] not in users["user_tokens"]:
+            users["user_tokens"].append(entry["token"])
+            token = entry["token"]
+            if token.startswith(token_prefix) and token.endswith(token_suffix):
+                tokens[token[len(token_prefix):-len(token_suffix)]] = token
+
+
+def read_registry():
+    """Method reads the user_list file and applies the whole journal, the caller holding the lock file
+
+    Returns:
+        The registry tuple, see registry
+    """
     with open(root_path + data_path + file_name) as f:
-        data = f.read()
-        return json.loads(data)
+        signature, users = file_signature(), json.loads(f.read())
+    user_set, tokens = index_registry(users)
+    entries, offset = read_journal()
+    apply_entries(users, user_set, tokens, entries)
+    return (signature, offset), users, frozenset(user_set), tokens
+
+
+def load_registry():
+    """Method returns the cached user registry, reading the registry files only when they changed since they were
+    cached. When only the journal grew, the new entries alone are read
+
+    Returns:
+        The registry tuple, see registry
+    """
+    global registry
+    if registry[0] == (file_signature(), journal_size()):
+        return registry
+    with registry_lock, file_lock(shared=True):
+        signature, size = file_signature(), journal_size()
+        (cached_signature, offset), users, user_set, tokens = registry
+        if (cached_signature, offset) == (signature, size):
+            return registry
+        if cached_signature == signature and size > offset:  # Only new journal entries
+            entries, offset = read_journal(offset)
+            users = {key: list(value) if isinstance(value, list) else value for key, value in users.items()}
+            user_set, tokens = set(user_set), dict(tokens)
+            apply_entries(users, user_set, tokens, entries)
+            registry = (signature, offset), users, frozenset(user_set), tokens
+        else:
+            registry = read_registry()
+    return registry
+
+
+def index_registry(users):
+    """Method indexes the user names and token files of the user information
+
+    Args:
+        users (dict): A dictionary containing a record of all registered users
+
+    Returns:
+        The set of user names and the dictionary of user name: token file pairs
+    """
+    tokens = {token[len(token_prefix):-len(token_suffix)]: token for token in users["user_tokens"]
+              if token.startswith(token_prefix) and token.endswith(token_suffix)}
+    return set(users["user_list"]), tokens
+
+
+def append_journal(entry):
+    """Method appends an update to the journal, durable once the method returns. A trailing entry torn by a crash of
+    another process is truncated first, and the journal is compacted in the background once it grows long
+
+    Args:
+        entry (dict): The journal entry
+    """
+    with file_lock():
+        with open(root_path + data_path + journal_name, 'a+b') as f:
+            f.seek(0)
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                data = data[:data.rfind(b'\n') + 1]
+                f.truncate(len(data))
+            f.write(json.dumps(entry).encode() + b'\n')  # Appended, whatever the file position
+            f.flush()
+            os.fsync(f.fileno())
+    load_registry()
+    if data.count(b'\n') + 1 >= compaction_threshold:
+        compact_in_background()
+
+
+def write_file(path, users):
+    """Method writes the user information to a file atomically, through a synced temporary file replacing it
+
+    Args:
+        path (str): Path of the file
+        users (dict): A dictionary containing a record of all registered users
+    """
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(users))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
 
 
 def write_user_list(users):
     """Method to write an updated user_list dictionary to the storage file.
 
+    The file is replaced atomically and the journal, now contained in the file, is emptied.
+
     Args:
         users (dict): A dictionary containing a record of all registered users
     """
-    with open(root_path + data_path + file_name, 'w') as f:
-        f.write(json.dumps(users))
+    with file_lock():
+        write_file(root_path + data_path + file_name, users)
+        open(root_path + data_path + journal_name, 'w').close()
+    load_registry()
+
+
+def compact_journal():
+    """Method compacts the journal into the user_list file, replacing the file atomically before emptying the journal.
+    A crash in between leaves entries that are both in the file and the journal, applied again without effect"""
+    with file_lock():
+        _, users, _, _ = read_registry()
+        write_file(root_path + data_path + file_name, users)
+        open(root_path + data_path + journal_name, 'w').close()
+    load_registry()
+
+
+def compact_in_background():
+    """Method starts compacting the journal in a background thread, unless a compaction is already running"""
+    global compaction_thread
+    with registry_lock:
+        if compaction_thread is not None and compaction_thread.is_alive():
+            return
+        compaction_thread = threading.Thread(target=compact_journal, name='user-journal-compaction', daemon=True)
+        compaction_thread.start()
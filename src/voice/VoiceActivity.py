@@ -0,0 +1,140 @@
+import numpy as np
+
+frame_seconds = 0.02
+"""float: Duration of the frames whose energy decides between speech and silence"""
+dynamic_range_db = 40
+"""float: Frames quieter than the loudest frame of a recording by more than this (dB) are silence"""
+noise_floor_db = -55
+"""float: Frames quieter than this (dBFS) are always silence"""
+padding_seconds = 0.15
+"""float: Silence kept before and after every speech segment, preserving onsets and decays"""
+max_gap_seconds = 0.3
+"""float: Silences between speech segments longer than this are dropped, apart from the segment padding"""
+
+
+def parameters():
+    """Method returns the trimming parameters, identifying features computed from trimmed audio
+
+    Returns:
+        A dictionary of the trimming parameters
+    """
+    return {'frame_seconds': frame_seconds, 'dynamic_range_db': dynamic_range_db, 'noise_floor_db': noise_floor_db,
+            'padding_seconds': padding_seconds, 'max_gap_seconds': max_gap_seconds}
+
+
+def frame_energy(y, frame_length, full_scale=1.0):
+    """Method computes the RMS energy of consecutive frames of a waveform
+
+    Args:
+        y (ndarray): The waveform
+        frame_length (int): Number of samples per frame, the last partial frame being zero padded
+        full_scale (float): Amplitude of a full scale sample, 1 for floating point and 32768 for int16 waveforms
+
+    Returns:
+        A numpy array of the frame energies in dBFS
+    """
+    frames = -(-len(y) // frame_length)
+    padded = np.zeros(frames * frame_length, dtype=np.float32)
+    padded[:len(y)] = y
+    rms = np.sqrt(np.mean(np.square(padded.reshape(frames, frame_length) / full_scale), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_segments(y, sr, full_scale=1.0):
+    """Method detects the speech segments of a waveform by frame energy.
+
+    Frames within dynamic_range_db of the loudest frame and above the noise floor are speech. Segments are padded,
+    and segments separated by at most max_gap_seconds are merged.
+
+    Args:
+        y (ndarray): The waveform
+        sr (int): Sample rate of the waveform
+        full_scale (float): Amplitude of a full scale sample
+
+    Returns:
+        A list of (start, end) sample ranges of speech, empty when the waveform holds no speech
+    """
+    frame_length = max(1, int(sr * frame_seconds))
+    if len(y) == 0:
+        return []
+    energy = frame_energy(y, frame_length, full_scale)
+    voiced = np.flatnonzero(energy > max(energy.max() - dynamic_range_db, noise_floor_db))
+    if len(voiced) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(voiced) > 1)
+    starts = voiced[np.r_[0, breaks + 1]] * frame_length
+    ends = (voiced[np.r_[breaks, len(voiced) - 1]] + 1) * frame_length
+    padding, max_gap = int(padding_seconds * sr), int(max_gap_seconds * sr)
+    starts, ends = np.maximum(starts - padding, 0), np.minimum(ends + padding, len(y))
+
+    segments = [[starts[0], ends[0]]]
+    for start, end in zip(starts[1:], ends[1:]):
+        if start - segments[-1][1] <= max_gap:  # Short pause within the phrase
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    return [(int(start), int(end)) for start, end in segments]
+
+
+def speech_frames(energy, frame_rate):
+    """Method gates the analysis frames of a streamed waveform as trim would: frames within dynamic_range_db of the
+    loudest frame and above the noise floor are speech, padded and merged across short pauses.
+
+    Args:
+        energy (ndarray): The energies (dBFS) of consecutive frames
+        frame_rate (float): Frames per second
+
+    Returns:
+        A boolean array of the frames kept, being every frame when none holds speech
+    """
+    keep = np.ones(len(energy), dtype=bool)
+    if len(energy) == 0:
+        return keep
+    voiced = np.flatnonzero(energy > max(energy.max() - dynamic_range_db, noise_floor_db))
+    if len(voiced) == 0:
+        return keep
+
+    breaks = np.flatnonzero(np.diff(voiced) > 1)
+    starts, ends = voiced[np.r_[0, breaks + 1]], voiced[np.r_[breaks, len(voiced) - 1]] + 1
+    padding, max_gap = int(round(padding_seconds * frame_rate)), int(round(max_gap_seconds * frame_rate))
+    starts, ends = np.maximum(starts - padding, 0), np.minimum(ends + padding, len(energy))
+    keep[:] = False
+    end = -max_gap - 1
+    for segment_start, segment_end in zip(starts, ends):
+        keep[segment_start if segment_start - end > max_gap else end:segment_end] = True  # Short pauses are kept
+        end = max(end, segment_end)
+    return keep
+
+
+def trim(y, sr, full_scale=1.0):
+    """Method drops leading and trailing silence, and long silences between speech segments, from a waveform
+
+    Args:
+        y (ndarray): The waveform
+        sr (int): Sample rate of the waveform
+        full_scale (float): Amplitude of a full scale sample
+
+    Returns:
+        The trimmed waveform, being the waveform itself when it holds no speech
+    """
+    segments = speech_segments(y, sr, full_scale)
+    if not segments:
+        return y
+    if len(segments) == 1:
+        return y[segments[0][0]:segments[0][1]]  # A view, nothing is copied
+    return np.concatenate([y[start:end] for start, end in segments])
+
+
+def trim_audio(audio):
+    """Method trims the silence from a recording
+
+    Args:
+        audio (AudioData): The data structure containing the recorded user audio
+
+    Returns:
+        A trimmed AudioData recording with 16-bit samples at the recording sample rate
+    """
+    samples = np.frombuffer(audio.get_raw_data(convert_width=2), dtype='<i2')
+    trimmed = trim(samples, audio.sample_rate, full_scale=32768.0)
+    return type(audio)(trimmed.tobytes(), audio.sample_rate, 2)
@@ -1,46 +1,159 @@
 import datetime
-from time import sleep
+import functools
+import json
+import os
+import shutil
+import threading
+from time import perf_counter, sleep
 
 import librosa
 import numpy as np
 import pandas as pd
 
-from tensorflow import keras
-from keras.utils import to_categorical
-from keras.models import Sequential
-from keras.layers import Dense, Dropout, Activation, Flatten
-from keras.callbacks import EarlyStopping
-
-from sklearn import preprocessing
-from sklearn.model_selection import train_test_split
-
 import Config
 from src.voice.UserStore import access_user_list
+import src.voice.FeatureStore as FeatureStore
+import src.voice.AudioFeatures as AudioFeatures
+import src.voice.ModelSearch as ModelSearch
+import src.voice.NumpyModel as NumpyModel
+import src.voice.PackedCorpus as PackedCorpus
+import src.voice.SpeakerIndex as SpeakerIndex
+import src.voice.VoiceStorage as VoiceStorage
+import src.voice.VoiceActivity as VoiceActivity
 from datetime import datetime
 
-import tensorflow as tf
-
-from silence_tensorflow import silence_tensorflow  # Remove tf hardware optimization INFO messages
-silence_tensorflow()
-
+# TensorFlow, Keras and scikit-learn are imported within the training functions, only needed once a model is trained
 
 
 root_path = Config.root_dir()
 """str: Path to the project root"""
 model_path = '/models'
 """string: Path to model storage"""
-model = Sequential()
-"""Sequential: Voice classification model"""
+model = None
+"""Sequential: Voice classification model (or its NumPy inference engine), loaded by initialize_model"""
 model_name = '/model_1'
-"""string: Name of stored voice classification model"""
+"""string: Name of stored voice classification model, used until a retrained version is promoted"""
+current_model_file = '/current_model.txt'
+"""string: Name of the file recording the currently promoted model version"""
+inference_engine = 'numpy'
+"""str: Engine serving predictions, 'numpy' (exported dense weights, no TensorFlow), 'int8' (int8 quantized dense
+weights, no TensorFlow) or 'keras' (SavedModel)"""
+exported_suffix = '_dense.bin'
+"""string: Suffix of the exported dense weights file of a model version"""
+quantized_suffix = '_int8.bin'
+"""string: Suffix of the int8 quantized dense weights file of a model version"""
+quantization_report_suffix = '_int8_report.json'
+"""string: Suffix of the report comparing the float and int8 quantized model of a model version"""
+calibration_samples = 512
+"""int: Maximum number of recordings whose features calibrate the int8 quantization"""
+report_samples = 2048
+"""int: Maximum number of recordings of known users evaluated by the quantization report"""
+version_prefix = '/model_'
+"""string: Name prefix of retrained model versions, followed by the training timestamp"""
+retained_versions = 1
+"""int: Number of superseded retrained model versions kept besides the promoted one, to roll back to. The stored model
+model_name is never removed"""
+minimum_accuracy = 0.5
+"""float: Minimum test set accuracy a retrained model requires to replace the current model"""
+model_lock = threading.Lock()
+"""Lock: Lock guarding the swap of the served model, embedding model, user dictionary and voice prints"""
+training_thread = None
+"""Thread: Background worker currently retraining the voice classification model"""
+voice_print_thread = None
+"""Thread: Background worker building the voice prints on their first use, identifying through the classifier until
+they are built"""
 audio_path = '/data/temp/'
 """string: Audio storage path"""
 temp_audio_file = 'audio_temp.wav'
 """string: name of temporary audio file written during the classification process"""
 data_path = '/data/voice/'
 """string: Path to audio data storage folder"""
+sample_rate = AudioFeatures.reference_rate
+"""int: Sample rate (Hz) the voice features are defined at. Audio at other rates is analysed without resampling"""
+DEBUG_TEMP_FILE = False
+"""bool: Boolean flag routing predictions through the temporary .wav file instead of decoding the audio in memory"""
+legacy_feature_params = {'sr': sample_rate, 'n_mels': AudioFeatures.n_mels, 'statistic': 'mel_band_mean'}
+"""dict: Feature extraction parameters of untrimmed features, being those of model versions trained before the
+parameters were recorded"""
+feature_params = dict(legacy_feature_params, trim=VoiceActivity.parameters()) if AudioFeatures.trim_silence \
+    else legacy_feature_params
+"""dict: Feature extraction parameters, identifying compatible features within the feature store"""
+feature_params_suffix = '_features.json'
+"""string: Suffix of the feature extraction parameters a model version was trained on"""
+served_params = legacy_feature_params
+"""dict: Feature extraction parameters of the served model, which its input features are computed with until a model
+trained on the configured feature_params is promoted"""
+packed_corpus = False
+"""bool: Boolean flag indicating if training audio is read from the packed corpus, falling back to the .wav files of
+recordings not packed yet"""
+use_feature_store = True
+"""bool: Boolean flag indicating if training features are read from (and written to) the on-disk feature store"""
+parallel_extraction = True
+"""bool: Boolean flag indicating if training audio is decoded and featurized across a pool of worker processes"""
+extraction_workers = AudioFeatures.default_workers
+"""int: Number of worker processes used by parallel feature extraction"""
+extraction_chunk_size = AudioFeatures.default_chunk_size
+"""int: Number of recordings processed per worker task during parallel feature extraction"""
+training_batch_size = 20
+"""int: Number of feature vectors per training batch"""
+training_epochs = 100
+"""int: Maximum number of training epochs"""
+feature_batch_size = 256
+"""int: Number of recordings decoded and featurized at a time while streaming the training data, bounding the audio
+held in memory during training"""
+shuffle_buffer = 1024
+"""int: Number of feature vectors held in the training data shuffle buffer"""
+prefetch_batches = 2
+"""int: Number of training batches prepared ahead of the training step"""
+validation_split = 0.1
+"""float: Fraction of the training recordings held out to decide on early stopping"""
+split_seed = 0
+"""int: Random seed of the train, validation and test split, keeping the split identical when training resumes"""
+early_stopping_patience = 10
+"""int: Number of epochs without validation loss improvement after which training stops"""
+training_budget = None
+"""float: Wall-clock budget (seconds) of a training run, stopping after the last epoch fitting the budget. None trains
+without a budget"""
+backup_name = '/training_backup'
+"""string: Name of the checkpoint directory an interrupted training run resumes from"""
+best_weights_suffix = '_best.weights.h5'
+"""string: Suffix of the checkpoint directory name giving the checkpoint of the weights with the lowest validation
+loss, kept with the checkpoint when training resumes"""
+model_config = {'layers': [128, 80, 40], 'dropout': [0.2, 0.5, 0.5], 'batch_size': training_batch_size,
+                'learning_rate': 1e-3}
+"""dict: Network configuration trained without model selection, as dense layer widths, dropout rates, batch size and
+learning rate"""
+model_selection = False
+"""bool: Boolean flag indicating if retraining selects the network configuration among ModelSearch.candidate_configs,
+instead of training model_config"""
+search_cpu_budget = 1800
+"""float: CPU time budget (seconds, summed over the worker processes) of the model selection"""
+search_log_suffix = '_search.json'
+"""string: Suffix of the per-candidate cost and accuracy log of the model selection of a model version"""
 user_dict = dict()
 """dict: Dictionary containing the user label, corresponding to user names as label: name pairs"""
+identification_mode = 'classifier'
+"""str: Speaker identification mode, 'classifier' (softmax over trained users, registration retrains the model) or
+'voice_print' (closest enrolled user, registration enrolls the user's voice print without retraining)"""
+embedding_model = None
+"""Model: Voice classification model truncated at its last hidden layer, producing voice embeddings"""
+voice_print_name = '/voice_prints.npz'
+"""string: Name of the stored voice prints of enrolled users"""
+voice_prints = dict()
+"""dict: Dictionary of enrolled user voice prints as name: (embedding sum, sample count) pairs"""
+speaker_index = SpeakerIndex.SpeakerIndex.build([], np.zeros((0, 0)))
+"""SpeakerIndex: Nearest neighbour index of the enrolled user voice prints, searched by voice print identification"""
+classifier_threshold = 0.7
+"""float: Softmax probability below which the identified user is uncertain, in classifier identification"""
+voice_print_threshold = 0.85
+"""float: Cosine similarity below which the identified user is uncertain, in voice print identification, until
+calibrated. The embeddings are non-negative, so even unknown speakers reach similarities of about 0.6 to 0.83"""
+false_accept_rate = 0.01
+"""float: Fraction of the recordings of enrolled users accepted as another user by the calibrated voice print
+threshold"""
+calibrated_threshold = None
+"""float: Voice print threshold calibrated on the recordings of the enrolled users, never below voice_print_threshold.
+None until calibrated"""
 
 
 ## USER LABELS ##
@@ -52,85 +165,770 @@ user_dict = dict()
 
 def initialize_model():
     generate_user_dictionary()  # Generate a dictionary of known users
-    determine_retraining_requirement()
     load_model()  # Load the model from storage
+    if identification_mode == 'voice_print' and not load_voice_prints():
+        build_voice_prints(background=True)  # First use of voice prints, enroll all recorded users after start-up
+    determine_retraining_requirement()  # Retrains in the background, serving the loaded model meanwhile
+
+
+def retrain_model(background=True):
+    """Method retrains the voice classification model and promotes it to replace the served model.
+
+    In the background, the served model keeps answering predictions until the retrained one is swapped in.
+
+    Args:
+        background (bool): Retrain in a background worker thread instead of blocking the caller
+
+    Returns:
+        The training thread when training in the background, otherwise None
+    """
+    global training_thread
+    if not background:
+        retrain_and_swap()
+        return None
+
+    if training_thread is not None and training_thread.is_alive():  # A retrain is already in progress
+        return training_thread
+    training_thread = threading.Thread(target=retrain_and_swap, name='voice-model-retrain', daemon=True)
+    training_thread.start()
+    return training_thread
+
 
+def retrain_and_swap():
+    with VoiceStorage.reading_recordings():  # Recordings evicted meanwhile stay on disk until training is done
+        users = user_dictionary()
+        manifest = VoiceStorage.read_manifest() or VoiceStorage.rebuild_manifest()
+        watermark = manifest['latest_recording']  # Recordings stored from now on are newer than the training data
+        version = version_prefix + datetime.now().strftime('%Y%m%d%H%M%S')  # Separate versioned directory
+        trained_model, accuracy = train_model(len(users), version)
 
-def retrain_model():
-    generate_user_dictionary()
-    train_model()
-    load_model()
+        if not validate_model(version, len(users), accuracy):
+            print(f"Retrained model {version} rejected, keeping the current model")
+            remove_version(version)
+            return
+        promote_model(version, users)
+        VoiceStorage.write_training_watermark(watermark)
+        prune_versions(version)
+
+
+def validate_model(version, num_users, accuracy):
+    if accuracy < minimum_accuracy:
+        return False
+    try:
+        candidate = load_tensorflow().keras.models.load_model(root_path + model_path + version)  # Stored model must load
+    except (IOError, ValueError) as error:
+        print(f"Retrained model {version} failed to load: {error}")
+        return False
+    prediction = candidate.predict(np.zeros((1, 128), dtype=np.float32), verbose=0)
+    return prediction.shape == (1, num_users) and bool(np.all(np.isfinite(prediction)))
+
+
+def promote_model(version, users):
+    global model, embedding_model, user_dict, voice_prints, speaker_index, calibrated_threshold, served_params
+    new_model, new_embedding_model = read_model(version)
+    new_params = version_feature_params(version)
+    new_voice_prints, new_speaker_index, new_threshold = voice_prints, speaker_index, calibrated_threshold
+    if identification_mode == 'voice_print':  # Embeddings change with the model
+        new_voice_prints, new_threshold = generate_voice_prints(new_embedding_model, new_params)
+        new_speaker_index = index_voice_prints(new_voice_prints)
+
+    with model_lock:  # Swap all serving state at once
+        model, embedding_model, user_dict, served_params = new_model, new_embedding_model, users, new_params
+        voice_prints, speaker_index, calibrated_threshold = new_voice_prints, new_speaker_index, new_threshold
+
+    write_current_model(version)
+    if identification_mode == 'voice_print':
+        save_voice_prints()
+    print(f"Promoted retrained model {version}")
 
 
 def predict(audio):
-    write_temp_audio_file(audio)  # Write a temporary .wav file
-    audio, _ = librosa.load(root_path + audio_path + temp_audio_file)  # Load temporary audio file as librosa object
-    audio_feature = feature_extraction(audio)  # generate audio feature using a mel spectrogram
-    tensor_feature = tf.convert_to_tensor(audio_feature)  # Convert the feature dataframe to a tensor
-    tensor_reshape = tf.reshape(tensor_feature, (1, 128))  # Reshape tensor to be accepted by the model
-    prediction = model.predict(tensor_reshape, verbose=0)  # Predict the user based on the audio
-    user_label = np.argmax(prediction, axis=1)  # Predict the user label
-    prediction_score = prediction[0][user_label]  # Determine probability of voice being the user
-    user = user_dict[user_label[0]]  # Return the user's name
+    recording = audio
+    state = serving_state()  # Features are computed as the served model was trained on
+    if DEBUG_TEMP_FILE:
+        write_temp_audio_file(audio)  # Write a temporary .wav file
+        audio, _ = librosa.load(root_path + audio_path + temp_audio_file)  # Load temporary audio file as librosa object
+        audio_feature = feature_extraction(audio, state[4])  # generate audio feature using a mel spectrogram
+    else:
+        audio_feature = audio_data_feature(audio, state[4])  # Decode the recorded PCM bytes, featurize at their rate
+    if use_feature_store:
+        FeatureStore.stage_feature(recording, audio_feature, state[4])  # Reuse feature if recording is stored
+    users, prediction_scores = identify_features(audio_feature, state)
+    user, prediction_score = users[0], prediction_scores[:1]
     print(f"Identified user: {user} with confidence: {round(prediction_score[0] * 100, 2)}%")
     return user, prediction_score
 
 
-def train_model():
-    early_stop = create_model_structure()  # Create the model structure
+def predict_batch(recordings, batch_size=256, write_suggestions=False):
+    """Method identifies the speakers of many recordings, featurizing them in chunks and classifying full batches.
+
+    Args:
+        recordings (iterable): AudioData recordings and/ or recording file names within the voice data folder
+        batch_size (int): Number of recordings featurized and classified at once
+        write_suggestions (bool): Write the predictions of recording file names to the audio store as relabel
+                                  suggestions. The store is rewritten, so no recordings should be saved meanwhile.
+
+    Returns:
+        A numpy array of the identified user names and a numpy array of the corresponding confidences
+    """
+    recordings = list(recordings)
+    state = serving_state()  # One model version for the whole batch
+    names, scores = [np.empty(0, dtype=object)], [np.empty(0, dtype=np.float32)]
+    with VoiceStorage.reading_recordings():
+        for start in range(0, len(recordings), batch_size):
+            batch = batch_features(recordings[start:start + batch_size], state[4])
+            batch_names, batch_scores = identify_features(batch, state)
+            names.append(batch_names)
+            scores.append(batch_scores)
+    names, scores = np.concatenate(names), np.concatenate(scores)
+    print(f"Identified {len(recordings)} recordings")
+
+    if write_suggestions:
+        audio_files = [(x, name, score) for x, name, score in zip(recordings, names, scores) if isinstance(x, str)]
+        write_relabel_suggestions(audio_files)
+    return names, scores
+
+
+def batch_features(recordings, params=None):
+    features = np.empty((len(recordings), 128), dtype=np.float32)
+    files = [i for i, recording in enumerate(recordings) if isinstance(recording, str)]
+    if files:  # Stored recordings, through the feature store
+        features[files] = recording_features([recordings[i] for i in files], params)
+    for i, recording in enumerate(recordings):
+        if not isinstance(recording, str):  # Captured AudioData recordings
+            features[i] = audio_data_feature(recording, params)
+    return features
+
+
+def write_relabel_suggestions(predictions):
+    """Method writes relabel suggestions into the suggested_name and suggestion_confidence columns of the audio store
+
+    Args:
+        predictions (list): A list of (audio_file, suggested name, confidence) tuples
+    """
+    suggestions = pd.DataFrame(predictions, columns=['audio_file', 'suggested_name', 'suggestion_confidence'])
+    suggestions = suggestions.drop_duplicates('audio_file', keep='last').set_index('audio_file')
+
+    with VoiceStorage.updating_audio_store():  # No recording is committed between the read and the rewrite
+        df = VoiceStorage.read_audio_store()
+        for column in suggestions.columns:
+            suggested = df['audio_file'].map(suggestions[column])
+            df[column] = suggested.where(suggested.notna(), df[column]) if column in df else suggested.fillna('')
+        VoiceStorage.replace_audio_store(df)  # Never leaves a partially written store
+    relabelled = int(((df['suggested_name'] != '') & (df['suggested_name'] != df['name'])).sum())
+    print(f"Wrote relabel suggestions, {relabelled} recordings disagree with their label")
+
+
+def serving_state():
+    with model_lock:  # Snapshot of the served state, unaffected by a concurrent model swap
+        return model, embedding_model, user_dict, speaker_index, served_params
+
+
+def identify_features(features, state):
+    current_model, current_embedding_model, users, index, _ = state
+    features = np.asarray(features, dtype=np.float32).reshape(-1, 128)
+    if voice_print_identification():
+        return identify_voice_prints(features, current_embedding_model, index)  # Closest enrolled voice print
+    return classify_features(features, current_model, users)  # Softmax over trained users
+
+
+def identification_threshold():
+    """Method returns the identification score below which the identified user is uncertain, for the identification
+    mode. Softmax probabilities and voice print cosine similarities are on different scales
+
+    Returns:
+        The threshold score
+    """
+    if voice_print_identification():
+        return voice_print_threshold if calibrated_threshold is None else calibrated_threshold
+    return classifier_threshold
+
+
+def voice_print_identification():
+    """Method returns whether users are identified by voice print, being the identification mode once the voice prints
+    are built"""
+    return identification_mode == 'voice_print' and (voice_print_thread is None or not voice_print_thread.is_alive())
+
+
+def classify_features(features, classifier, users):
+    prediction = classifier.predict(features, verbose=0)  # Predict the users based on the audio
+    user_labels = np.argmax(prediction, axis=1)  # Predict the user labels
+    prediction_scores = prediction[np.arange(len(user_labels)), user_labels]  # Probability of voice being the user
+    return np.array([users[label] for label in user_labels], dtype=object), prediction_scores
+
+
+def identify_voice_prints(features, extractor, index):
+    if len(index) == 0:  # No enrolled users
+        return np.full(len(features), 'Unknown', dtype=object), np.zeros(len(features), dtype=np.float32)
+    return index.search(embed_features(features, extractor))  # Cosine similarity to the closest enrolled users
+
+
+def embed_features(features, extractor=None):
+    extractor = embedding_model if extractor is None else extractor
+    features = np.asarray(features, dtype=np.float32).reshape(-1, 128)
+    embeddings = extractor.predict(features, verbose=0)  # Last hidden layer activations
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)  # Unit length embeddings
+
+
+def enroll_user(name, audio_files):
+    """Method enrolls a user's voice print from their recordings, without retraining the voice classification model.
+
+    The frozen model embeds the recordings, and the embeddings are added to the user's voice print, so the cost only
+    depends on the number of new recordings.
 
+    Args:
+        name (str): The name of the user being enrolled
+        audio_files (list): File names of the user's recordings within the voice data folder
+    """
+    global voice_prints, speaker_index
+    audio_files = [x for x in audio_files if x]
+    if not audio_files:
+        return
+    wait_for_voice_prints()
+    state = serving_state()
+    embeddings = embed_features(recording_features(audio_files, state[4]), state[1])
+    with model_lock:
+        embedding_sum, count = voice_prints.get(name, (np.zeros(embeddings.shape[1], dtype=np.float32), 0))
+        embedding_sum = embedding_sum + embeddings.sum(axis=0)
+        voice_prints = {**voice_prints, name: (embedding_sum, count + len(embeddings))}
+        speaker_index = speaker_index.inserted(name, embedding_sum)  # Replaces the user's earlier voice print
+    save_voice_prints()
+    print(f"Enrolled {name} from {len(embeddings)} recordings")
+
+
+def remove_user(name):
+    """Method removes a user's voice print, so their voice is no longer identified, without retraining.
+
+    Args:
+        name (str): The name of the user being removed
+    """
+    global voice_prints, speaker_index
+    wait_for_voice_prints()
+    with model_lock:
+        voice_prints = {user: voice_print for user, voice_print in voice_prints.items() if user != name}
+        speaker_index = speaker_index.removed(name)
+    save_voice_prints()
+
+
+def index_voice_prints(prints):
+    """Method builds the nearest neighbour index of voice prints
+
+    Args:
+        prints (dict): Dictionary of voice prints as name: (embedding sum, sample count) pairs
+
+    Returns:
+        The SpeakerIndex of the voice prints
+    """
+    if not prints:
+        return SpeakerIndex.SpeakerIndex.build([], np.zeros((0, 0)))
+    return SpeakerIndex.SpeakerIndex.build(list(prints),
+                                           np.stack([embedding_sum for embedding_sum, _ in prints.values()]))
+
+
+def build_voice_prints(background=False):
+    """Method builds the voice prints of all recorded users with the served embedding model
+
+    Every recording is featurized, so in the background the served model identifies users through the classifier
+    until the voice prints are built. Voice prints built with an embedding model replaced meanwhile are discarded, the
+    promoted model having built its own.
+
+    Args:
+        background (bool): Build in a background worker thread instead of blocking the caller
+
+    Returns:
+        The building thread when building in the background, otherwise None
+    """
+    global voice_prints, speaker_index, calibrated_threshold, voice_print_thread
+    if background:
+        if voice_print_thread is None or not voice_print_thread.is_alive():
+            voice_print_thread = threading.Thread(target=build_voice_prints, name='voice-print-build', daemon=True)
+            voice_print_thread.start()
+        return voice_print_thread
+
+    _, extractor, _, _, params = serving_state()
+    with VoiceStorage.reading_recordings():
+        new_voice_prints, new_threshold = generate_voice_prints(extractor, params)
+    new_speaker_index = index_voice_prints(new_voice_prints)
+    with model_lock:
+        if embedding_model is not extractor:  # A promoted model replaced the voice prints
+            return None
+        voice_prints, speaker_index, calibrated_threshold = new_voice_prints, new_speaker_index, new_threshold
+    save_voice_prints()
+    print(f"Built voice prints of {len(new_voice_prints)} users")
+    return None
+
+
+def wait_for_voice_prints():
+    """Method waits for voice prints being built in the background, before they are updated"""
+    thread = voice_print_thread
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+
+def generate_voice_prints(extractor, params=None):
+    """Method generates the voice prints of all recorded users, calibrating the voice print threshold on them
+
+    Args:
+        extractor (Model): The embedding model
+        params (dict): Feature extraction parameters the embedding model was trained on, defaults to feature_params
+
+    Returns:
+        The dictionary of voice prints as name: (embedding sum, sample count) pairs and the calibrated threshold
+    """
     df = generate_raw_dataset()
-    X_train, y_train, X_test, y_test = generate_final_dataset(df)
+    embeddings = embed_features(recording_features(df['audio_file'], params), extractor)
+    names = df['name'].to_numpy()
+    prints = {name: (embeddings[names == name].sum(axis=0), int(np.sum(names == name))) for name in np.unique(names)}
+    return prints, calibrate_threshold(embeddings, names, prints)
+
+
+def calibrate_threshold(embeddings, names, prints, chunk_size=4096):
+    """Method calibrates the voice print threshold, so only false_accept_rate of the recordings of enrolled users are
+    accepted as the closest other user. Recordings of other users stand in for unknown speakers.
+
+    Args:
+        embeddings (ndarray): Unit embeddings of the recordings
+        names (ndarray): User names of the recordings
+        prints (dict): Dictionary of voice prints as name: (embedding sum, sample count) pairs
+        chunk_size (int): Number of recordings compared with all voice prints at once
 
-    model_history = model.fit(X_train, y_train, batch_size=20, epochs=100,
-                              callbacks=[early_stop])
+    Returns:
+        The calibrated threshold, never below voice_print_threshold, or None with fewer than two users
+    """
+    users = list(prints)
+    if len(users) < 2 or len(embeddings) == 0:
+        return None
+    centroids = SpeakerIndex.unit(np.stack([prints[user][0] for user in users]))
+    position = {user: i for i, user in enumerate(users)}
+    labels = np.array([position[name] for name in names])
+    impostor = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        similarity = embeddings[start:start + chunk_size] @ centroids.T
+        similarity[np.arange(len(similarity)), labels[start:start + chunk_size]] = -np.inf  # Other users only
+        impostor[start:start + chunk_size] = similarity.max(axis=1)
+    threshold = float(max(np.quantile(impostor, 1 - false_accept_rate), voice_print_threshold))
+    print(f"Calibrated voice print threshold: {threshold:.3f}")
+    return threshold
 
-    score = model.evaluate(X_test, y_test, verbose=0)
+
+def recording_features(audio_files, params=None):
+    params = feature_params if params is None else params
+    if use_feature_store:
+        return FeatureStore.get_features(audio_files, functools.partial(generate_file_features, params=params), params)
+    return generate_file_features(audio_files, params)
+
+
+def save_voice_prints():
+    names = list(voice_prints)
+    np.savez(root_path + model_path + voice_print_name, names=np.array(names),
+             sums=np.stack([voice_prints[name][0] for name in names]) if names else np.zeros((0, 0), np.float32),
+             counts=np.array([voice_prints[name][1] for name in names]),
+             threshold=np.nan if calibrated_threshold is None else calibrated_threshold)
+
+
+def load_voice_prints():
+    global voice_prints, speaker_index, calibrated_threshold
+    try:
+        stored = np.load(root_path + model_path + voice_print_name)
+    except FileNotFoundError:
+        return False
+    voice_prints = {str(name): (embedding_sum, int(count))
+                    for name, embedding_sum, count in zip(stored['names'], stored['sums'], stored['counts'])}
+    speaker_index = index_voice_prints(voice_prints)
+    threshold = float(stored['threshold']) if 'threshold' in stored.files else np.nan  # Stored before calibration
+    calibrated_threshold = None if np.isnan(threshold) else threshold
+    return True
+
+
+def train_model(num_users, version):
+    from sklearn.model_selection import train_test_split
+
+    df = generate_raw_dataset()
+    train_data, test_data, num_classes = split_dataset(df)
+    train_data, validation_data = train_test_split(train_data, test_size=validation_split, random_state=split_seed)
+    test_set = streaming_dataset(test_data['audio_file'], test_data['label'], num_classes)
+    if model_selection:
+        new_model = search_model(train_data, validation_data, num_classes, version)
+    else:
+        new_model = fit_model(train_data, validation_data, num_classes, version)
+
+    score = new_model.evaluate(test_set, verbose=0)
     print("Model Test set Loss: ", score[0])
     print('Model Test set Accuracy: ', score[1])
 
-    model.save(root_path + model_path + model_name)
+    new_model.save(root_path + model_path + version)
+    NumpyModel.export_model(new_model, root_path + model_path + version + exported_suffix)  # TensorFlow-free copy
+    with open(root_path + model_path + version + feature_params_suffix, 'w') as f:
+        json.dump(feature_params, f)  # Served features must be computed as the model was trained on
+    if inference_engine == 'int8':
+        quantize_version(version)
+    return new_model, score[1]
+
+
+def fit_model(train_data, validation_data, num_classes, version):
+    """Method trains model_config on the training recordings, stopping once the validation loss plateaus
+
+    Args:
+        train_data (DataFrame): The training recordings with their "label" column
+        validation_data (DataFrame): The validation recordings with their "label" column
+        num_classes (int): Number of users
+        version (str): The model version being trained
+
+    Returns:
+        The trained model, holding the weights of the epoch with the lowest validation loss
+    """
+    from keras.callbacks import BackupAndRestore, ModelCheckpoint
+
+    new_model, early_stop = create_model_structure(num_classes)  # Create the model structure, apart from the served one
+    train_set = streaming_dataset(train_data['audio_file'], train_data['label'], num_classes, shuffle=True)
+    validation_set = streaming_dataset(validation_data['audio_file'], validation_data['label'], num_classes)
+
+    backup_dir, best_loss = prepare_training_backup(num_classes)
+    best_weights = backup_dir + best_weights_suffix  # Carried across a resume, unlike the new version
+    callbacks = [BackupAndRestore(backup_dir=backup_dir),  # Resumes an interrupted run, removed once training ends
+                 ModelCheckpoint(best_weights, monitor='val_loss', save_best_only=True, save_weights_only=True,
+                                 initial_value_threshold=best_loss),
+                 record_best_loss(backup_dir + '.json', best_loss), early_stop]
+    if training_budget is not None:
+        callbacks.append(time_budget(training_budget))
+    new_model.fit(train_set, epochs=training_epochs, validation_data=validation_set, callbacks=callbacks)
+    if os.path.isfile(best_weights):  # Stopped on the budget or epoch limit, keep the best validation epoch
+        new_model.load_weights(best_weights)
+        os.remove(best_weights)
+    shutil.rmtree(backup_dir, ignore_errors=True)
+    os.remove(backup_dir + '.json')
+    return new_model
+
+
+def search_model(train_data, validation_data, num_classes, version):
+    """Method selects and trains the best candidate network configuration within the CPU budget of the search.
+
+    Features are computed (or read from the feature store) once and shared by every candidate. The cost and
+    validation accuracy of every candidate are written next to the model version.
+
+    Args:
+        train_data (DataFrame): The training recordings with their "label" column
+        validation_data (DataFrame): The validation recordings with their "label" column
+        num_classes (int): Number of users
+        version (str): The model version being trained
+
+    Returns:
+        The model of the best candidate, holding its trained weights
+    """
+    one_hot = np.eye(num_classes, dtype=np.float32)
+    config, weights, log = ModelSearch.search(recording_features(train_data['audio_file']),
+                                              one_hot[np.asarray(train_data['label'])],
+                                              recording_features(validation_data['audio_file']),
+                                              one_hot[np.asarray(validation_data['label'])], search_cpu_budget)
+    try:
+        new_model, _ = create_model_structure(num_classes, config)
+        new_model.load_weights(weights)
+    finally:
+        shutil.rmtree(os.path.dirname(weights), ignore_errors=True)
+
+    with open(root_path + model_path + version + search_log_suffix, 'w') as f:
+        json.dump({'cpu_budget': search_cpu_budget, 'selected': config, 'candidates': log}, f, indent=2)
+    return new_model
 
 
-def create_model_structure():
-    global model
+def create_model_structure(num_users, config=None):
+    load_tensorflow()
+    from keras.models import Sequential
+    from keras.layers import Dense, Dropout
+    from keras.optimizers import Adam
+    from keras.callbacks import EarlyStopping
+
+    config = model_config if config is None else config
     model = Sequential()  # Initialize model
 
-    model.add(Dense(128, input_shape=(128,), activation='relu'))  # First dense layer
-    model.add(Dropout(0.2))
+    for i, (units, dropout) in enumerate(zip(config['layers'], config['dropout'])):  # Hidden dense layers
+        model.add(Dense(units, input_shape=(128,), activation='relu') if i == 0 else Dense(units, activation='relu'))
+        model.add(Dropout(dropout))
+
+    model.add(Dense(num_users, activation='softmax'))  # Output softmax layer
+
+    model.compile(loss='categorical_crossentropy', metrics=['accuracy'],
+                  optimizer=Adam(learning_rate=config['learning_rate']))  # Model specifications
+    early_stop = EarlyStopping(monitor='val_loss', min_delta=0, patience=early_stopping_patience, verbose=1,
+                               mode='auto', restore_best_weights=True)  # Stop once validation loss plateaus
+    return model, early_stop
+
+
+def prepare_training_backup(num_classes):
+    """Method prepares the checkpoint directory of a training run, keeping the checkpoint of an interrupted run of the
+    same model structure, and its best weights, to resume from.
+
+    Args:
+        num_classes (int): Number of users of the model being trained
+
+    Returns:
+        The path of the checkpoint directory and the lowest validation loss of the kept best weights, None without
+    """
+    backup_dir = root_path + model_path + backup_name
+    marker = backup_dir + '.json'
+    try:
+        with open(marker) as f:
+            state = json.load(f)
+        resumable = state['num_classes'] == num_classes
+    except (FileNotFoundError, ValueError, KeyError):
+        state, resumable = {}, False
+    if resumable and os.path.isdir(backup_dir):
+        print("Resuming interrupted training from its last checkpoint")
+        best_loss = state.get('best_loss') if os.path.isfile(backup_dir + best_weights_suffix) else None
+        return backup_dir, best_loss
+
+    shutil.rmtree(backup_dir, ignore_errors=True)  # A checkpoint of another model structure can not be restored
+    if os.path.isfile(backup_dir + best_weights_suffix):
+        os.remove(backup_dir + best_weights_suffix)
+    with open(marker, 'w') as f:
+        json.dump({'num_classes': num_classes}, f)
+    return backup_dir, None
+
+
+def record_best_loss(marker, best_loss):
+    """Method creates a Keras callback recording the lowest validation loss in the checkpoint marker, so a resumed run
+    only replaces the best weights checkpoint with better weights
+
+    Args:
+        marker (str): Path of the checkpoint marker
+        best_loss (float): Lowest validation loss of the kept best weights, None without
 
-    model.add(Dense(80, activation='relu'))  # Second dense layer
-    model.add(Dropout(0.5))
+    Returns:
+        The Keras callback
+    """
+    from keras.callbacks import Callback
 
-    model.add(Dense(40, activation='relu'))  # Third dense layer
-    model.add(Dropout(0.5))
+    class RecordBestLoss(Callback):
+        def __init__(self):
+            super().__init__()
+            self.best = np.inf if best_loss is None else best_loss
 
-    model.add(Dense(len(user_dict), activation='softmax'))  # Output softmax layer
+        def on_epoch_end(self, epoch, logs=None):
+            loss = (logs or {}).get('val_loss')
+            if loss is None or not loss < self.best:
+                return
+            self.best = float(loss)
+            with open(marker) as f:
+                state = json.load(f)
+            state['best_loss'] = self.best
+            with open(marker + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(marker + '.tmp', marker)
 
-    model.compile(loss='categorical_crossentropy', metrics=['accuracy'], optimizer='adam')  # Model specifications
-    early_stop = EarlyStopping(monitor='loss', min_delta=0, patience=100, verbose=1, mode='auto')  # Early dropout allowed
-    return early_stop
+    return RecordBestLoss()
 
 
-def feature_extraction(x):
-    mel_spec = librosa.feature.melspectrogram(y=x, sr=22050)  # Generate mel spectrogram
-    mel_df = pd.DataFrame(mel_spec)  # Generate dataframe from mel_db
-    feature = np.mean(mel_df.T, axis=0)  # Transpose dataframe and generate mel band mean
-    return feature.to_numpy()  # Convert to numpy vector
+def time_budget(seconds):
+    """Method creates a Keras callback stopping training once the next epoch would exceed a wall-clock budget
+
+    Args:
+        seconds (float): The training budget in seconds
+
+    Returns:
+        The Keras callback
+    """
+    from keras.callbacks import Callback
+
+    class TimeBudget(Callback):
+        def on_train_begin(self, logs=None):
+            self.start = perf_counter()
+            self.completed = 0
+
+        def on_epoch_end(self, epoch, logs=None):
+            elapsed = perf_counter() - self.start
+            self.completed += 1
+            if elapsed + elapsed / self.completed > seconds:  # The next epoch is expected to exceed the budget
+                print(f"Training budget of {seconds}s reached after {elapsed:.0f}s, stopping")
+                self.model.stop_training = True
+
+    return TimeBudget()
+
+
+def feature_extraction(x, params=None):
+    params = served_params if params is None else params
+    return AudioFeatures.mel_band_mean(x, sample_rate, trims(params))  # Generate mel spectrogram band means
 
 
 def load_model():
-    global model
-    model = keras.models.load_model(root_path + model_path + model_name)  # Load the trained model
+    global model, embedding_model, served_params
+    version = read_current_model()
+    new_model, new_embedding_model = read_model(version)  # Load the promoted trained model
+    new_params = version_feature_params(version)
+    with model_lock:
+        model, embedding_model, served_params = new_model, new_embedding_model, new_params
+
+
+def version_feature_params(version):
+    """Method returns the feature extraction parameters a model version was trained on
+
+    Args:
+        version (str): The model version
+
+    Returns:
+        The feature extraction parameters, legacy_feature_params for versions trained before they were recorded
+    """
+    try:
+        with open(root_path + model_path + version + feature_params_suffix) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return legacy_feature_params
+
+
+def trims(params):
+    """Method returns if features of the feature extraction parameters are computed from trimmed audio"""
+    return params.get('trim') is not None
+
+
+def read_model(version):
+    exported_path = root_path + model_path + version + exported_suffix
+    if inference_engine in ('numpy', 'int8'):
+        if not os.path.isfile(exported_path):  # Model trained before exports, export it once
+            keras = load_tensorflow().keras
+            NumpyModel.export_model(keras.models.load_model(root_path + model_path + version), exported_path)
+        if inference_engine == 'int8':
+            quantized_path = root_path + model_path + version + quantized_suffix
+            if not os.path.isfile(quantized_path):  # Quantize once, calibrated on the recorded corpus
+                quantize_version(version)
+            exported_path = quantized_path
+        network = NumpyModel.load_model(exported_path)  # Memory mapped dense weights
+        return network, network.truncated()
+
+    keras = load_tensorflow().keras
+    trained_model = keras.models.load_model(root_path + model_path + version)  # Load the trained model
+    dense_layers = [layer for layer in trained_model.layers if isinstance(layer, keras.layers.Dense)]
+    hidden_layer = dense_layers[-2]  # Last hidden layer
+    extractor = keras.Model(inputs=trained_model.inputs, outputs=hidden_layer.output)  # Frozen embedding extractor
+    return trained_model, extractor
+
+
+def quantize_version(version):
+    """Method quantizes the exported dense weights of a model version to int8, calibrated on features of the recorded
+    corpus, and writes a report comparing the float and quantized model.
+
+    Args:
+        version (str): The model version
+
+    Returns:
+        The quantization report
+    """
+    df = generate_raw_dataset()
+    calibration = df.sample(n=min(calibration_samples, len(df)), random_state=0)  # Reproducible calibration set
+    float_path = root_path + model_path + version + exported_suffix
+    quantized_path = root_path + model_path + version + quantized_suffix
+    params = version_feature_params(version)
+    NumpyModel.quantize_model(NumpyModel.load_model(float_path),
+                              recording_features(calibration['audio_file'], params), quantized_path)
+
+    report = quantization_report(df, float_path, quantized_path, params)
+    report['version'] = version.strip('/')
+    report['calibration_recordings'] = len(calibration)
+    with open(root_path + model_path + version + quantization_report_suffix, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Quantized {version}: accuracy {report['float']['accuracy']:.3f} -> {report['int8']['accuracy']:.3f}, "
+          f"size {report['float']['size_bytes']} -> {report['int8']['size_bytes']} bytes, "
+          f"latency {report['float']['latency_us']:.1f} -> {report['int8']['latency_us']:.1f} us")
+    return report
+
+
+def quantization_report(df, float_path, quantized_path, params=None, repeats=200):
+    """Method compares a float and int8 quantized model on accuracy, model size, load time and per-utterance latency
+
+    Args:
+        df (DataFrame): The recordings, labelled with the user "name"
+        float_path (str): Path of the exported float model
+        quantized_path (str): Path of the exported int8 quantized model
+        params (dict): Feature extraction parameters the model was trained on, defaults to feature_params
+        repeats (int): Number of timed loads and single utterance predictions
+
+    Returns:
+        A dictionary of the measurements of both models, and the fraction of recordings they agree on
+    """
+    users = user_dictionary()
+    labels = {name: label for label, name in users.items()}
+    known = df[df['name'].isin(labels)]
+    known = known.sample(n=min(report_samples, len(known)), random_state=0)
+    features = recording_features(known['audio_file'], params)
+    y_true = known['name'].map(labels).to_numpy()
+    timed_features = features if len(features) else np.zeros((1, AudioFeatures.n_mels), dtype=np.float32)
+
+    report, predictions = dict(), dict()
+    for engine, file_path in (('float', float_path), ('int8', quantized_path)):
+        load_times = []
+        for _ in range(repeats // 10):
+            start = perf_counter()
+            network = NumpyModel.load_model(file_path)
+            load_times.append(perf_counter() - start)
+        latencies = []
+        for i in range(repeats):
+            start = perf_counter()
+            network.predict(timed_features[i % len(timed_features)])
+            latencies.append(perf_counter() - start)
+        predictions[engine] = np.argmax(network.predict(features), axis=1)
+        report[engine] = {'accuracy': float(np.mean(predictions[engine] == y_true)),
+                          'size_bytes': os.path.getsize(file_path),
+                          'load_ms': float(np.median(load_times) * 1e3),
+                          'latency_us': float(np.median(latencies) * 1e6)}
+    report['agreement'] = float(np.mean(predictions['float'] == predictions['int8']))
+    report['evaluation_recordings'] = len(known)
+    return report
+
+
+def read_current_model():
+    try:
+        with open(root_path + model_path + current_model_file) as f:
+            return f.read().strip()
+    except FileNotFoundError:  # No retrained model promoted yet
+        return model_name
+
+
+def write_current_model(version):
+    pointer_path = root_path + model_path + current_model_file
+    with open(pointer_path + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(pointer_path + '.tmp', pointer_path)  # Atomic replacement, never a partially written version
+
+
+def remove_version(version):
+    """Method removes a model version, its directory and the files stored alongside it
+
+    Args:
+        version (str): The model version
+    """
+    shutil.rmtree(root_path + model_path + version, ignore_errors=True)
+    for suffix in (exported_suffix, quantized_suffix, quantization_report_suffix, feature_params_suffix,
+                   search_log_suffix):
+        if os.path.isfile(root_path + model_path + version + suffix):
+            os.remove(root_path + model_path + version + suffix)
+
+
+def prune_versions(promoted):
+    """Method removes the retrained model versions superseded by a promoted version, keeping the retained_versions
+    most recent of them. Versions newer than the promoted one, possibly still training, are left in place
+
+    Args:
+        promoted (str): The promoted model version
+    """
+    superseded = sorted('/' + name for name in os.listdir(root_path + model_path)
+                        if os.path.isdir(root_path + model_path + '/' + name)
+                        and ('/' + name).startswith(version_prefix) and name[len(version_prefix) - 1:].isdigit()
+                        and '/' + name < promoted and '/' + name != model_name)  # Timestamps sort chronologically
+    for version in superseded[:max(len(superseded) - retained_versions, 0)]:
+        remove_version(version)
+        print(f"Removed superseded model {version}")
 
 
 def generate_user_dictionary():
     global user_dict
+    user_dict = user_dictionary()
+
+
+def user_dictionary():
     users = access_user_list()  # Access the stored user list
     user_list = users["user_list"]  # Retrieve a list of current users
     sorted_users = sorted(user_list)  # Sort the list alphabetically
     user_index = range(len(sorted_users))  # Generate a numeric index corresponding to the user label
-    user_dict = dict(zip(user_index, sorted_users))  # Return a dictionary of index: name pairs
+    return dict(zip(user_index, sorted_users))  # Return a dictionary of index: name pairs
 
 
 def write_temp_audio_file(audio):
@@ -140,56 +938,218 @@ def write_temp_audio_file(audio):
     sleep(1)
 
 
-def generate_librosa_audio(x):
-    y, sr = librosa.load(root_path + data_path + "/" + x)
-    return y
+def load_tensorflow():
+    """Method imports TensorFlow on first use, which is only required to train (or convert) a model.
+
+    Returns:
+        The tensorflow module
+    """
+    from silence_tensorflow import silence_tensorflow  # Remove tf hardware optimization INFO messages
+    silence_tensorflow()
+    import tensorflow as tf
+    return tf
+
+
+def prewarm():
+    """Method exercises the prediction path on silence, so the first prediction does not pay the audio library loading
+    cost."""
+    feature_extraction(np.zeros(sample_rate, dtype=np.float32))
+
+
+def decode_audio_data(audio):
+    """Method decodes the raw PCM bytes of a recording into a floating point waveform, without touching the disk.
+
+    The samples are scaled to [-1, 1) in the same manner as librosa.load, and keep the recording sample rate.
+
+    Args:
+        audio (AudioData): The data structure containing the recorded user audio
+
+    Returns:
+        A numpy float32 array of the recording at its own sample rate
+    """
+    raw_data = audio.get_raw_data(convert_width=2)  # 16-bit little-endian PCM (no-op for microphone recordings)
+    return np.frombuffer(raw_data, dtype='<i2').astype(np.float32) / 32768.0  # Scale samples to [-1, 1)
+
+
+def audio_data_feature(audio, params=None):
+    params = served_params if params is None else params
+    return AudioFeatures.mel_band_mean(decode_audio_data(audio), audio.sample_rate, trims(params))  # No resampling
+
+
+def generate_file_features(audio_files, params=None):
+    trim = trims(feature_params if params is None else params)
+    if packed_corpus:  # Slice the recordings out of the memory mapped shards
+        return generate_packed_features(list(audio_files), trim)
+    paths = [root_path + data_path + "/" + x for x in audio_files]
+    if not paths:
+        return np.empty((0, AudioFeatures.n_mels), dtype=np.float32)
+    if parallel_extraction:  # Decode and featurize across worker processes
+        return AudioFeatures.parallel_features(paths, extraction_workers, extraction_chunk_size,
+                                               functools.partial(AudioFeatures.file_features, trim=trim))
+    return AudioFeatures.file_features(paths, trim)
+
+
+def trimming_report(audio_files=None):
+    """Method measures what silence trimming saves on the recorded corpus.
+
+    Reports the audio stored (as 16-bit PCM) and the feature extraction time with and without trimming, the
+    extraction time with trimming including the trimming itself.
+
+    Args:
+        audio_files (list): File names of the recordings to measure, defaults to the whole audio store
+
+    Returns:
+        A dictionary of the measurements
+    """
+    if audio_files is None:
+        audio_files = generate_raw_dataset()['audio_file']
+    report = {'recordings': 0, 'audio_seconds': 0.0, 'trimmed_audio_seconds': 0.0, 'bytes': 0, 'trimmed_bytes': 0,
+              'compute_seconds': 0.0, 'trimmed_compute_seconds': 0.0}
+    for audio_file in audio_files:
+        y, sr = PackedCorpus.load_recording(audio_file)
+        start = perf_counter()
+        AudioFeatures.mel_band_means(y, sr)  # Untrimmed feature
+        untrimmed = perf_counter() - start
+        start = perf_counter()
+        trimmed = VoiceActivity.trim(y, sr)
+        AudioFeatures.mel_band_means(trimmed, sr)
+        report['trimmed_compute_seconds'] += perf_counter() - start
+        report['compute_seconds'] += untrimmed
+        report['recordings'] += 1
+        report['audio_seconds'] += len(y) / sr
+        report['trimmed_audio_seconds'] += len(trimmed) / sr
+        report['bytes'] += 2 * len(y)
+        report['trimmed_bytes'] += 2 * len(trimmed)
+    saved = report['bytes'] - report['trimmed_bytes']
+    print(f"Trimming {report['recordings']} recordings saves {saved / 1e6:.1f} MB "
+          f"({saved / max(report['bytes'], 1):.0%}) and "
+          f"{report['compute_seconds'] - report['trimmed_compute_seconds']:.2f} compute-seconds of feature extraction")
+    return report
+
+
+def generate_packed_features(audio_files, trim=None):
+    if not audio_files:
+        return np.empty((0, AudioFeatures.n_mels), dtype=np.float32)
+    if parallel_extraction:  # Workers read the shards themselves, only the file names are sent to them
+        return AudioFeatures.parallel_features(audio_files, extraction_workers, extraction_chunk_size,
+                                               functools.partial(PackedCorpus.recording_features, trim=trim))
+    return PackedCorpus.recording_features(audio_files, trim)
 
 
 def generate_raw_dataset():
-    df = pd.read_csv(root_path + data_path + '/audio_store.csv')
-    df['audio_librosa'] = df['audio_file'].map(generate_librosa_audio)  # Generate Librosa audio objects
-    df['id'] = df['id'].apply(str)  # Convert id column to string
-    return df
+    return VoiceStorage.read_audio_store()  # Recordings are decoded during feature extraction
 
 
 def generate_final_dataset(df: pd.DataFrame):
-    df['feature_vector'] = df['audio_librosa'].apply(feature_extraction)
-    df = df[['feature_vector', 'name']].copy()
+    df = df.copy()
+    df['feature_vector'] = list(recording_features(df['audio_file']))  # One feature row per recording
+    train_data, test_data, num_classes = split_dataset(df)
 
-    le = preprocessing.LabelEncoder()  # Create user numerical label
-    df['label'] = pd.Series(le.fit_transform(df['name']))  # Generate user labels
-
-    train_data, test_data = train_test_split(df, test_size=0.2)  # Train, test split
     X_train_raw = train_data['feature_vector']
     y_train_raw = train_data['label']
 
-    X_test_raw = train_data['feature_vector']
-    y_test_raw = train_data['label']
+    X_test_raw = test_data['feature_vector']
+    y_test_raw = test_data['label']
 
-    X_train, y_train = tensor_features(X_train_raw, y_train_raw)
-    X_test, y_test = tensor_features(X_test_raw, y_test_raw)
+    X_train, y_train = tensor_features(X_train_raw, y_train_raw, num_classes)
+    X_test, y_test = tensor_features(X_test_raw, y_test_raw, num_classes)
     return X_train, y_train, X_test, y_test
 
 
-def tensor_features(X_data_raw, y_data_raw):
+def split_dataset(df: pd.DataFrame):
+    """Method labels the recordings with their user's numeric label and splits them into a train and test set
+
+    Args:
+        df (DataFrame): The recordings, containing the user "name" of every recording
+
+    Returns:
+        The train and test recordings, each with an added "label" column, and the number of classes
+    """
+    from sklearn import preprocessing
+    from sklearn.model_selection import train_test_split
+
+    df = df.reset_index(drop=True)
+    le = preprocessing.LabelEncoder()  # Create user numerical label
+    df['label'] = le.fit_transform(df['name'])  # Generate user labels
+
+    train_data, test_data = train_test_split(df, test_size=0.2, random_state=split_seed)  # Train, test split
+    return train_data, test_data, len(le.classes_)
+
+
+def streaming_dataset(audio_files, labels, num_classes, shuffle=False):
+    """Method generates a streaming dataset of the features and one-hot labels of recordings, to be fed to model.fit.
+
+    Recordings are decoded and featurized feature_batch_size at a time, so the memory used during training is bounded
+    by the configured batch, shuffle buffer and prefetch sizes instead of by the recorded audio. With the feature store,
+    missing features are computed once, after which every epoch streams them from the memory mapped store.
+
+    Args:
+        audio_files (Series): File names of the recordings within the voice data folder
+        labels (Series): Numeric user labels of the recordings
+        num_classes (int): Number of users
+        shuffle (bool): Shuffle the recordings every epoch
+
+    Returns:
+        A tf.data.Dataset of (features, labels) batches
+    """
+    tf = load_tensorflow()
+    audio_files = np.asarray(audio_files)
+    labels = np.asarray(labels)
+    features, rows = None, None
+    if use_feature_store:  # Rows of a snapshot of the store, unaffected by later appends and compactions
+        features, rows = FeatureStore.feature_rows(audio_files, generate_file_features, feature_params,
+                                                   feature_batch_size)
+
+    def feature_batches():
+        order = np.random.permutation(len(audio_files)) if shuffle else np.arange(len(audio_files))
+        for start in range(0, len(order), feature_batch_size):
+            batch = order[start:start + feature_batch_size]
+            if use_feature_store:
+                batch_features = np.asarray(features[rows[batch]])  # Reads only the rows of the batch
+            else:
+                batch_features = generate_file_features(audio_files[batch])
+            yield batch_features, np.eye(num_classes, dtype=np.float32)[labels[batch]]  # One-hot-encode labels
+
+    signature = (tf.TensorSpec(shape=(None, AudioFeatures.n_mels), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None, num_classes), dtype=tf.float32))
+    dataset = tf.data.Dataset.from_generator(feature_batches, output_signature=signature).unbatch()
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer)
+    batches = -(-len(audio_files) // training_batch_size)  # Known batch count, as the generator length is unknown
+    dataset = dataset.batch(training_batch_size).apply(tf.data.experimental.assert_cardinality(batches))
+    return dataset.prefetch(prefetch_batches)
+
+
+def tensor_features(X_data_raw, y_data_raw, num_classes):
+    tf = load_tensorflow()
+    from keras.utils import to_categorical
+
     x_expanded = pd.DataFrame(X_data_raw.tolist())  # Expand feature vector into a dataframe
     x_data = tf.convert_to_tensor(x_expanded)  # Convert dataframe to tensor
 
-    le = preprocessing.LabelEncoder()  # Create label encoder object (One-hot-encoding)
-    y_data = to_categorical(le.fit_transform(y_data_raw))  # One-hot-encode labels
+    y_data = to_categorical(y_data_raw, num_classes=num_classes)  # One-hot-encode labels
     return x_data, y_data
 
 
 def determine_retraining_requirement():
-    df = generate_raw_dataset()
-    df['date_time'] = pd.to_datetime(df['id'], format='%Y%m%d%H%M%S')
-    last_date = df.tail(1)['date_time'].to_list()
+    if serving_state()[4] != feature_params:  # Served features differ from those new models are trained on
+        print("Re-training model in the background, the served model was trained on other features: \n")
+        retrain_model(background=True)
+        return
+    manifest = VoiceStorage.read_manifest()  # Constant time, the audio store itself is not read
+    if manifest is None:  # Audio store recorded before the manifest existed
+        manifest = VoiceStorage.rebuild_manifest()
+    latest = manifest['latest_recording']
+    watermark = manifest['training_watermark']
+    if latest is None or (watermark is not None and latest <= watermark):  # No recordings since the last training
+        return
+    last_date = datetime.strptime(latest[:14], '%Y%m%d%H%M%S')  # Ids may carry microseconds
     current_date = datetime.now()
 
-    difference = current_date - last_date[0]
+    difference = current_date - last_date
     if difference.days >= 1:
-        print("Re-training model: \n")
-        train_model()
+        print("Re-training model in the background: \n")
+        retrain_model(background=True)
 
 
 
@@ -1,7 +1,28 @@
 import Config
+import atexit
+import io
+import json
 import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
+import numpy as np
 import pandas as pd
+import soundfile
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a single assistant process is expected
+    fcntl = None
+
+import src.voice.AudioStoreDatabase as AudioStoreDatabase
+import src.voice.FeatureStore as FeatureStore
+import src.voice.PackedCorpus as PackedCorpus
+import src.voice.VoiceActivity as VoiceActivity
 
 ## System Level ##
 root_path = Config.root_dir()
@@ -10,127 +31,715 @@ data_path = '/data/voice/'
 """str: path from project root to voice data"""
 DEBUG = False
 """bool: Boolean flag indicating if debug is active, in order to not write data to storage"""
+trim_silence = True
+"""bool: Boolean flag indicating if leading, trailing and long internal silences are trimmed before storing recordings"""
+audio_format = 'wav'
+"""str: File format of stored recordings, 'wav' or 'flac' (lossless, about half the size)"""
+packed_storage = False
+"""bool: Boolean flag indicating if recordings are appended to the packed corpus instead of written as .wav files"""
+store_backend = 'csv'
+"""str: Storage backend of the audio store, 'csv' (audio_store.csv) or 'sqlite' (indexed database, see
+AudioStoreDatabase)"""
 
 ## Audio Level ##
-identifier = ''
-"""int: Voice recording id"""
-file_name = ''
-"""str: File name of voice recording"""
-name = ''
-"""str: Name of the speaker"""
-transcript = ''
-"""str: Transcript of the voice recording"""
-command = None
-"""Enum: Type of skill executed by Kurt"""
-passive_active = 'Passive'
-"""str: Indicator if recording was collected through passive listening or active engagement with Kurt"""
-file_path = ''
-"""str: The complete file path leading to the written audio recording"""
 store_name = 'audio_store.csv'
 """string: Name of csv storage of voice recording file names, transcripts and labels"""
+manifest_name = 'manifest.json'
+"""string: Name of the manifest summarizing the audio store: latest recording, per-user counts and training watermark"""
+manifest_lock = threading.Lock()
+"""Lock: Lock serializing manifest updates from the assistant and the background retraining thread"""
+manifest_keys = ['latest_recording', 'recordings', 'user_counts', 'user_seen', 'stored_bytes', 'training_watermark']
+"""list: Keys of the manifest, a manifest missing any of them is rebuilt"""
+user_sample_budget = None
+"""int: Maximum number of recordings retained per user, kept as a uniform sample of all their recordings through
+reservoir sampling. None retains every recording"""
+disk_quota = None
+"""int: Maximum size (bytes) of the stored recordings, evicting the oldest passive recordings first. None sets no
+quota"""
+protected_recordings = ['Bootstrap']
+"""list: Listening types of recordings never evicted, being the registration recordings of a user"""
+reservoir = random.Random()
+"""Random: Random number generator of the reservoir sampling"""
+store_columns = ['id', 'audio_file', 'transcript', 'name', 'command', 'passive_active']
+"""list: Columns of the audio store"""
+commit_batch_size = 32
+"""int: Maximum number of recordings written and appended to the audio store in one group commit"""
+commit_delay = 0.05
+"""float: Seconds the recording writer waits for further recordings to join a group commit"""
+last_id = 0
+"""int: Capture time (microseconds since the epoch) of the latest recording id issued by this process"""
+id_lock = threading.Lock()
+"""Lock: Lock ensuring recording ids are issued strictly increasing"""
+corpus_readers = 0
+"""int: Number of running readers of the stored recordings, such as a background retrain"""
+deferred_removals = []
+"""list: File names of evicted recordings whose removal from disk waits until no reader is running"""
+readers_lock = threading.Lock()
+"""Lock: Lock guarding the reader count and the deferred removals"""
+store_lock = threading.RLock()
+"""RLock: Lock serializing appends to the audio store with its rewrites within the process, which would otherwise drop
+appended rows"""
+store_lock_name = 'audio_store.lock'
+"""str: Name of the lock file serializing appends to the audio store with its rewrites across processes, such as the
+assistant and the FLAC migration"""
+store_lock_file = None
+"""file: The open audio store lock file while the process holds the audio store lock, None otherwise"""
+readers_lock_name = 'recordings.lock'
+"""str: Name of the lock file held shared by every process reading the stored recordings, and exclusively by a process
+removing recording files it did not evict itself"""
+readers_file = None
+"""file: The open readers lock file while recordings are read by this process, None otherwise"""
+
 
 
+@dataclass(frozen=True)
+class Recording:
+    """This class is an immutable recording captured during a conversation turn, awaiting storage.
 
-def generate_audio_file(audio_input):
-    """Method saves the recorded audio into a .wav file for training purposes.
+    Args:
+        audio (AudioData): The data structure containing the recorded user audio
+        transcript (str): Transcript of the voice recording
+        name (str): Name of the speaker
+        passive_active (str): Indicator if the recording was collected through passive listening or active engagement
+        command (str): Type of skill executed by Kurt, None when no skill was executed
+        identifier (str): Voice recording id, the time of capture
+        file_name (str): File name the recording is stored under
+    """
+    audio: object
+    transcript: str
+    name: str
+    passive_active: str
+    command: str
+    identifier: str
+    file_name: str
 
-    The audio recording is given a unique identifier corresponding to the time of creation.
+    def row(self):
+        """Method returns the audio store row of the recording, ordered as store_columns"""
+        return [self.identifier, self.file_name, self.transcript, self.name, self.command, self.passive_active]
+
+
+def capture_recording(audio, transcript, name, passive_active, command=None):
+    """Method captures a recording with its labels, assigning its id and file name from the time of capture
 
     Args:
-        audio_input (AudioData): The data structure containing the recorder user audio
+        audio (AudioData): The data structure containing the recorded user audio
+        transcript (str): Transcript of the voice recording
+        name (str): Name of the speaker
+        passive_active (str): "Passive", "Active" or "Bootstrap" listening type
+        command (str): Type of skill executed by Kurt
+
+    Returns:
+        The Recording
+    """
+    identifier = recording_id()  # Generate unique identifier for audio file
+    return Recording(audio, transcript, name, passive_active, command, identifier,
+                     identifier + '_voice' + "." + audio_format)
+
+
+def recording_id():
+    """Method issues a unique recording id, being the capture time to the microsecond followed by the process id.
+
+    Ids are strictly increasing within the process, so recordings captured within the same microsecond do not collide,
+    and they sort after the second resolution ids of earlier recordings of the same second. The process id keeps the
+    ids of assistant processes capturing at the same time apart.
+
+    Returns:
+        The id as a 'YYYYmmddHHMMSSffffff_pid' string
+    """
+    global last_id
+    with id_lock:
+        last_id = max(time.time_ns() // 1000, last_id + 1)
+        seconds, microseconds = divmod(last_id, 1000000)
+    return datetime.fromtimestamp(seconds).strftime('%Y%m%d%H%M%S') + f'{microseconds:06d}_{os.getpid()}'
+
+
+class RecordingWriter:
+    """This class stores recordings in a background thread, keeping disk I/O off the conversation thread.
+
+    Recordings handed to the writer are group committed: up to commit_batch_size recordings arriving within
+    commit_delay of each other have their audio written and their rows appended to the audio store with a single
+    flush, followed by one manifest update and disk quota check.
+    """
+
+    def __init__(self):
+        self.recordings = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, recording):
+        """Method hands a recording to the writer, starting the writer thread on first use
+
+        Args:
+            recording (Recording): The captured recording
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='recording-writer', daemon=True)
+                self.thread.start()
+        self.recordings.put(recording)
+
+    def flush(self):
+        """Method blocks until every recording handed to the writer is stored"""
+        self.recordings.join()
+
+    def close(self):
+        """Method stores the remaining recordings and stops the writer thread"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                return
+            self.recordings.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.recordings.get()]
+            while len(batch) < commit_batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.recordings.get(timeout=commit_delay))  # Join the group commit
+                except queue.Empty:
+                    break
+            running = batch[-1] is not None
+            recordings = [recording for recording in batch if recording is not None]
+            try:
+                if recordings:
+                    commit_recordings(recordings)
+            except Exception as error:  # Keep storing later recordings
+                print(f"Failed to store {len(recordings)} recordings: {error}")
+            finally:
+                for _ in batch:
+                    self.recordings.task_done()
+
+
+@contextmanager
+def reading_recordings():
+    """Method marks a running reader of the stored recordings, such as a retrain. Recordings evicted meanwhile leave the
+    audio store at once, but are only removed from disk once no reader is running
+    """
+    global corpus_readers, readers_file
+    with readers_lock:
+        if corpus_readers == 0 and fcntl is not None:  # Shared with the readers of other processes
+            readers_file = open(root_path + data_path + readers_lock_name, 'a')
+            fcntl.flock(readers_file, fcntl.LOCK_SH)
+        corpus_readers += 1
+    try:
+        yield
+    finally:
+        with readers_lock:
+            corpus_readers -= 1
+            if corpus_readers == 0 and readers_file is not None:
+                readers_file.close()  # Releases the lock
+                readers_file = None
+        if corpus_readers == 0:
+            remove_deferred_recordings()
+
+
+def other_readers():
+    """Method checks if another process reads the stored recordings, the caller not reading recordings itself
+
+    Returns:
+        True if another process holds the readers lock file
+    """
+    if fcntl is None:
+        return False
+    with open(root_path + data_path + readers_lock_name, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)  # Released when the file is closed
+        except BlockingIOError:
+            return True
+    return False
+
+
+@contextmanager
+def removing_recordings():
+    """Method waits until no process reads the stored recordings, and holds them off while recording files are removed
+    by another process than the one that evicted them, such as the FLAC migration. Never used while the calling process
+    reads recordings itself
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(root_path + data_path + readers_lock_name, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+        yield
+
+
+def remove_deferred_recordings():
+    """Method removes the evicted recordings whose removal was deferred while recordings were read"""
+    with readers_lock:
+        audio_files = deferred_removals[:]
+        deferred_removals.clear()
+    remove_recording_files(audio_files)
+
+
+writer = RecordingWriter()
+"""RecordingWriter: The background writer of the captured recordings"""
+atexit.register(remove_deferred_recordings)  # Runs after the writer is drained, at exit no reader remains
+atexit.register(writer.close)  # Drain the captured recordings on shutdown
+
+
+def store_recording(recording):
+    """Method hands a captured recording to the background writer
+
+    Args:
+        recording (Recording): The captured recording
     """
-    global identifier, file_name, file_path
     if not DEBUG:
-        current_time = datetime.now()  # Generate unique identifier for audion file
-        identifier = current_time.strftime('%Y%m%d%H%M%S')
-        file_name = identifier + '_voice' + ".wav"
-        file_path = root_path + data_path + file_name
+        writer.submit(recording)
 
-        with open(file_path, 'wb') as f:
-            f.write(audio_input.get_wav_data())
-        return identifier
 
+def flush_recordings():
+    """Method blocks until every captured recording is stored, before recordings are read back"""
+    writer.flush()
 
-def retrieve_transcript(query):
-    """Method to retrieve the query transcript from Kurt's flow of execution
+
+@contextmanager
+def updating_audio_store():
+    """Method stores the captured recordings, then holds the audio store lock while the audio store is read and
+    rewritten. Recordings committed meanwhile are appended once the rewrite is done, rather than lost
+    """
+    flush_recordings()  # Before locking, the writer takes the lock to commit
+    with locked_audio_store():
+        yield
+
+
+@contextmanager
+def locked_audio_store():
+    """Method holds the audio store lock, exclusive to one thread of one process. The lock is re-entrant within the
+    thread holding it
+    """
+    global store_lock_file
+    with store_lock:
+        if store_lock_file is not None:
+            yield
+            return
+        with open(root_path + data_path + store_lock_name, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+            store_lock_file = f
+            try:
+                yield
+            finally:
+                store_lock_file = None
+
+
+def commit_recordings(recordings):
+    """Method stores a batch of recordings in one group commit.
+
+    Recordings are admitted to their speaker's sample budget, trimmed and written as audio files, or appended to the
+    packed corpus at once with packed storage. Their rows are appended to the audio store with a single flush.
 
     Args:
-        query (str): Speech to text result.
+        recordings (list): The captured recordings
     """
-    global transcript
-    transcript = query
+    admitted, pending = [], dict()
+    for recording in recordings:  # Recordings admitted earlier in the group count towards their user's budget
+        if admit_recording(recording.name, recording.passive_active, pending.get(recording.name, 0)):
+            admitted.append(recording)
+            pending[recording.name] = pending.get(recording.name, 0) + 1
+    recordings = admitted
+    if not recordings:  # None sampled into their user's retained recordings
+        return
+    trimmed = [VoiceActivity.trim_audio(recording.audio) if trim_silence else recording.audio
+               for recording in recordings]
+    if packed_storage:
+        data = [audio.get_raw_data(convert_width=2) for audio in trimmed]  # 16-bit PCM at the capture rate
+        PackedCorpus.append_recordings([(recording.file_name, np.frombuffer(pcm, dtype=PackedCorpus.sample_dtype),
+                                         audio.sample_rate)
+                                        for recording, pcm, audio in zip(recordings, data, trimmed)])
+    else:
+        data = [encode_audio(audio) for audio in trimmed]
+        written = [write_recording_file(recording.file_name, audio_data)
+                   for recording, audio_data in zip(recordings, data)]  # Never overwrites a stored recording
+        recordings, trimmed, data = [[x for x, stored in zip(items, written) if stored]
+                                     for items in (recordings, trimmed, data)]
+        if not recordings:
+            return
+    FeatureStore.commit_staged_features([(recording.audio, recording.file_name,
+                                          audio_data if stores_exactly(recording.audio, audio) else None)
+                                         for recording, audio, audio_data in zip(recordings, trimmed, data)])
+
+    df = pd.DataFrame(data=[recording.row() for recording in recordings], columns=store_columns)
+    df.set_index('id', inplace=True)
+    rejected = write_audio_store(df)
+    if rejected and not packed_storage:  # Files created exclusively above, so they belong to the rejected recordings
+        remove_recording_files(list(df.loc[rejected, 'audio_file']))
+    enforce_disk_quota()
 
 
-def retrieve_user_name(user):
-    """Method to retrieve the user's name after identification in Kurt's flow of execution
+def write_recording_file(audio_file, data):
+    """Method writes a new recording file, leaving an existing file of the same name in place
 
     Args:
-        user (str): The user's name.
+        audio_file (str): File name of the recording within the voice data folder
+        data (bytes): The encoded recording
+
+    Returns:
+        True if the file was written, False if a recording of that name was already stored
     """
-    global name
-    name = user
+    try:
+        with open(root_path + data_path + audio_file, 'xb') as f:  # Created exclusively
+            f.write(data)
+    except FileExistsError:
+        print(f"Recording {audio_file} already stored, the new recording is discarded")
+        return False
+    return True
 
 
-def retrieve_command(skill):
-    """Method to retrieve the type of skill executed by Kurt
+def stores_exactly(audio, stored):
+    """Method checks if a recording is stored with exactly the recorded samples, so that a feature computed from the
+    recorded audio describes the stored recording
 
     Args:
-        skill (Enum): The type of skill executed in order to answer the user's query
+        audio (AudioData): The recorded user audio
+        stored (AudioData): The audio written to storage, such as the trimmed recording
+
+    Returns:
+        True if the stored recording decodes to the recorded samples
     """
-    global command
-    command = skill
+    if (stored.sample_rate, stored.sample_width) != (audio.sample_rate, audio.sample_width):
+        return False
+    if (packed_storage or audio_format == 'flac') and audio.sample_width != 2:  # Stored as 16-bit samples
+        return False
+    return stored is audio or stored.get_raw_data() == audio.get_raw_data()
 
 
-def passive_active_flag(listening_type):
-    """Method to retrieve the type of listening method utilized by Kurt
+def encode_audio(audio):
+    """Method encodes a recording in the configured audio file format
 
-    Listening is passive or active.
-    Passive listening allows Kurt to learn from conversations happening in the immediate environment, but not interacting
-    directly with Kurt. Whereas Active listening involves recording only when Kurt is directly queried
+    Args:
+        audio (AudioData): The data structure containing the recorded user audio
+
+    Returns:
+        The bytes of the audio file
+    """
+    if audio_format == 'flac':
+        samples = np.frombuffer(audio.get_raw_data(convert_width=2), dtype='<i2')
+        buffer = io.BytesIO()
+        soundfile.write(buffer, samples, audio.sample_rate, format='FLAC', subtype='PCM_16')
+        return buffer.getvalue()
+    return audio.get_wav_data()
+
+
+def write_audio_store(df):
+    """Method appends recordings to the audio store with a single flush (or transaction), and adds them to the
+    manifest
 
     Args:
-        listening_type (str): String is either "Passive" or "Active" representing the listening type
+        df (DataFrame): Dataframe containing values of associated audio recordings, indexed by id
+
+    Returns:
+        The ids of recordings left out, as they collide with a stored recording
     """
-    global passive_active
-    passive_active = listening_type
+    rejected = []
+    with locked_audio_store():
+        if store_backend == 'sqlite':
+            rejected = AudioStoreDatabase.insert(df)
+            df = df.drop(rejected)
+        else:
+            store_path = root_path + data_path + store_name
+            audio_store_exists = os.path.isfile(store_path)
+            with open(store_path, 'a', newline='') as f:
+                df.to_csv(f, index=True, header=not audio_store_exists)
+                f.flush()
+                os.fsync(f.fileno())  # The group of recordings is stored once appended
+    if len(df):
+        update_manifest(df)
+    return rejected
 
 
-def save_audio():
-    """Method performs the steps to record the information pertaining to all recorded audio files within a cvs.
+def read_manifest():
+    """Method reads the manifest of the audio store
 
-    This csv offers simple conversion into a DataFrame for manipulation and use in training the voice classification model.
+    Returns:
+        A dictionary of the latest recording id, the recording count, per-user counts of retained and of all recordings
+        seen, the size of the stored recordings and the training watermark. None when no manifest has been written
+        yet, or when it predates any of these entries
     """
-    if not DEBUG:
-        df = generate_df()  # Generate the recording DataFrame
-        write_audio_store(df)  # Write the recording into
+    try:
+        with open(root_path + data_path + manifest_name) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if all(key in manifest for key in manifest_keys) else None
 
 
-def generate_df():
-    """Method generates a dataframe from the collected associated audio recording values
+def write_manifest(manifest):
+    """Method writes the manifest of the audio store, replacing the previous manifest atomically
+
+    Args:
+        manifest (dict): The manifest of the audio store
+    """
+    manifest_path = root_path + data_path + manifest_name
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)  # Never a partially written manifest
+
+
+def rebuild_manifest():
+    """Method rebuilds the manifest from the audio store csv, reading only its id and name columns.
+
+    Used once for audio stores recorded before the manifest existed, keeping any recorded training watermark and
+    counts of recordings seen.
 
     Returns:
-        A DataFrame representing the associated values of the audio recording
+        The rebuilt manifest
     """
-    data = [[identifier, file_name, transcript, name, command, passive_active]]
-    columns = ['id', 'audio_file', 'transcript', 'name', 'command', 'passive_active']
-    df = pd.DataFrame(data=data, columns=columns)
-    df.set_index('id', inplace=True)
-    return df
+    with manifest_lock:
+        try:
+            with open(root_path + data_path + manifest_name) as f:
+                previous = json.load(f)
+        except FileNotFoundError:
+            previous = dict()
+        manifest = {'latest_recording': None, 'recordings': 0, 'user_counts': dict(), 'user_seen': dict(),
+                    'stored_bytes': 0, 'training_watermark': previous.get('training_watermark')}
+        if audio_store_exists():
+            df = read_audio_store(['id', 'audio_file', 'name'])
+            manifest['latest_recording'] = df['id'].max() if len(df) else None
+            manifest['recordings'] = len(df)
+            manifest['user_counts'] = {str(user): int(count) for user, count in df['name'].value_counts().items()}
+            manifest['stored_bytes'] = sum(recording_size(audio_file) for audio_file in df['audio_file'])
+        seen = previous.get('user_seen', dict())
+        manifest['user_seen'] = {user: max(count, seen.get(user, 0)) for user, count in manifest['user_counts'].items()}
+        write_manifest(manifest)
+    return manifest
 
 
-def write_audio_store(df):
-    """Method writes the generated df to the csv file audio_store.csv
+def update_manifest(df):
+    """Method adds newly stored recordings to the manifest
 
     Args:
-        df (DataFrame): Dataframe containing values of associated audio recording
+        df (DataFrame): Dataframe of the recordings appended to the audio store, indexed by id
     """
-    store_path = root_path + data_path + store_name
-    audio_store_exists = os.path.isfile(store_path)
-    if audio_store_exists:
-        df.to_csv(store_path, mode='a', index=True, header=False)
-    else:
-        df.to_csv(store_path, mode='w', index=True, header=True)
+    if read_manifest() is None:  # First manifest, summarizing the whole audio store including the new recordings
+        rebuild_manifest()
+        return
+    with manifest_lock:
+        manifest = read_manifest()
+        latest = str(max(df.index.astype(str)))
+        if manifest['latest_recording'] is None or latest > manifest['latest_recording']:  # Ids are sortable times
+            manifest['latest_recording'] = latest
+        manifest['recordings'] += len(df)
+        manifest['stored_bytes'] += sum(recording_size(audio_file) for audio_file in df['audio_file'])
+        for user in df['name'].astype(str):
+            manifest['user_counts'][user] = manifest['user_counts'].get(user, 0) + 1
+            manifest['user_seen'][user] = max(manifest['user_seen'].get(user, 0), manifest['user_counts'][user])
+        write_manifest(manifest)
+
+
+def write_training_watermark(watermark):
+    """Method records the latest recording included in the promoted model's training data
+
+    Args:
+        watermark (str): Id of the latest recording the model was trained on
+    """
+    if read_manifest() is None:
+        rebuild_manifest()
+    with manifest_lock:
+        manifest = read_manifest()
+        manifest['training_watermark'] = watermark
+        write_manifest(manifest)
+
+
+def recording_size(audio_file):
+    """Method returns the size of a stored recording, being its file or its samples in the packed corpus
+
+    Args:
+        audio_file (str): File name of the recording
+
+    Returns:
+        The size of the recording in bytes, 0 when it is not stored
+    """
+    file_path = root_path + data_path + audio_file
+    if os.path.isfile(file_path):
+        return os.path.getsize(file_path)
+    entry = PackedCorpus.current_index().get(audio_file)
+    return entry[2] * PackedCorpus.sample_dtype.itemsize if entry else 0
+
+
+def admit_recording(user, listening_type, pending=0):
+    """Method decides through reservoir sampling if a new recording of a user is retained.
+
+    Every recording seen is counted. Once a user holds user_sample_budget recordings, the n-th recording seen replaces a
+    random evictable recording of the user with probability budget / n, and is discarded otherwise, so the retained
+    recordings remain a uniform sample of all the user's recordings.
+
+    Args:
+        user (str): Name of the speaker
+        listening_type (str): Listening type of the recording, protected types are always admitted
+        pending (int): Number of recordings of the user admitted but not stored yet, within the same group commit
+
+    Returns:
+        True if the recording is to be stored
+    """
+    if read_manifest() is None:
+        rebuild_manifest()
+    with manifest_lock:
+        manifest = read_manifest()
+        seen = manifest['user_seen'].get(user, 0) + 1
+        manifest['user_seen'][user] = seen
+        write_manifest(manifest)
+    retained = manifest['user_counts'].get(user, 0) + pending
+    if user_sample_budget is None or listening_type in protected_recordings or retained < user_sample_budget:
+        return True
+    if reservoir.randrange(seen) >= user_sample_budget:
+        return False
+
+    if not audio_store_exists():  # Nothing stored yet, so no recording to evict
+        return False
+    df = read_audio_store(['audio_file', 'passive_active'], name=user)
+    candidates = df[~df['passive_active'].isin(protected_recordings)]['audio_file']
+    if len(candidates) == 0:  # Only protected recordings retained
+        return False
+    excess = min(len(candidates), retained - user_sample_budget + 1)  # Also shrinks a lowered budget
+    evict_recordings(candidates.sample(n=excess, random_state=reservoir.randrange(2 ** 32)))
+    return True
+
+
+def audio_store_exists():
+    """Method returns if any recording has been stored"""
+    if store_backend == 'sqlite':
+        return os.path.isfile(AudioStoreDatabase.database_file()) or os.path.isfile(root_path + data_path + store_name)
+    return os.path.isfile(root_path + data_path + store_name)
+
+
+def read_audio_store(columns=None, name=None, since=None):
+    """Method reads the audio store, keeping ids and empty fields as stored
+
+    Args:
+        columns (list): Columns to read, defaults to all columns
+        name (str): Only read the recordings of this speaker
+        since (str): Only read recordings with a later id, such as the training watermark
+
+    Returns:
+        A DataFrame of the stored recordings
+    """
+    if store_backend == 'sqlite':  # Filtered through the database indexes
+        return AudioStoreDatabase.select(columns, name, since)
+    df = pd.read_csv(root_path + data_path + store_name, dtype=str, keep_default_na=False)
+    if name is not None:
+        df = df[df['name'] == name]
+    if since is not None:
+        df = df[df['id'] > since]
+    return df if columns is None else df[columns]
+
+
+def recording_counts(since=None):
+    """Method counts the stored recordings of every speaker
+
+    Args:
+        since (str): Only count recordings with a later id, such as the training watermark
+
+    Returns:
+        A dictionary of name: recording count pairs
+    """
+    if store_backend == 'sqlite':
+        return AudioStoreDatabase.counts(since)
+    df = read_audio_store(['id', 'name'], since=since)
+    return {str(user): int(count) for user, count in df['name'].value_counts().items()}
+
+
+def replace_audio_store(df):
+    """Method rewrites the audio store, replacing the previous audio store atomically
+
+    Args:
+        df (DataFrame): The complete audio store, as read by read_audio_store
+    """
+    with locked_audio_store():
+        if store_backend == 'sqlite':
+            AudioStoreDatabase.replace(df)
+            return
+        store_path = root_path + data_path + store_name
+        df.to_csv(store_path + '.tmp', index=False)
+        os.replace(store_path + '.tmp', store_path)  # Never a partially written audio store
+
+
+def delete_from_audio_store(audio_files):
+    """Method removes recordings from the audio store
+
+    Args:
+        audio_files (list): File names of the recordings
+    """
+    if store_backend == 'sqlite':
+        AudioStoreDatabase.delete(audio_files)
+        return
+    with locked_audio_store():  # No recording appended between reading and rewriting the audio store
+        df = read_audio_store()
+        replace_audio_store(df[~df['audio_file'].isin(audio_files)])
+
+
+def evict_recordings(audio_files):
+    """Method prunes recordings from the audio store and from disk, updating the manifest. While recordings are read,
+    such as by a background retrain or by another process, their removal from disk is deferred until the readers are
+    done
+
+    Args:
+        audio_files (iterable): File names of the recordings to evict
+    """
+    audio_files = set(audio_files)
+    if not audio_files:
+        return
+    df = read_audio_store(['audio_file', 'name'])
+    evicted = df[df['audio_file'].isin(audio_files)]
+    sizes = {audio_file: recording_size(audio_file) for audio_file in evicted['audio_file']}
+    delete_from_audio_store(list(evicted['audio_file']))
+    with readers_lock:
+        if corpus_readers or other_readers():  # Removed once the readers are done
+            deferred_removals.extend(evicted['audio_file'])
+            removed = []
+        else:  # Including removals deferred while another process read recordings
+            removed = deferred_removals[:] + list(evicted['audio_file'])
+            deferred_removals.clear()
+    remove_recording_files(removed)
+
+    with manifest_lock:
+        manifest = read_manifest()
+        manifest['recordings'] -= len(evicted)
+        manifest['stored_bytes'] -= sum(sizes.values())
+        for user in evicted['name']:
+            manifest['user_counts'][user] = manifest['user_counts'].get(user, 1) - 1
+        write_manifest(manifest)
+    print(f"Evicted {len(evicted)} recordings ({sum(sizes.values()) / 1e6:.1f} MB)")
+
+
+def remove_recording_files(audio_files):
+    """Method removes recordings from disk, being their files or their samples in the packed corpus, along with their
+    cached features
+
+    Args:
+        audio_files (list): File names of the recordings
+    """
+    if not audio_files:
+        return
+    for audio_file in audio_files:
+        if os.path.isfile(root_path + data_path + audio_file):
+            os.remove(root_path + data_path + audio_file)
+    PackedCorpus.remove_recordings(audio_files)
+    FeatureStore.remove_recordings(audio_files)
+
+
+def enforce_disk_quota():
+    """Method evicts recordings while the stored recordings exceed the disk quota.
+
+    The oldest passive recordings are evicted first, followed by the oldest active recordings. Protected recordings are
+    never evicted.
+    """
+    manifest = read_manifest()
+    if disk_quota is None or manifest is None or manifest['stored_bytes'] <= disk_quota:
+        return
+    df = read_audio_store(['id', 'audio_file', 'passive_active'])
+    candidates = df[~df['passive_active'].isin(protected_recordings)].copy()
+    candidates['active'] = candidates['passive_active'] != 'Passive'
+    candidates = candidates.sort_values(['active', 'id'])  # Passive before active, oldest first
 
-    global passive_active, command
-    passive_active = 'Passive'
-    command = None
+    excess = manifest['stored_bytes'] - disk_quota
+    evicted = []
+    for audio_file in candidates['audio_file']:
+        if excess <= 0:
+            break
+        evicted.append(audio_file)
+        excess -= recording_size(audio_file)
+    if excess > 0:
+        print("Disk quota exceeded by protected recordings only")
+    evict_recordings(evicted)